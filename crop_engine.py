@@ -0,0 +1,82 @@
+# Batched cropping of windows around cells, used by script_cropfilm.py.
+#
+# Each frame is decoded once into a numpy array and all requested windows are extracted from it with a single
+# gather. Windows have a fixed size: parts falling outside the image are padded, so that all crops have the same
+# shape whatever the position of the cell.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+from collections import namedtuple
+import numpy as np
+from PIL import Image
+
+
+# Decoded image: pixel array, PIL mode and palette (None if mode is not 'P')
+Frame = namedtuple('Frame', ['array', 'mode', 'palette'])
+
+
+def image_array(im):
+    """Pixels of a PIL Image. The pages of a multi-page TIFF are the channels, giving an array of shape (H, W, pages).
+
+    Raise ValueError for multi-page images whose pages are not single-channel.
+    """
+    n_pages = getattr(im, 'n_frames', 1)
+    if n_pages == 1:
+        return np.asarray(im)
+    pages = []
+    for k in range(n_pages):
+        im.seek(k)
+        pages.append(np.asarray(im))
+        if pages[-1].ndim != 2:
+            raise ValueError('Pages of multi-page images must be single-channel, page ' + str(k) + ' is ' + im.mode)
+    im.seek(0)
+    return np.stack(pages, axis=-1)
+
+
+def load_frame(imfile):
+    """Decode an image file into a Frame. Works with 16-bit images, and multi-page TIFF (see image_array)."""
+    im = Image.open(imfile)
+    palette = im.getpalette() if im.mode == 'P' else None
+    return Frame(array=image_array(im), mode=im.mode, palette=palette)
+
+
+def crop_windows(arr, centers, size, fill=0):
+    """Extract fixed-size windows around several centers of an image array.
+
+    Args:
+        arr (numpy array): Image of shape (H, W) or (H, W, C).
+        centers (list of 2-tuple of int): Centers (x, y) of the windows, x is the image column and y the image row.
+        size (4-tuple of int): Extent of the windows left, right, top and bottom of the center. The window around
+        (x, y) covers columns [x-left, x+right) and rows [y-top, y+bottom).
+        fill (optional): Value of the pixels outside the image. Defaults to 0.
+    Returns:
+        A numpy array of shape (len(centers), top+bottom, left+right) + arr.shape[2:].
+
+    """
+    crop_l, crop_r, crop_t, crop_b = size
+    h, w = arr.shape[:2]
+    centers = np.asarray(centers, dtype=np.int64).reshape(-1, 2)
+    # Rows and columns to gather for each window, shape (n, top+bottom) and (n, left+right)
+    rows = centers[:, 1, None] + np.arange(-crop_t, crop_b)
+    cols = centers[:, 0, None] + np.arange(-crop_l, crop_r)
+    # Gather from the clipped indices and overwrite pixels out of the image afterwards
+    windows = arr[np.clip(rows, 0, h - 1)[:, :, None], np.clip(cols, 0, w - 1)[:, None, :]]
+    outside = ((rows < 0) | (rows >= h))[:, :, None] | ((cols < 0) | (cols >= w))[:, None, :]
+    windows[outside] = fill
+    return windows
+
+
+def window_to_image(window, frame):
+    """Convert a window extracted from frame back to a PIL Image with the mode and palette of the frame.
+
+    Raise ValueError for windows with no PIL equivalent (e.g. several 16-bit channels), to be scaled to 8 bits first
+    (see display.DisplayScaling) or written as npy.
+    """
+    if window.ndim == 3 and (window.dtype != np.uint8 or window.shape[2] not in (3, 4)):
+        raise ValueError('Cannot write a window of ' + str(window.shape[2]) + ' channels of type ' + str(window.dtype) +
+                         ' as an image. Scale it to 8 bits or write it as npy.')
+    im = Image.fromarray(window)
+    if frame.palette is not None:
+        im.putpalette(frame.palette)
+    return im
@@ -0,0 +1,182 @@
+# Long-running process serving crop and overlay requests on a local Unix socket, see script_daemon.py.
+#
+# A single call of script_cropfilm.py or script_overlay_cfg.py spends most of its time starting Python, importing
+# numpy and Pillow, loading the font and parsing the tracks table, before touching the few frames actually requested.
+# The daemon pays these costs once and keeps in memory:
+#  - the parsed tracks tables (with their per-track and spatial indexes), reloaded when the .csv file changes,
+#  - the fonts and the cache of rendered labels,
+#  - an LRU cache of decoded frames (frame_stack.FrameCache), checked against the files at each access.
+# Requests are JSON objects on one line: {"command": ..., "argv": [...], "cwd": ...}, where argv are the command line
+# arguments of the script and cwd the directory they are relative to. The answer is a JSON object on one line with the
+# exit status, the printed output and the elapsed time. Requests are served one at a time: scripts change the current
+# directory and share the caches.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, io, json, time, socket, threading, traceback, socketserver
+from collections import OrderedDict
+from contextlib import redirect_stdout, redirect_stderr
+from PIL import ImageFont
+from label_cache import DEFAULT_FONT
+from track_table import load_track_table, csv_fingerprint
+from frame_stack import open_frame_source, CachedFrameSource, FrameCache
+import overlay_engine
+import script_cropfilm
+import script_overlay_cfg
+
+COMMANDS = ('crop', 'overlay', 'stats', 'ping', 'shutdown')
+
+
+class Daemon:
+    """State kept between requests and dispatch of the requests.
+
+    Args:
+        max_frames (int, optional): Maximum number of decoded frames kept in memory. Defaults to 256.
+        max_tables (int, optional): Maximum number of tracks tables kept in memory. Defaults to 16.
+        font (str, optional): Path of the TrueType font of the overlays. Defaults to DEFAULT_FONT.
+        font_size (int, optional): Size of the font. Defaults to 10.
+    """
+
+    def __init__(self, max_frames=256, max_tables=16, font=DEFAULT_FONT, font_size=10):
+        self.frames = FrameCache(max_frames)
+        self.max_tables = max_tables
+        self.tables = OrderedDict()
+        self.font = ImageFont.truetype(font=font, size=font_size)
+        self.started = time.time()
+        self.n_requests = 0
+        self.table_hits = 0
+        self.table_misses = 0
+        self.running = True
+        # Overlays run in this process decode their frames through the cache
+        overlay_engine.set_frame_cache(self.frames)
+
+    def load_tracks(self, csvfi, time_col, id_col, xpos_col, ypos_col, use_cache=True, rebuild=False):
+        """Same as track_table.load_track_table, tables already loaded are reused while the .csv file is unchanged."""
+        key = (os.path.abspath(csvfi), time_col, id_col, xpos_col, ypos_col)
+        fingerprint = csv_fingerprint(csvfi)
+        entry = self.tables.get(key)
+        if entry is not None and entry[0] == fingerprint and not rebuild:
+            self.tables.move_to_end(key)
+            self.table_hits += 1
+            return entry[1]
+        self.table_misses += 1
+        table = load_track_table(csvfi, time_col, id_col, xpos_col, ypos_col, use_cache=use_cache, rebuild=rebuild)
+        self.tables[key] = (fingerprint, table)
+        self.tables.move_to_end(key)
+        while len(self.tables) > self.max_tables:
+            self.tables.popitem(last=False)
+        return table
+
+    def open_source(self, in_im, ext='png'):
+        """Same as frame_stack.open_frame_source, decoded frames are kept in the frame cache."""
+        return CachedFrameSource(open_frame_source(in_im, ext), self.frames)
+
+    def stats(self):
+        """Counters of the caches."""
+        return {'uptime': round(time.time() - self.started, 1), 'requests': self.n_requests,
+                'frames': len(self.frames), 'frame_hits': self.frames.hits, 'frame_misses': self.frames.misses,
+                'tables': len(self.tables), 'table_hits': self.table_hits, 'table_misses': self.table_misses}
+
+    def _run(self, command, argv):
+        """Run a script command, return its exit status."""
+        if command == 'crop':
+            args = script_cropfilm.parseArguments_crop(argv)
+            script_cropfilm.run_cropfilm(args, load_tracks=self.load_tracks, open_source=self.open_source)
+            return 0
+        args = script_overlay_cfg.parseArguments_overlay_cfg(argv)
+        failed = script_overlay_cfg.run_overlay_cfg(args, self.font, load_tracks=self.load_tracks,
+                                                    open_source=self.open_source)
+        return 1 if failed else 0
+
+    def handle(self, request):
+        """Serve one request.
+
+        Args:
+            request (dict): {"command": one of COMMANDS, "argv": list of str, "cwd": str}.
+        Returns:
+            A dictionary {"status": exit status, "output": printed text, "elapsed": seconds}, plus "stats" for the
+            'stats' command.
+
+        """
+        start = time.time()
+        self.n_requests += 1
+        command = request.get('command')
+        answer = {'status': 0, 'output': ''}
+        if command not in COMMANDS:
+            answer.update(status=2, output='Unknown command: ' + str(command) + '. Expected one of: ' +
+                          ', '.join(COMMANDS) + '\n')
+        elif command == 'stats':
+            answer['stats'] = self.stats()
+        elif command == 'shutdown':
+            self.running = False
+        elif command in ('crop', 'overlay'):
+            out = io.StringIO()
+            cwd = os.getcwd()
+            try:
+                os.chdir(request.get('cwd', cwd))
+                with redirect_stdout(out), redirect_stderr(out):
+                    try:
+                        answer['status'] = self._run(command, list(request.get('argv', [])))
+                    except SystemExit as e:
+                        # argparse errors and --help
+                        answer['status'] = e.code if isinstance(e.code, int) else 1
+                    except Exception:
+                        traceback.print_exc()
+                        answer['status'] = 1
+            finally:
+                os.chdir(cwd)
+            answer['output'] = out.getvalue()
+        answer['elapsed'] = round(time.time() - start, 4)
+        return answer
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            answer = self.server.daemon.handle(request)
+        except Exception:
+            answer = {'status': 1, 'output': traceback.format_exc()}
+        self.wfile.write((json.dumps(answer) + '\n').encode('utf-8'))
+        if not self.server.daemon.running:
+            # shutdown() waits for serve_forever() to return, call it from another thread
+            threading.Thread(target=self.server.shutdown).start()
+
+
+def is_listening(socket_path):
+    """Whether a daemon answers on socket_path."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        client.close()
+
+
+def serve(socket_path, **kwargs):
+    """Serve requests on a Unix socket until a 'shutdown' request.
+
+    Args:
+        socket_path (str): Path of the socket. A stale socket file left by a previous daemon is removed.
+        **kwargs: Arguments of Daemon.
+    Raises:
+        RuntimeError if a daemon is already listening on socket_path.
+
+    """
+    if os.path.exists(socket_path):
+        if is_listening(socket_path):
+            raise RuntimeError('A daemon is already listening on: ' + socket_path)
+        os.remove(socket_path)
+    server = socketserver.UnixStreamServer(socket_path, _RequestHandler)
+    server.daemon = Daemon(**kwargs)
+    print('Listening on: ' + socket_path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+    print('Daemon stopped after ' + str(server.daemon.n_requests) + ' request(s).')
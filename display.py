@@ -0,0 +1,228 @@
+# Display scaling of raw microscopy frames (16-bit, multi-channel) to 8-bit images that can be annotated and viewed.
+#
+# Each channel is mapped linearly from a display range [low, high] to [0, 255]. The range is either fixed or taken at
+# percentiles of the intensities: percentiles are computed once per stack, from the histogram of a sample of frames,
+# and the same range is used for every frame (no flickering, no per-frame statistics). Unsigned integer images are
+# scaled through a lookup table built once (a single gather per pixel), float images arithmetically. Several channels
+# are merged into an RGB image with one pseudocolor per channel, added and clipped at 255.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import numpy as np
+from PIL import Image
+from frame_stack import is_frame_stack
+
+COLORS = {'gray': (255, 255, 255), 'red': (255, 0, 0), 'green': (0, 255, 0), 'blue': (0, 0, 255),
+          'cyan': (0, 255, 255), 'magenta': (255, 0, 255), 'yellow': (255, 255, 0)}
+# Pseudocolors of the channels when none is given, single channel images stay grayscale
+DEFAULT_COLORS = ('red', 'green', 'blue', 'magenta', 'cyan', 'yellow', 'gray')
+DEFAULT_PERCENTILES = (0.1, 99.9)
+# Largest unsigned integer type scaled through a lookup table (65536 entries)
+_MAX_LUT_BITS = 16
+
+# Lookup tables by scaling and channel, shared by all DisplayScaling of a process: scalings are sent to worker
+# processes with each frame, their tables are built once per worker
+_luts = {}
+_MAX_LUTS = 64
+
+
+def is_drawable(frame):
+    """Whether a frame (crop_engine.Frame) can be annotated as it is: 8-bit grayscale, RGB or palette image."""
+    if frame.array.dtype != np.uint8:
+        return False
+    if frame.array.ndim == 2:
+        return frame.mode in ('L', 'P')
+    return frame.mode == 'RGB' and frame.array.shape[2] == 3
+
+
+def source_is_drawable(source):
+    """Whether the frames of a source (see frame_stack.open_frame_source) can be annotated as they are, judged on the
+    first frame. Image files are judged on their header, without decoding the pixels."""
+    image = source.frames[0][1]
+    if is_frame_stack(source.path):
+        # A view of the memory map, nothing is decoded
+        return is_drawable(source.load(image))
+    with source.image(image) as im:
+        # Same test as is_drawable: 'L', 'P' and 'RGB' images decode to 8-bit arrays, multi-page images to channels
+        return getattr(im, 'n_frames', 1) == 1 and im.mode in ('L', 'P', 'RGB')
+
+
+def channel_count(arr):
+    """Number of channels of an image of shape (H, W) or (H, W, C)."""
+    return 1 if arr.ndim == 2 else arr.shape[2]
+
+
+def _uses_lut(dtype):
+    return dtype.kind == 'u' and dtype.itemsize * 8 <= _MAX_LUT_BITS
+
+
+def stack_percentiles(arrays, percentiles=DEFAULT_PERCENTILES, max_pixels=1000000):
+    """Percentiles of the intensities of each channel over several frames.
+
+    Args:
+        arrays (iterable of numpy array): Frames of shape (H, W) or (H, W, C), all with the same number of channels.
+        percentiles (2-tuple of float, optional): Lower and upper percentiles, between 0 and 100. Defaults to
+        DEFAULT_PERCENTILES.
+        max_pixels (int, optional): For float images, pixels of each frame are subsampled to at most this number.
+        Unsigned integer images are counted exhaustively in a histogram. Defaults to 1000000.
+    Returns:
+        A 2-tuple of numpy arrays (low, high) of shape (C,).
+
+    """
+    counts, samples = None, []
+    for arr in arrays:
+        arr = np.asarray(arr)
+        pixels = arr.reshape(-1, channel_count(arr))
+        if _uses_lut(arr.dtype):
+            levels = 1 << (arr.dtype.itemsize * 8)
+            frame_counts = np.stack([np.bincount(pixels[:, c], minlength=levels) for c in range(pixels.shape[1])])
+            counts = frame_counts if counts is None else counts + frame_counts
+        else:
+            step = max(1, len(pixels) // max_pixels)
+            samples.append(pixels[::step].astype(np.float64))
+    if counts is not None:
+        # Percentile = first level whose cumulative count reaches the given fraction of the pixels
+        cdf = np.cumsum(counts, axis=1)
+        bounds = []
+        for p in percentiles:
+            target = cdf[:, -1] * (p / 100)
+            bounds.append(np.array([np.searchsorted(cdf[c], target[c]) for c in range(len(cdf))], dtype=np.float64))
+        return bounds[0], bounds[1]
+    if not samples:
+        raise ValueError('No frame to compute percentiles from.')
+    pixels = np.concatenate(samples)
+    low, high = np.nanpercentile(pixels, percentiles, axis=0)
+    return low, high
+
+
+class DisplayScaling:
+    """Linear contrast of each channel and pseudocolor merge of the channels.
+
+    Args:
+        low, high (list of float): Display range of each channel: low and below are black, high and above are full
+        intensity.
+        colors (list of str, optional): Pseudocolor of each channel, among COLORS. By default, a single channel stays
+        grayscale and several channels get DEFAULT_COLORS.
+    Attributes:
+        mode (str): PIL mode of the scaled images, 'L' for a single gray channel, 'RGB' otherwise.
+    """
+
+    def __init__(self, low, high, colors=None):
+        self.low = np.asarray(low, dtype=np.float64).reshape(-1)
+        self.high = np.asarray(high, dtype=np.float64).reshape(-1)
+        if len(self.low) != len(self.high):
+            raise ValueError('Display range needs as many low as high values.')
+        if colors is None:
+            colors = ['gray'] if len(self.low) == 1 else DEFAULT_COLORS[:len(self.low)]
+        if len(colors) != len(self.low):
+            raise ValueError('Expected one color per channel (' + str(len(self.low)) + '), got: ' + ' '.join(colors))
+        for color in colors:
+            if color not in COLORS:
+                raise ValueError('Unknown color: ' + str(color) + '. Expected one of: ' + ', '.join(COLORS))
+        self.colors = list(colors)
+        self.mode = 'L' if self.colors == ['gray'] else 'RGB'
+
+    def __len__(self):
+        return len(self.low)
+
+    def params(self):
+        """Description of the scaling, recorded in manifests of incremental runs."""
+        return {'low': self.low.tolist(), 'high': self.high.tolist(), 'colors': self.colors}
+
+    def _scale(self, values, c):
+        """Map values of channel c to [0, 255] as float."""
+        span = self.high[c] - self.low[c]
+        if span <= 0:
+            return np.where(values > self.low[c], 255.0, 0.0)
+        return np.clip((values - self.low[c]) * (255.0 / span), 0, 255)
+
+    def _lut(self, c, dtype):
+        """Lookup table from the pixel values of channel c to its pseudocolor, shape (levels,) or (levels, 3)."""
+        key = (self.low[c], self.high[c], self.colors[c], self.mode, dtype.itemsize)
+        lut = _luts.get(key)
+        if lut is None:
+            if len(_luts) >= _MAX_LUTS:
+                _luts.clear()
+            scaled = self._scale(np.arange(1 << (dtype.itemsize * 8), dtype=np.float64), c)
+            if self.mode == 'L':
+                lut = np.rint(scaled).astype(np.uint8)
+            else:
+                lut = np.rint(scaled[:, None] * (np.array(COLORS[self.colors[c]]) / 255.0)).astype(np.uint8)
+            _luts[key] = lut
+        return lut
+
+    def apply(self, arr):
+        """Scale raw pixels to 8 bits.
+
+        Args:
+            arr (numpy array): Pixels with the channels on the last axis if there are several, e.g. a frame of shape
+            (H, W[, C]) or a batch of windows of shape (n, h, w[, C]).
+        Returns:
+            A uint8 numpy array, same shape without the channel axis if mode is 'L', channel axis of size 3 if 'RGB'.
+
+        """
+        arr = np.asarray(arr)
+        n = len(self)
+        if n > 1 and arr.shape[-1] != n:
+            raise ValueError('Image has ' + str(arr.shape[-1]) + ' channels, display scaling expects ' + str(n) + '.')
+        channels = [arr] if n == 1 else [arr[..., c] for c in range(n)]
+        lut = _uses_lut(arr.dtype)
+        if self.mode == 'L':
+            if lut:
+                return self._lut(0, arr.dtype)[arr]
+            return np.rint(self._scale(arr.astype(np.float64), 0)).astype(np.uint8)
+        out = np.zeros(channels[0].shape + (3,), dtype=np.uint16)
+        for c, values in enumerate(channels):
+            if lut:
+                out += self._lut(c, arr.dtype)[values]
+            else:
+                color = np.array(COLORS[self.colors[c]]) / 255.0
+                out += np.rint(self._scale(values.astype(np.float64), c)[..., None] * color).astype(np.uint16)
+        return np.minimum(out, 255).astype(np.uint8)
+
+    def to_image(self, arr):
+        """Scaled PIL Image of a frame of shape (H, W[, C])."""
+        return Image.fromarray(self.apply(arr), mode=self.mode)
+
+
+def display_for_source(source, display_range=None, percentiles=None, colors=None, n_samples=16, auto=True):
+    """Display scaling of the frames of a source from the command line options.
+
+    Args:
+        source (FrameStack or PngFolder): Frames, see frame_stack.open_frame_source.
+        display_range (list of float, optional): Fixed range: low high for all channels, or one pair per channel.
+        percentiles (2-tuple of float, optional): Range taken at these percentiles of the intensities of each channel,
+        computed once over n_samples frames evenly spread in the stack.
+        colors (list of str, optional): Pseudocolor of each channel, see DisplayScaling.
+        n_samples (int, optional): Number of frames sampled to compute the percentiles. Defaults to 16.
+        auto (bool, optional): If no option is given, use DEFAULT_PERCENTILES for frames that cannot be annotated as
+        they are (16-bit, multi-channel...). Defaults to True.
+    Returns:
+        A DisplayScaling, or None if no option is given and the frames are used as they are (also when there is no
+        frame). Raise ValueError for palette images, whose pixels are indices and not intensities, or if an option is
+        given and there is no frame to scale.
+
+    """
+    if display_range is None and percentiles is None and colors is None:
+        if not auto or not source.frames or source_is_drawable(source):
+            return None
+        percentiles = DEFAULT_PERCENTILES
+    elif not source.frames:
+        raise ValueError('No frame found in: ' + str(source.path))
+    first = source.load(source.frames[0][1])
+    if first.mode == 'P':
+        raise ValueError('Display scaling does not apply to palette ("P") images.')
+    n = channel_count(first.array)
+    if display_range is not None:
+        if len(display_range) not in (2, 2 * n):
+            raise ValueError('Display range must be 2 values (low high) or 2 values per channel (' + str(2 * n) + ').')
+        pairs = np.resize(np.asarray(display_range, dtype=np.float64), 2 * n).reshape(n, 2)
+        low, high = pairs[:, 0], pairs[:, 1]
+    else:
+        percentiles = DEFAULT_PERCENTILES if percentiles is None else percentiles
+        picks = np.unique(np.linspace(0, len(source.frames) - 1, min(n_samples, len(source.frames))).astype(int))
+        # The first pick is always the first frame, already decoded
+        low, high = stack_percentiles((first.array if i == 0 else source.load(source.frames[i][1]).array
+                                       for i in picks), percentiles)
+    return DisplayScaling(low, high, colors)
@@ -0,0 +1,89 @@
+# Encoding of the images written by the overlay and crop scripts.
+#
+# PNG with Pillow's default zlib level is often most of the cost of writing a preview. The format and its settings can
+# be chosen per deployment:
+#  - 'png': lossless, compress_level from 0 (no compression, fastest) to 9 (smallest). Pillow's default is 6.
+#  - 'tiff': lossless, uncompressed.
+#  - 'jpeg': lossy, quality from 1 to 95, for previews.
+#  - 'npy': raw pixels as a numpy array, no encoding at all.
+# benchmark_encodings measures the time/size tradeoff on a sample of frames, see script_encoding_bench.py.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import io, os, time
+import numpy as np
+
+FRAME_FORMATS = ('png', 'tiff', 'jpeg', 'npy')
+FRAME_EXTENSIONS = {'png': '.png', 'tiff': '.tif', 'jpeg': '.jpg', 'npy': '.npy'}
+
+
+def replace_extension(path, frame_format):
+    """Give path the extension of frame_format."""
+    return os.path.splitext(path)[0] + FRAME_EXTENSIONS[frame_format]
+
+
+def save_options(frame_format='png', compress_level=None, quality=None):
+    """Keyword arguments of Image.save for a format, None values are left to Pillow's defaults."""
+    if frame_format not in FRAME_FORMATS:
+        raise ValueError('Unknown frame format: ' + str(frame_format) + '. Expected one of: ' + ', '.join(FRAME_FORMATS))
+    if frame_format == 'png':
+        return {'format': 'PNG'} if compress_level is None else {'format': 'PNG', 'compress_level': compress_level}
+    elif frame_format == 'tiff':
+        return {'format': 'TIFF', 'compression': 'raw'}
+    elif frame_format == 'jpeg':
+        return {'format': 'JPEG'} if quality is None else {'format': 'JPEG', 'quality': quality}
+    return {'format': 'npy'}
+
+
+def save_image(im, path, frame_format='png', compress_level=None, quality=None):
+    """Write a PIL Image (or file object) with the chosen encoding.
+
+    Args:
+        im (Image): Image to write.
+        path (str or file object): Destination. Its extension is not changed, see replace_extension.
+        frame_format (str, optional): One of FRAME_FORMATS. Defaults to 'png'.
+        compress_level (int, optional): zlib level for 'png', 0-9. Defaults to Pillow's default.
+        quality (int, optional): Quality for 'jpeg', 1-95. Defaults to Pillow's default.
+    Returns:
+        None
+
+    """
+    options = save_options(frame_format, compress_level, quality)
+    if options['format'] == 'npy':
+        np.save(path, np.asarray(im))
+        return
+    if options['format'] == 'JPEG' and im.mode == 'P':
+        im = im.convert('RGB')
+    im.save(path, **options)
+
+
+def benchmark_encodings(images, settings, repeat=1):
+    """Time the encoding of sample images with several settings, in memory (disk speed is not included).
+
+    Args:
+        images (list of Image): Sample frames.
+        settings (list of dict): Keyword arguments of save_image (without im and path), e.g. {'frame_format': 'png',
+        'compress_level': 1}.
+        repeat (int, optional): Number of times each image is encoded, the fastest time is kept. Defaults to 1.
+    Returns:
+        A list of dictionaries, one per setting, with the setting and the mean time (ms) and size (kB) per frame.
+
+    """
+    for im in images:
+        im.load()
+    results = []
+    for setting in settings:
+        seconds, size = 0, 0
+        for im in images:
+            best = None
+            for _ in range(repeat):
+                buffer = io.BytesIO()
+                start = time.perf_counter()
+                save_image(im, buffer, **setting)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            seconds += best
+            size += buffer.tell()
+        results.append(dict(setting, ms_per_frame=1000 * seconds / len(images), kb_per_frame=size / 1024 / len(images)))
+    return results
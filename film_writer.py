@@ -0,0 +1,386 @@
+# Streaming writers gathering the successive crops of a track into a single file.
+#
+# Frames are written as soon as they are produced, a film is never held in memory:
+#  - 'tiff': multi-page TIFF, one page per frame.
+#  - 'npy': numpy array of shape (T, H, W[, C]) filled through a memory map, which downstream analysis can open with
+#    numpy.load(..., mmap_mode='r'). A .json sidecar records the time of each frame and the image mode/palette.
+#  - 'apng', 'gif', 'avi' (MJPEG): animated films played at a given frame rate, for viewing. Each frame is encoded alone
+#    by Pillow (PNG, GIF or JPEG) and its compressed data is appended to the container, whose header is completed when
+#    the film is closed. Frames can thus be encoded in worker processes and written in order by the main process, see
+#    overlay_engine.iter_overlay_results.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, io, json, zlib, struct
+import numpy as np
+from PIL import Image, TiffImagePlugin
+from crop_engine import window_to_image
+
+FILM_FORMATS = ('tiff', 'npy', 'apng', 'gif', 'avi')
+FILM_EXTENSIONS = {'tiff': '.tif', 'npy': '.npy', 'apng': '.png', 'gif': '.gif', 'avi': '.avi'}
+# Films played at a frame rate, written from frames encoded one by one (encode_film_frame)
+ANIMATED_FORMATS = ('apng', 'gif', 'avi')
+DEFAULT_FPS = 10
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class TiffFilmWriter:
+    """Append frames as pages of a multi-page TIFF file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._tf = TiffImagePlugin.AppendingTiffWriter(path, True)
+
+    def append(self, window, frame):
+        """Write a window cropped from frame (crop_engine.Frame) as the next page."""
+        window_to_image(window, frame).save(self._tf, format='TIFF')
+        self._tf.newFrame()
+
+    def close(self):
+        self._tf.close()
+
+    def abort(self):
+        """Close and delete the incomplete film, e.g. after an error."""
+        self._tf.close()
+        _remove(self.path)
+
+
+class NpyFilmWriter:
+    """Write frames in a preallocated .npy stack of shape (len(times),) + frame_shape.
+
+    Args:
+        path (str): Path of the .npy file.
+        times (list): Time of each frame of the film, in order of writing.
+        frame_shape (tuple): Shape of one frame, (H, W) or (H, W, C).
+        dtype: Type of the pixels.
+        mode (str, optional): PIL mode of the frames, recorded in the sidecar. Defaults to None.
+        palette (list, optional): Palette of 'P' frames, recorded in the sidecar. Defaults to None.
+    """
+
+    def __init__(self, path, times, frame_shape, dtype, mode=None, palette=None):
+        self.path = path
+        self._stack = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(len(times),) + tuple(frame_shape))
+        self._next = 0
+        with open(path[:-len('.npy')] + '.json', 'w') as f:
+            json.dump({'times': [str(t) for t in times], 'mode': mode, 'palette': palette}, f)
+
+    def append(self, window, frame):
+        """Write a window cropped from frame (crop_engine.Frame) as the next frame."""
+        self._stack[self._next] = window
+        self._next += 1
+
+    def close(self):
+        self._stack.flush()
+        del self._stack
+
+    def abort(self):
+        """Delete the incomplete film and its sidecar, e.g. after an error."""
+        del self._stack
+        _remove(self.path)
+        _remove(self.path[:-len('.npy')] + '.json')
+
+
+def encode_film_frame(im, film_format, quality=None, compress_level=None):
+    """Encode one frame of an animated film.
+
+    Args:
+        im (Image): Frame. 'apng' accepts all modes of PNG, 'gif' and 'avi' need 8-bit images ('L', 'RGB' or 'P').
+        film_format (str): One of ANIMATED_FORMATS.
+        quality (int, optional): JPEG quality of 'avi' frames, 1-95. Defaults to Pillow's default (75).
+        compress_level (int, optional): zlib level of 'apng' frames, 0-9. Defaults to Pillow's default (6).
+    Returns:
+        The frame encoded as a PNG ('apng'), GIF ('gif') or JPEG ('avi') file, as bytes.
+
+    """
+    if film_format not in ANIMATED_FORMATS:
+        raise ValueError('Unknown animated film format: ' + str(film_format) + '. Expected one of: ' +
+                         ', '.join(ANIMATED_FORMATS))
+    if film_format != 'apng' and im.mode not in ('L', 'RGB', 'P'):
+        raise ValueError('Frames of ' + film_format + ' films must be 8-bit images, got mode ' + im.mode +
+                         '. Scale raw frames with a display range.')
+    buffer = io.BytesIO()
+    if film_format == 'apng':
+        im.save(buffer, format='PNG', **({} if compress_level is None else {'compress_level': compress_level}))
+    elif film_format == 'gif':
+        im.save(buffer, format='GIF')
+    else:
+        if im.mode == 'P':
+            im = im.convert('RGB')
+        im.save(buffer, format='JPEG', **({} if quality is None else {'quality': quality}))
+    return buffer.getvalue()
+
+
+class _AnimatedFilmWriter:
+    """Common part of the writers of animated films: frames encoded with encode_film_frame are appended in order.
+
+    Args:
+        path (str): Path of the film, created at the first frame.
+        fps (float, optional): Frame rate. Defaults to DEFAULT_FPS.
+        quality, compress_level: Encoding of the frames appended with append, see encode_film_frame.
+    """
+
+    FORMAT = None
+
+    def __init__(self, path, fps=DEFAULT_FPS, quality=None, compress_level=None):
+        if fps <= 0:
+            raise ValueError('Frame rate must be positive.')
+        self.path = path
+        self.format = self.FORMAT
+        self.fps = fps
+        self.quality = quality
+        self.compress_level = compress_level
+        self.n_frames = 0
+        self._f = None
+
+    def append(self, window, frame):
+        """Encode and write a window cropped from frame (crop_engine.Frame) as the next frame."""
+        self.append_image(window_to_image(window, frame))
+
+    def append_image(self, im):
+        """Encode and write a PIL Image as the next frame."""
+        self.append_encoded(encode_film_frame(im, self.format, quality=self.quality,
+                                              compress_level=self.compress_level))
+
+    def append_encoded(self, data):
+        """Write a frame already encoded with encode_film_frame as the next frame."""
+        if self._f is None:
+            self._f = open(self.path, 'wb')
+            self._start(data)
+        self._write(data)
+        self.n_frames += 1
+
+    def close(self):
+        """Complete the headers and close the file. Nothing is written if no frame was appended."""
+        if self._f is not None:
+            self._finish()
+            self._f.close()
+            self._f = None
+
+    def abort(self):
+        """Delete the incomplete film, e.g. after an error. Its headers were not completed."""
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+            _remove(self.path)
+
+
+def _png_chunks(data):
+    """(type, content) of the chunks of a PNG file."""
+    pos = 8
+    while pos < len(data):
+        length, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        yield kind, data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+
+
+def _png_chunk(kind, content):
+    return struct.pack('>I', len(content)) + kind + content + struct.pack('>I', zlib.crc32(kind + content))
+
+
+class ApngFilmWriter(_AnimatedFilmWriter):
+    """Animated PNG: the IDAT data of each PNG frame becomes a frame of the animation (fcTL + fdAT chunks). All frames
+    must have the same size and mode, and the same palette for 'P' frames."""
+
+    FORMAT = 'apng'
+
+    def _start(self, data):
+        chunks = dict(_png_chunks(data))
+        self._header = (chunks[b'IHDR'], chunks.get(b'PLTE'), chunks.get(b'tRNS'))
+        self._f.write(b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', chunks[b'IHDR']))
+        # Number of frames, completed by close
+        self._actl = self._f.tell()
+        self._f.write(_png_chunk(b'acTL', struct.pack('>II', 0, 0)))
+        for kind in (b'PLTE', b'tRNS'):
+            if kind in chunks:
+                self._f.write(_png_chunk(kind, chunks[kind]))
+        self._sequence = 0
+        # Delay between frames as a fraction of seconds, in milliseconds
+        self._delay = max(1, min(65535, int(round(1000 / self.fps))))
+
+    def _write(self, data):
+        chunks = list(_png_chunks(data))
+        header = dict(chunks)
+        if (header[b'IHDR'], header.get(b'PLTE'), header.get(b'tRNS')) != self._header:
+            raise ValueError('All frames of an APNG film must have the same size, mode and palette.')
+        width, height = struct.unpack('>II', header[b'IHDR'][:8])
+        self._f.write(_png_chunk(b'fcTL', struct.pack('>IIIIIHHBB', self._sequence, width, height, 0, 0,
+                                                      self._delay, 1000, 0, 0)))
+        self._sequence += 1
+        for kind, content in chunks:
+            if kind != b'IDAT':
+                continue
+            if self.n_frames == 0:
+                # The first frame is also the default image, shown by viewers without APNG support
+                self._f.write(_png_chunk(b'IDAT', content))
+            else:
+                self._f.write(_png_chunk(b'fdAT', struct.pack('>I', self._sequence) + content))
+                self._sequence += 1
+
+    def _finish(self):
+        self._f.write(_png_chunk(b'IEND', b''))
+        self._f.seek(self._actl)
+        self._f.write(_png_chunk(b'acTL', struct.pack('>II', self.n_frames, 0)))
+
+
+def _gif_frame(data):
+    """Split a single-frame GIF file into (logical screen descriptor, color table, image descriptor, image data)."""
+    screen = data[6:13]
+    flags = screen[4]
+    pos = 13
+    table = b''
+    if flags & 0x80:
+        table = data[pos:pos + 3 * (2 << (flags & 0x07))]
+        pos += len(table)
+    # Skip the extensions written by Pillow
+    while data[pos] == 0x21:
+        pos += 2
+        while data[pos]:
+            pos += data[pos] + 1
+        pos += 1
+    if data[pos] != 0x2C:
+        raise ValueError('Unexpected GIF block: ' + hex(data[pos]))
+    descriptor = data[pos:pos + 10]
+    pos += 10
+    if descriptor[9] & 0x80:
+        table = data[pos:pos + 3 * (2 << (descriptor[9] & 0x07))]
+        pos += len(table)
+    # LZW minimum code size and data sub-blocks, up to the terminator
+    start = pos
+    pos += 1
+    while data[pos]:
+        pos += data[pos] + 1
+    return screen, table, descriptor, data[start:pos + 1]
+
+
+class GifFilmWriter(_AnimatedFilmWriter):
+    """Animated GIF looping forever. Each frame keeps the palette chosen by Pillow for it, as a local color table."""
+
+    FORMAT = 'gif'
+
+    def _start(self, data):
+        screen = _gif_frame(data)[0]
+        self._size = screen[:4]
+        # No global color table, keep the color resolution
+        self._f.write(b'GIF89a' + self._size + bytes([screen[4] & 0x70, 0, 0]))
+        self._f.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00')
+        # Delay between frames in hundredths of seconds
+        self._delay = max(1, min(65535, int(round(100 / self.fps))))
+
+    def _write(self, data):
+        screen, table, descriptor, image = _gif_frame(data)
+        if screen[:4] != self._size:
+            raise ValueError('All frames of a GIF film must have the same size.')
+        self._f.write(b'\x21\xf9\x04\x00' + struct.pack('<H', self._delay) + b'\x00\x00')
+        size_bits = len(table) // 3
+        size_bits = size_bits.bit_length() - 2
+        self._f.write(descriptor[:9] + bytes([0x80 | (descriptor[9] & 0x40) | size_bits]) + table + image)
+
+    def _finish(self):
+        self._f.write(b'\x3b')
+
+
+class AviFilmWriter(_AnimatedFilmWriter):
+    """Motion JPEG in an AVI container (RIFF, single video stream, idx1 index), read by most players and by ffmpeg.
+    All frames must have the same size. The file is limited to 4 GB."""
+
+    FORMAT = 'avi'
+
+    def _start(self, data):
+        im = Image.open(io.BytesIO(data))
+        self.size = im.size
+        width, height = im.size
+        scale, rate = 1000, max(1, int(round(self.fps * 1000)))
+        avih = struct.pack('<IIIIIIIIII16x', int(round(1e6 / self.fps)), 0, 0, 0x10, 0, 0, 1, 0, width, height)
+        strh = struct.pack('<4s4sIHHIIIIIIIIhhHH', b'vids', b'MJPG', 0, 0, 0, 0, scale, rate, 0, 0, 0, 0xFFFFFFFF,
+                           0, 0, 0, width, height)
+        strf = struct.pack('<IiiHH4sIiiII', 40, width, height, 1, 24, b'MJPG', width * height * 3, 0, 0, 0, 0)
+        strl = b'strl' + self._chunk(b'strh', strh) + self._chunk(b'strf', strf)
+        hdrl = b'hdrl' + self._chunk(b'avih', avih) + self._chunk(b'LIST', strl)
+        self._f.write(b'RIFF' + struct.pack('<I', 0) + b'AVI ' + self._chunk(b'LIST', hdrl))
+        # Offsets of the numbers of frames completed by close: dwTotalFrames of avih, after the RIFF and hdrl headers
+        # and 4 fields, and dwLength of strh, after avih, the strl header and 8 fields
+        self._total_frames = 12 + 12 + 8 + 16
+        self._length = 12 + 12 + 8 + len(avih) + 12 + 8 + 32
+        self._movi = self._f.tell()
+        self._f.write(b'LIST' + struct.pack('<I', 0) + b'movi')
+        # Index entries (offset from the movi fourcc, size), 8 bytes per frame
+        self._index = []
+
+    @staticmethod
+    def _chunk(kind, content):
+        return kind + struct.pack('<I', len(content)) + content + (b'\x00' if len(content) % 2 else b'')
+
+    def _write(self, data):
+        if self.n_frames > 0:
+            if Image.open(io.BytesIO(data)).size != self.size:
+                raise ValueError('All frames of an AVI film must have the same size.')
+        if self._f.tell() + len(data) + 8 * (len(self._index) + 2) > 0xFFFFFFF0:
+            raise ValueError('AVI films are limited to 4 GB, write smaller films.')
+        self._index.append((self._f.tell() - self._movi - 8, len(data)))
+        self._f.write(self._chunk(b'00dc', data))
+
+    def _finish(self):
+        end = self._f.tell()
+        index = b''.join([struct.pack('<4sIII', b'00dc', 0x10, offset, size) for offset, size in self._index])
+        self._f.write(self._chunk(b'idx1', index))
+        size = self._f.tell()
+        self._f.seek(4)
+        self._f.write(struct.pack('<I', size - 8))
+        self._f.seek(self._total_frames)
+        self._f.write(struct.pack('<I', self.n_frames))
+        self._f.seek(self._length)
+        self._f.write(struct.pack('<I', self.n_frames))
+        self._f.seek(self._movi + 4)
+        self._f.write(struct.pack('<I', end - self._movi - 8))
+
+
+ANIMATED_WRITERS = {'apng': ApngFilmWriter, 'gif': GifFilmWriter, 'avi': AviFilmWriter}
+
+
+def open_animation(path_prefix, film_format, fps=DEFAULT_FPS, quality=None, compress_level=None):
+    """Create the writer of an animated film, see _AnimatedFilmWriter.
+
+    Args:
+        path_prefix (str): Path of the film without extension.
+        film_format (str): One of ANIMATED_FORMATS.
+        fps, quality, compress_level: See _AnimatedFilmWriter.
+    Returns:
+        A writer with methods append(window, frame), append_image(im), append_encoded(data) and close().
+
+    """
+    if film_format not in ANIMATED_FORMATS:
+        raise ValueError('Unknown animated film format: ' + str(film_format) + '. Expected one of: ' +
+                         ', '.join(ANIMATED_FORMATS))
+    return ANIMATED_WRITERS[film_format](path_prefix + FILM_EXTENSIONS[film_format], fps=fps, quality=quality,
+                                         compress_level=compress_level)
+
+
+def open_film(path_prefix, film_format, times, window, frame, fps=DEFAULT_FPS, quality=None, compress_level=None):
+    """Create the writer of one film.
+
+    Args:
+        path_prefix (str): Path of the film without extension.
+        film_format (str): One of FILM_FORMATS.
+        times (list): Time of each frame that will be appended.
+        window (numpy array): First window of the film, gives shape and type of the film.
+        frame (crop_engine.Frame): Frame from which window was cropped, gives mode and palette of the film.
+        fps, quality, compress_level (optional): Frame rate and encoding of animated films, see open_animation.
+    Returns:
+        A writer with methods append(window, frame) and close().
+
+    """
+    if film_format not in FILM_FORMATS:
+        raise ValueError('Unknown film format: ' + str(film_format) + '. Expected one of: ' + ', '.join(FILM_FORMATS))
+    if film_format in ANIMATED_FORMATS:
+        return open_animation(path_prefix, film_format, fps=fps, quality=quality, compress_level=compress_level)
+    path = path_prefix + FILM_EXTENSIONS[film_format]
+    if film_format == 'tiff':
+        return TiffFilmWriter(path)
+    return NpyFilmWriter(path, times, window.shape, window.dtype, mode=frame.mode, palette=frame.palette)
@@ -0,0 +1,307 @@
+# Memory-mapped stack of the frames of a well.
+#
+# pack_frames converts a folder of "...T[0-9]+.png" (or .tif, see IMAGE_EXTENSIONS) images into a folder with:
+#  - frames.npy: uncompressed numpy array of shape (T, H, W[, C]), one contiguous chunk per frame.
+#  - index.json: time and original file name of each frame, PIL mode and palette.
+# FrameStack opens it with numpy.load(..., mmap_mode='r'): reading a frame or a small window across all frames only
+# touches the corresponding bytes, without decoding any PNG.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, re, json
+from collections import namedtuple, OrderedDict
+import numpy as np
+from PIL import Image
+from crop_engine import Frame, load_frame
+from manifest import file_fingerprint
+
+STACK_ARRAY = 'frames.npy'
+STACK_INDEX = 'index.json'
+# Extensions of the input frames, one per folder: .png by default, 'tif' for .tif and .tiff files, which can hold
+# 16-bit pixels and one channel per page
+IMAGE_EXTENSIONS = {'png': '\\.png$', 'tif': '\\.tiff?$'}
+
+# Reference to one frame of a stack, picklable and cheap to send to worker processes
+StackFrameRef = namedtuple('StackFrameRef', ['stack', 'image'])
+
+
+def list_frames(in_im, ext='png'):
+    """List the images of a folder whose name ends with "T[0-9]+.png" (or .tif/.tiff, see ext).
+
+    Args:
+        in_im (str): Folder with the images.
+        ext (str, optional): Extension of the images, key of IMAGE_EXTENSIONS: 'png', or 'tif' for .tif and .tiff
+        files. Images with another extension are ignored. Defaults to 'png'.
+    Returns:
+        A list of 2-tuples (time (str), image file name), sorted by time.
+        Raise ValueError if two images only differ by their extension (e.g. img_T1.tif and img_T1.tiff): they would
+        be annotated at the same time and written to the same output.
+
+    """
+    pattern = IMAGE_EXTENSIONS[ext]
+    frames = []
+    stems = {}
+    for image in sorted(os.listdir(in_im)):
+        if re.search(pattern, image):
+            time = re.search('T([0-9]+)' + pattern, image).group(1)  # trim T and extension
+            stem = os.path.splitext(image)[0]
+            if stem in stems:
+                raise ValueError('Images ' + stems[stem] + ' and ' + image + ' of ' + in_im + ' have the same name '
+                                 'and time, keep only one of them in the folder.')
+            stems[stem] = image
+            frames.append((time, image))
+    frames.sort(key=lambda frame: int(frame[0]))
+    return frames
+
+
+def is_frame_stack(path):
+    """Whether path is a folder created by pack_frames."""
+    return os.path.isfile(os.path.join(path, STACK_ARRAY)) and os.path.isfile(os.path.join(path, STACK_INDEX))
+
+
+def pack_frames(in_im, out_stack, ext='png'):
+    """Pack the images of a folder into a memory-mappable frame stack.
+
+    Args:
+        in_im (str): Folder with images whose name ends with "T[0-9]+" and the extension ext. All images must have
+        same size and mode.
+        out_stack (str): Folder where frames.npy and index.json are written. Created if it does not exist.
+        ext (str, optional): Extension of the images, see list_frames. Defaults to 'png'.
+    Returns:
+        A FrameStack opened on out_stack.
+
+    """
+    frames = list_frames(in_im, ext)
+    if not frames:
+        raise ValueError('No image ending with "T[0-9]+.' + ext + '" found in: ' + in_im)
+    os.makedirs(out_stack, exist_ok=True)
+    first = load_frame(os.path.join(in_im, frames[0][1]))
+    stack = np.lib.format.open_memmap(os.path.join(out_stack, STACK_ARRAY), mode='w+', dtype=first.array.dtype,
+                                      shape=(len(frames),) + first.array.shape)
+    for i, (time, image) in enumerate(frames):
+        frame = first if i == 0 else load_frame(os.path.join(in_im, image))
+        if frame.array.shape != first.array.shape or frame.mode != first.mode:
+            raise ValueError('All images must have same size and mode. ' + image + ' differs from ' + frames[0][1])
+        stack[i] = frame.array
+    stack.flush()
+    del stack
+    with open(os.path.join(out_stack, STACK_INDEX), 'w') as f:
+        json.dump({'times': [time for time, _ in frames], 'images': [image for _, image in frames],
+                   'mode': first.mode, 'palette': first.palette}, f)
+    return FrameStack(out_stack)
+
+
+class FrameStack:
+    """Read-only access to a frame stack created by pack_frames.
+
+    Attributes:
+        array (numpy memmap): Pixels, shape (T, H, W[, C]).
+        frames (list of 2-tuple): (time, image name) of each frame, same format as list_frames.
+        mode (str): PIL mode of the frames.
+        palette (list): Palette of 'P' frames, None otherwise.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, STACK_INDEX)) as f:
+            index = json.load(f)
+        self.array = np.load(os.path.join(path, STACK_ARRAY), mmap_mode='r')
+        self.frames = list(zip(index['times'], index['images']))
+        self.mode = index['mode']
+        self.palette = index['palette']
+        self._position = {image: i for i, (_, image) in enumerate(self.frames)}
+        self._time_position = {int(time): i for i, (time, _) in enumerate(self.frames)}
+
+    def __len__(self):
+        return len(self.frames)
+
+    def load(self, image):
+        """Frame (crop_engine.Frame) of an image, given by its original file name. The array is a memory map view."""
+        return Frame(array=self.array[self._position[image]], mode=self.mode, palette=self.palette)
+
+    def frame_at(self, time):
+        """Frame (crop_engine.Frame) at a given time."""
+        return Frame(array=self.array[self._time_position[int(time)]], mode=self.mode, palette=self.palette)
+
+    def fingerprint(self, image):
+        """Fingerprint of a frame, for manifests of incremental runs."""
+        return frame_fingerprint(StackFrameRef(self.path, image))
+
+    def image(self, image):
+        """PIL Image of a frame, given by its original file name."""
+        im = Image.fromarray(np.asarray(self.load(image).array))
+        if self.palette is not None:
+            im.putpalette(self.palette)
+        return im
+
+    def window(self, x0, x1, y0, y1, times=None):
+        """Pixels of a rectangle [x0, x1) x [y0, y1) across frames, reading only the rows of the rectangle.
+
+        Args:
+            x0, x1, y0, y1 (int): Columns and rows of the rectangle, must lie inside the frames.
+            times (list, optional): Times of the frames to read. Defaults to all frames.
+        Returns:
+            A numpy array of shape (n_frames, y1-y0, x1-x0[, C]).
+
+        """
+        if times is None:
+            return np.array(self.array[:, y0:y1, x0:x1])
+        rows = [self._time_position[int(t)] for t in times]
+        return np.array(self.array[rows, y0:y1, x0:x1])
+
+
+class PngFolder:
+    """Frames stored as individual .png files (or .tif, see list_frames), with the same interface as FrameStack."""
+
+    def __init__(self, path, ext='png'):
+        self.path = path
+        self.frames = list_frames(path, ext)
+        self._time_image = {int(time): image for time, image in self.frames}
+
+    def __len__(self):
+        return len(self.frames)
+
+    def load(self, image):
+        return load_frame(os.path.join(self.path, image))
+
+    def frame_at(self, time):
+        return self.load(self._time_image[int(time)])
+
+    def fingerprint(self, image):
+        return frame_fingerprint(os.path.join(self.path, image))
+
+    def image(self, image):
+        return Image.open(os.path.join(self.path, image))
+
+
+class CachedFrameSource:
+    """A FrameStack or PngFolder whose decoded frames are kept in a FrameCache, with the same interface."""
+
+    def __init__(self, source, cache):
+        self.source = source
+        self.cache = cache
+        self.path = source.path
+        self.frames = source.frames
+        self._time_image = {int(time): image for time, image in self.frames}
+
+    def __len__(self):
+        return len(self.frames)
+
+    def _ref(self, image):
+        if isinstance(self.source, FrameStack):
+            return StackFrameRef(self.path, image)
+        return os.path.join(self.path, image)
+
+    def load(self, image):
+        return self.cache.get(self._ref(image), lambda: self.source.load(image))
+
+    def frame_at(self, time):
+        return self.load(self._time_image[int(time)])
+
+    def fingerprint(self, image):
+        return self.source.fingerprint(image)
+
+    def image(self, image):
+        return self.source.image(image)
+
+
+def open_frame_source(in_im, ext='png'):
+    """Open a folder of images: a FrameStack if in_im was created by pack_frames, a PngFolder otherwise.
+
+    ext is the extension of the images of a PngFolder, see list_frames. It is ignored for frame stacks.
+    """
+    if is_frame_stack(in_im):
+        return FrameStack(in_im)
+    return PngFolder(in_im, ext)
+
+
+# ---------------------------------
+# Resolution of StackFrameRef in worker processes, stacks are opened once per process
+
+_open_stacks = {}
+
+
+def _open_stack(path):
+    stack = _open_stacks.get(path)
+    if stack is None:
+        stack = _open_stacks[path] = FrameStack(path)
+    return stack
+
+
+def resolve_image(imfile):
+    """Return a PIL Image for a StackFrameRef, or imfile unchanged if it is a path."""
+    if not isinstance(imfile, StackFrameRef):
+        return imfile
+    return _open_stack(imfile.stack).image(imfile.image)
+
+
+def resolve_array(imfile):
+    """Pixels of an input frame (path or StackFrameRef), as decoded by crop_engine.load_frame."""
+    if isinstance(imfile, StackFrameRef):
+        return np.asarray(_open_stack(imfile.stack).load(imfile.image).array)
+    return load_frame(imfile).array
+
+
+def frame_fingerprint(imfile):
+    """Fingerprint of an input frame (path or StackFrameRef), for manifests of incremental runs."""
+    if isinstance(imfile, StackFrameRef):
+        return file_fingerprint(os.path.join(imfile.stack, STACK_ARRAY)) + [imfile.image]
+    return file_fingerprint(imfile)
+
+
+# ---------------------------------
+# Decoded frames kept in memory by long-running processes (see daemon.py)
+
+
+class FrameCache:
+    """Decoded frames, the least recently used are dropped first.
+
+    Frames are identified by their input (path or StackFrameRef, made absolute) and checked against the fingerprint of
+    the file at each access: a frame rewritten on disk is decoded again.
+
+    Args:
+        max_frames (int, optional): Maximum number of frames kept. Defaults to 256.
+    """
+
+    def __init__(self, max_frames=256):
+        self.max_frames = max_frames
+        self._frames = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def get(self, imfile, load, variant=None):
+        """Decoded frame of imfile, from the cache or from load() on a miss.
+
+        Args:
+            imfile (str or StackFrameRef): Input frame.
+            load (function): Decodes the frame, called without argument.
+            variant (optional): Distinguishes several decodings of the same frame (e.g. PIL Image or array).
+        Returns:
+            The output of load(), shared by all callers: it must not be modified.
+
+        """
+        if isinstance(imfile, StackFrameRef):
+            imfile = StackFrameRef(os.path.abspath(imfile.stack), imfile.image)
+        else:
+            imfile = os.path.abspath(imfile)
+        key = (imfile, variant)
+        fingerprint = frame_fingerprint(imfile)
+        entry = self._frames.get(key)
+        if entry is not None and entry[0] == fingerprint:
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        frame = load()
+        self._frames[key] = (fingerprint, frame)
+        self._frames.move_to_end(key)
+        while len(self._frames) > self.max_frames:
+            self._frames.popitem(last=False)
+        return frame
+
+    def clear(self):
+        self._frames.clear()
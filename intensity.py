@@ -0,0 +1,144 @@
+# Intensity measurements around tracked cells, used by script_measure.py.
+#
+# Sums over rectangles come from a summed-area table (integral image) computed once per frame: each measurement then
+# costs 4 lookups whatever the size of the rectangle. Sums over disks come from row-wise prefix sums, 2 lookups per row
+# of the disk. Min and max have no such shortcut: they are computed on windows gathered for all cells at once (see
+# crop_engine.crop_windows). Pixels outside the image are ignored, n_pixels counts the pixels actually measured.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import math
+import numpy as np
+from crop_engine import crop_windows
+
+STATS = ('mean', 'sum', 'min', 'max')
+SHAPES = ('box', 'disk')
+
+
+def _accumulator_dtype(arr):
+    # Exact integer sums for integer images, float64 otherwise
+    return np.int64 if np.issubdtype(arr.dtype, np.integer) or arr.dtype == bool else np.float64
+
+
+def integral_image(arr):
+    """Summed-area table of an image, with a leading row and column of zeros.
+
+    Args:
+        arr (numpy array): Image of shape (H, W) or (H, W, C).
+    Returns:
+        A numpy array sat of shape (H+1, W+1[, C]), sat[y, x] is the sum of arr[:y, :x].
+
+    """
+    sat = np.zeros((arr.shape[0] + 1, arr.shape[1] + 1) + arr.shape[2:], dtype=_accumulator_dtype(arr))
+    np.cumsum(arr, axis=0, dtype=sat.dtype, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+
+def row_prefix_sums(arr):
+    """Cumulative sums along the rows of an image, shape (H, W+1[, C]), with a leading column of zeros."""
+    prefix = np.zeros((arr.shape[0], arr.shape[1] + 1) + arr.shape[2:], dtype=_accumulator_dtype(arr))
+    np.cumsum(arr, axis=1, dtype=prefix.dtype, out=prefix[:, 1:])
+    return prefix
+
+
+def box_sums(sat, centers, size):
+    """Sums of rectangles around several centers, clipped to the image.
+
+    Args:
+        sat (numpy array): Output of integral_image.
+        centers (numpy array): Integer centers (x, y), shape (n, 2).
+        size (4-tuple of int): Extent left, right, top, bottom of the center, same convention as crop_windows: the
+        rectangle covers columns [x-left, x+right) and rows [y-top, y+bottom).
+    Returns:
+        A 2-tuple (sums of shape (n[, C]), number of pixels inside the image of shape (n,)).
+
+    """
+    h, w = sat.shape[0] - 1, sat.shape[1] - 1
+    left, right, top, bottom = size
+    x0 = np.clip(centers[:, 0] - left, 0, w)
+    x1 = np.clip(centers[:, 0] + right, 0, w)
+    y0 = np.clip(centers[:, 1] - top, 0, h)
+    y1 = np.clip(centers[:, 1] + bottom, 0, h)
+    sums = sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
+    return sums, (x1 - x0) * (y1 - y0)
+
+
+def disk_sums(prefix, centers, radius):
+    """Sums of disks of pixels around several centers, clipped to the image.
+
+    The disk around (x, y) contains the pixels (i, j) with (i-x)^2 + (j-y)^2 <= radius^2.
+
+    Args:
+        prefix (numpy array): Output of row_prefix_sums.
+        centers (numpy array): Integer centers (x, y), shape (n, 2).
+        radius (int): Radius of the disks, in pixels.
+    Returns:
+        A 2-tuple (sums of shape (n[, C]), number of pixels inside the image of shape (n,)).
+
+    """
+    h, w = prefix.shape[0], prefix.shape[1] - 1
+    dy = np.arange(-radius, radius + 1)
+    half = np.array([math.isqrt(radius * radius - int(d) * int(d)) for d in dy])
+    rows = centers[:, 1, None] + dy
+    inside = (rows >= 0) & (rows < h)
+    rows = np.clip(rows, 0, h - 1)
+    x0 = np.clip(centers[:, 0, None] - half, 0, w)
+    x1 = np.clip(centers[:, 0, None] + half + 1, 0, w)
+    spans = prefix[rows, x1] - prefix[rows, x0]
+    mask = inside.reshape(inside.shape + (1,) * (spans.ndim - 2))
+    return np.where(mask, spans, 0).sum(axis=1), np.where(inside, x1 - x0, 0).sum(axis=1)
+
+
+def disk_mask(radius):
+    """Boolean mask of the disk of a given radius, shape (2*radius+1, 2*radius+1)."""
+    d = np.arange(-radius, radius + 1)
+    return d[:, None] ** 2 + d[None, :] ** 2 <= radius * radius
+
+
+def measure_frame(arr, centers, shape='box', size=(5, 5, 5, 5), radius=5, stats=STATS):
+    """Statistics of the pixels around several centers of an image.
+
+    Args:
+        arr (numpy array): Image of shape (H, W) or (H, W, C). For 'P' images, these are the palette indices.
+        centers (list of 2-tuple of int): Centers (x, y), x is the image column and y the image row.
+        shape (str, optional): 'box' (rectangle given by size) or 'disk' (disk given by radius). Defaults to 'box'.
+        size (4-tuple of int, optional): Extent of the box, see box_sums. Defaults to (5, 5, 5, 5).
+        radius (int, optional): Radius of the disk. Defaults to 5.
+        stats (tuple of str, optional): Statistics to compute, among STATS. Defaults to all.
+    Returns:
+        A dictionary {statistic: numpy array of shape (n[, C])} plus 'n_pixels' of shape (n,). Cells with no pixel
+        inside the image get NaN.
+
+    """
+    if shape not in SHAPES:
+        raise ValueError('Unknown shape: ' + str(shape) + '. Expected one of: ' + ', '.join(SHAPES))
+    centers = np.asarray(centers, dtype=np.int64).reshape(-1, 2)
+    if shape == 'box':
+        sums, counts = box_sums(integral_image(arr), centers, size)
+    else:
+        sums, counts = disk_sums(row_prefix_sums(arr), centers, radius)
+    empty = (counts == 0).reshape(counts.shape + (1,) * (sums.ndim - 1))
+    out = {'n_pixels': counts}
+    if 'sum' in stats:
+        out['sum'] = np.where(empty, np.nan, sums) if empty.any() else sums
+    if 'mean' in stats:
+        out['mean'] = np.where(empty, np.nan, sums / np.maximum(counts, 1).reshape(empty.shape))
+    if 'min' in stats or 'max' in stats:
+        if shape == 'box':
+            window_size, keep = size, None
+        else:
+            window_size, keep = (radius, radius + 1, radius, radius + 1), disk_mask(radius)
+        # NaN marks pixels outside the image or outside the disk, ignored by nanmin and nanmax
+        windows = crop_windows(arr.astype(np.float64), centers, window_size, fill=np.nan)
+        if keep is not None:
+            windows[:, ~keep] = np.nan
+        flat = windows.reshape((len(centers), -1) + arr.shape[2:])
+        # Cells without any pixel in the image: measure zeros to avoid warnings, then set to NaN
+        flat = np.where(empty[:, None], 0, flat)
+        if 'min' in stats:
+            out['min'] = np.where(empty, np.nan, np.nanmin(flat, axis=1))
+        if 'max' in stats:
+            out['max'] = np.where(empty, np.nan, np.nanmax(flat, axis=1))
+    return out
@@ -0,0 +1,117 @@
+# Cache of rasterized text labels.
+#
+# ImageDraw.text rasterizes the label with FreeType every time it is called, although overlays write the same track
+# IDs on hundreds of frames. LabelCache renders each label once into an alpha mask and blits it with Image.paste,
+# which blends the color with the mask exactly as ImageDraw does. The result is identical pixel for pixel.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import sys, math
+from collections import OrderedDict
+import numpy as np
+from PIL import Image, ImageFont
+
+# TrueType font of the labels when none is given
+if sys.platform.startswith('win'):
+    DEFAULT_FONT = 'ARIALNB.TTF'
+else:
+    DEFAULT_FONT = '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+
+
+def _fontmode(mode):
+    """Mask mode used by ImageDraw to render text on an image of the given mode."""
+    return '1' if mode in ('1', 'P', 'I', 'F') else 'L'
+
+
+class LabelCache:
+    """Least-recently-used cache of text masks for one font.
+
+    FreeType renders the mask of a label relative to the sub-pixel part of the position where it is written. The
+    cache key therefore contains the sub-pixel offset quantized to 1/64 of pixel, which is the precision used by
+    FreeType. For labels whose glyphs all advance by whole pixels (e.g. digits in most hinted fonts), only the
+    pixel on which the text origin is snapped matters, so that a label has at most a few distinct masks.
+
+    Args:
+        font (FreeTypeFont): Font of the labels.
+        maxsize (int, optional): Maximum number of masks kept in memory. Defaults to 4096.
+    """
+
+    def __init__(self, font, maxsize=4096):
+        self.font = font
+        self.maxsize = maxsize
+        self.masks = OrderedDict()
+        self._aligned = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _is_aligned(self, text):
+        """Whether every glyph of text starts on a whole pixel when the text origin does."""
+        aligned = self._aligned.get(text)
+        if aligned is None:
+            if getattr(self.font, 'layout_engine', None) != ImageFont.Layout.BASIC:
+                aligned = False
+            else:
+                aligned = all([self.font.getlength(text[:i]).is_integer() for i in range(1, len(text) + 1)])
+            if len(self._aligned) >= self.maxsize:
+                self._aligned.clear()
+            self._aligned[text] = aligned
+        return aligned
+
+    def _key(self, text, start, fontmode):
+        # FreeType receives the sub-pixel start as a single precision float, the mask gets one extra column (or row)
+        # when it is positive, and the pen position is rounded to 1/64 of pixel
+        start = [float(np.float32(s)) for s in start]
+        extra = tuple([int(math.ceil(s)) for s in start])
+        pen = [int(math.copysign(math.floor(abs(s) * 64 + 0.5), s)) for s in start]
+        if self._is_aligned(text):
+            # Glyphs are then snapped on the pixel grid by FreeType's PIXEL macro
+            pen = [(pen[0] + 32) >> 6, (32 - pen[1]) >> 6]
+        return text, fontmode, extra, tuple(pen)
+
+    def get(self, text, start, fontmode='L'):
+        """Mask and offset of a label, as returned by FreeTypeFont.getmask2.
+
+        Args:
+            text (str): Label.
+            start (2-tuple of float): Sub-pixel part of the position of the label.
+            fontmode (str, optional): Mode of the mask ('L' for antialiased text). Defaults to 'L'.
+        Returns:
+            A 2-tuple (mask, offset).
+
+        """
+        key = self._key(text, start, fontmode)
+        entry = self.masks.get(key)
+        if entry is not None:
+            self.masks.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        mask, offset = self.font.getmask2(text, fontmode, start=start)
+        # getmask2 returns a core image with one byte per pixel, Image.paste expects a PIL Image
+        entry = (Image.frombytes('L', mask.size, bytes(mask)), offset)
+        self.masks[key] = entry
+        if len(self.masks) > self.maxsize:
+            self.masks.popitem(last=False)
+        return entry
+
+    def draw(self, im, xy, text, fill):
+        """Write text on image im, equivalent to ImageDraw.Draw(im).text(xy, text, font=self.font, fill=fill).
+
+        Args:
+            im (Image): Image to annotate, modified in place.
+            xy (2-tuple of float): Position of the top-left corner of the text.
+            text (str): Label.
+            fill (int or n-tuple): Color of the text, same format as for ImageDraw.
+        Returns:
+            None
+
+        """
+        start = (math.modf(xy[0])[0], math.modf(xy[1])[0])
+        mask, offset = self.get(text, start, _fontmode(im.mode))
+        w, h = mask.size
+        if w == 0 or h == 0:
+            return
+        x = int(xy[0]) + offset[0]
+        y = int(xy[1]) + offset[1]
+        im.paste(fill, (x, y, x + w, y + h), mask)
@@ -0,0 +1,174 @@
+# Manifest of the outputs of an overlay or crop run, for incremental and resumable reruns.
+#
+# manifest.json in the output folder maps each output file name to a record of what produced it: fingerprint of the
+# input frame, fingerprint of the tracks drawn or cropped, and rendering parameters. An output is up to date if the
+# file exists and its record is unchanged; reruns only regenerate the other outputs.
+# Several processes may share an output folder (sharded runs, see work_queue.py): each one merges its own records with
+# the ones on disk when saving, while holding a lock file (manifest.json.lock, created with O_EXCL) so that no other
+# process saves between the read and the write. A lock left by a crashed process is taken over once it is older than
+# a minute, measured with the clock of the file server.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, json, time, uuid, hashlib
+from contextlib import contextmanager
+
+MANIFEST_FILE = 'manifest.json'
+LOCK_SUFFIX = '.lock'
+
+
+def file_fingerprint(path):
+    """Size and modification time of a file, [size, mtime_ns]."""
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def digest(obj):
+    """Short hash of any json-serializable object, e.g. the tracks drawn on a frame."""
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _normalize(record):
+    # Round trip through json so that tuples and lists compare equal with the records read from disk
+    return json.loads(json.dumps(record, sort_keys=True))
+
+
+def _server_time(path):
+    """Current time according to the file server, as the modification time of the file path touched now."""
+    with open(path, 'a'):
+        os.utime(path)
+    return os.stat(path).st_mtime
+
+
+def _lock_state(lock):
+    """Identity of a lock file: inode, modification time and token of its owner. None if there is no lock."""
+    try:
+        st = os.stat(lock)
+        with open(lock) as f:
+            return st.st_ino, st.st_mtime_ns, f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _remove_stale(lock, state, token):
+    """Remove a lock found stale, unless another process replaced it meanwhile.
+
+    The lock is renamed to a unique name first: only one process can rename a given file. If the renamed file is not
+    the one found stale (state, see _lock_state), e.g. another process removed it and created a fresh lock in between,
+    it is put back.
+    """
+    moved = lock + '.' + token + '.stale'
+    try:
+        os.rename(lock, moved)
+    except FileNotFoundError:
+        return
+    try:
+        if _lock_state(moved) != state:
+            try:
+                os.link(moved, lock)
+            except FileExistsError:
+                pass
+        else:
+            print('Removing stale lock: ' + lock)
+    finally:
+        os.remove(moved)
+
+
+@contextmanager
+def _lock(path, stale_seconds=60, poll_seconds=0.05):
+    """Hold the lock file path + LOCK_SUFFIX while the enclosed block runs.
+
+    A lock older than stale_seconds belongs to a process which crashed while saving (saving takes well under a
+    second), it is removed. Ages are measured with the clock of the file server, as in work_queue.py, since nodes
+    sharing the folder may have different clocks.
+    """
+    lock = path + LOCK_SUFFIX
+    token = uuid.uuid4().hex
+    clock = lock + '.' + token + '.clock'
+    try:
+        while True:
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                state = _lock_state(lock)
+                if state is None:
+                    continue
+                if _server_time(clock) - state[1] / 1e9 > stale_seconds:
+                    _remove_stale(lock, state, token)
+                    continue
+                time.sleep(poll_seconds)
+    finally:
+        if os.path.exists(clock):
+            os.remove(clock)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(token)
+        yield
+    finally:
+        # The lock may have been taken over if this process was too slow, only remove our own
+        try:
+            with open(lock) as f:
+                owned = f.read() == token
+            if owned:
+                os.remove(lock)
+        except FileNotFoundError:
+            pass
+
+
+class Manifest:
+    """Records of the outputs of a folder.
+
+    Args:
+        folder (str): Output folder, where manifest.json is read and written.
+        force (bool, optional): If True, no output is considered up to date. Defaults to False.
+        save_every (int, optional): Write manifest.json after this number of updates, so that an interrupted run
+        can be resumed. Defaults to 20.
+    """
+
+    def __init__(self, folder, force=False, save_every=20):
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_FILE)
+        self.force = force
+        self.save_every = save_every
+        self._pending = 0
+        # Records updated by this process since it was loaded
+        self._updated = {}
+        self.records = self._read()
+
+    def _read(self):
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except ValueError:
+            print('Ignoring unreadable manifest: ' + self.path)
+            return {}
+
+    def is_current(self, output, record):
+        """Whether output exists in the folder and was produced with the same record."""
+        if self.force:
+            return False
+        name = os.path.basename(output)
+        return self.records.get(name) == _normalize(record) and os.path.isfile(os.path.join(self.folder, name))
+
+    def update(self, output, record):
+        """Register that output was produced with record."""
+        self.records[os.path.basename(output)] = _normalize(record)
+        self._updated[os.path.basename(output)] = self.records[os.path.basename(output)]
+        self._pending += 1
+        if self._pending >= self.save_every:
+            self.save()
+
+    def save(self):
+        """Write manifest.json atomically, with the records saved meanwhile by other processes."""
+        with _lock(self.path):
+            self.records = self._read()
+            self.records.update(self._updated)
+            tmp = self.path + '.' + uuid.uuid4().hex + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.records, f, sort_keys=True)
+            os.replace(tmp, self.path)
+        self._pending = 0
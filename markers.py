@@ -0,0 +1,185 @@
+# Markers at the tracked positions and trajectory tails, rasterized on numpy arrays.
+#
+# All markers of a frame are drawn with a single indexed assignment: each marker is a fixed stencil of pixel offsets
+# added to all centers at once. Tails join the last positions of each track with 1-pixel segments, all segments of a
+# frame being sampled together (one point per pixel along the longest axis of each segment). This replaces thousands
+# of ImageDraw calls per frame by a few numpy operations.
+# Tails come from TrackHistory, a ring buffer holding the last positions of every track, updated frame after frame
+# instead of being looked up again in the whole table for each frame.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import numpy as np
+from PIL import Image
+
+MARKERS = ('plus', 'cross', 'square', 'disk')
+
+
+class TrackHistory:
+    """Last positions of every track, updated incrementally with the frames of a TrackTable in time order.
+
+    Args:
+        table (TrackTable): Tracks positions.
+        length (int): Number of positions kept per track, the current one included.
+    """
+
+    def __init__(self, table, length):
+        if length < 1:
+            raise ValueError('Length of the history must be at least 1.')
+        self.table = table
+        self.length = length
+        self._ids = table.track_index().ids
+        # Ring buffer of positions, slot of the latest position of each track (-1 before its first detection)
+        self._xy = np.full((len(self._ids), length, 2), np.nan, dtype=np.float32)
+        self._head = np.full(len(self._ids), -1, dtype=np.int64)
+        self._next = 0
+
+    def _update(self, time):
+        """Push the positions of all tracks present at a frame."""
+        ids, x, y = self.table.frame(time)
+        tracks = np.searchsorted(self._ids, ids)
+        self._head[tracks] = (self._head[tracks] + 1) % self.length
+        self._xy[tracks, self._head[tracks], 0] = x
+        self._xy[tracks, self._head[tracks], 1] = y
+
+    def advance(self, time):
+        """Push all frames of the table up to time (included) not pushed yet. Frames must be requested in time order.
+
+        Raise ValueError if time is before the last frame pushed.
+        """
+        time = int(time)
+        frames = self.table.frames
+        if self._next > 0 and time < frames[self._next - 1]:
+            raise ValueError('Frames of a TrackHistory must be visited in time order, got ' + str(time) + ' after ' +
+                             str(frames[self._next - 1]) + '.')
+        while self._next < len(frames) and frames[self._next] <= time:
+            self._update(frames[self._next])
+            self._next += 1
+
+    def tails(self, time):
+        """Last positions of the tracks present at a frame.
+
+        Args:
+            time (int or str): Frame, after all frames already requested.
+        Returns:
+            A float32 numpy array of shape (n, length, 2), rows in the order of TrackTable.frame(time), positions
+            from the oldest to the current one. Missing positions (track younger than length frames) are NaN.
+            None if the frame is not in the table.
+
+        """
+        self.advance(time)
+        if time not in self.table:
+            return None
+        tracks = np.searchsorted(self._ids, self.table.frame(time)[0])
+        # Slots from the oldest to the latest position
+        slots = (self._head[tracks, None] + 1 + np.arange(self.length)) % self.length
+        return self._xy[tracks[:, None], slots]
+
+
+def marker_offsets(marker, size):
+    """Pixel offsets (dx, dy) of a marker around its center, shape (m, 2).
+
+    Args:
+        marker (str): One of MARKERS. 'plus' and 'cross' have arms of size pixels, 'square' is the outline of a
+        square of half side size, 'disk' a filled disk of radius size.
+        size (int): Size of the marker.
+    Returns:
+        A numpy array of int64.
+
+    """
+    d = np.arange(-size, size + 1)
+    zero = np.zeros_like(d)
+    if marker == 'plus':
+        offsets = np.concatenate([np.stack([d, zero], axis=1), np.stack([zero, d], axis=1)])
+    elif marker == 'cross':
+        offsets = np.concatenate([np.stack([d, d], axis=1), np.stack([d, -d], axis=1)])
+    elif marker == 'square':
+        side = np.full_like(d, size)
+        offsets = np.concatenate([np.stack([d, -side], axis=1), np.stack([d, side], axis=1),
+                                  np.stack([-side, d], axis=1), np.stack([side, d], axis=1)])
+    elif marker == 'disk':
+        dx, dy = np.meshgrid(d, d)
+        inside = dx ** 2 + dy ** 2 <= size * size
+        offsets = np.stack([dx[inside], dy[inside]], axis=1)
+    else:
+        raise ValueError('Unknown marker: ' + str(marker) + '. Expected one of: ' + ', '.join(MARKERS))
+    return np.unique(offsets, axis=0)
+
+
+def segment_pixels(start, end):
+    """Pixels of straight segments, sampled once per pixel along the longest axis of each segment.
+
+    Args:
+        start, end (numpy array): Ends (x, y) of the segments, shape (n, 2). Segments with a NaN end are dropped.
+    Returns:
+        A 2-tuple of int64 numpy arrays (x, y) with the pixels of all segments.
+
+    """
+    keep = ~(np.isnan(start).any(axis=1) | np.isnan(end).any(axis=1))
+    start, end = start[keep].astype(np.float64), end[keep].astype(np.float64)
+    delta = end - start
+    steps = np.ceil(np.abs(delta).max(axis=1)).astype(np.int64) if len(delta) else np.zeros(0, dtype=np.int64)
+    # Segment of each sampled point and position of the point along its segment
+    counts = steps + 1
+    segment = np.repeat(np.arange(len(steps)), counts)
+    first = np.cumsum(counts) - counts
+    k = np.arange(len(segment)) - first[segment]
+    frac = k / np.maximum(steps[segment], 1)
+    points = start[segment] + frac[:, None] * delta[segment]
+    return np.floor(points[:, 0]).astype(np.int64), np.floor(points[:, 1]).astype(np.int64)
+
+
+def _paint(arr, x, y, color):
+    """Set the pixels (x, y) inside the image to color."""
+    inside = (x >= 0) & (x < arr.shape[1]) & (y >= 0) & (y < arr.shape[0])
+    arr[y[inside], x[inside]] = color
+
+
+def draw_marks(arr, centers, tails=None, marker=None, size=3, color=255):
+    """Draw markers and tails of all tracks of a frame, in place.
+
+    Args:
+        arr (numpy array): Image of shape (H, W) or (H, W, C).
+        centers (numpy array): Positions (x, y) of the tracks, shape (n, 2).
+        tails (numpy array, optional): Last positions of the tracks, shape (n, k, 2), see TrackHistory.tails. Each
+        position is joined to the next one. Defaults to None.
+        marker (str, optional): Marker drawn at the centers, one of MARKERS. Defaults to None, no marker.
+        size (int, optional): Size of the markers, see marker_offsets. Defaults to 3.
+        color (int or tuple, optional): Color of markers and tails, an integer for single channel images and a tuple
+        with one value per channel otherwise. Defaults to 255.
+    Returns:
+        arr.
+
+    """
+    if tails is not None and tails.shape[1] > 1:
+        x, y = segment_pixels(tails[:, :-1].reshape(-1, 2), tails[:, 1:].reshape(-1, 2))
+        _paint(arr, x, y, color)
+    if marker is not None and len(centers):
+        pixels = np.floor(np.asarray(centers, dtype=np.float64)).astype(np.int64)[:, None, :] + \
+            marker_offsets(marker, size)[None]
+        _paint(arr, pixels[..., 0].ravel(), pixels[..., 1].ravel(), color)
+    return arr
+
+
+def mark_image(im, coord, tails=None, marker=None, size=3, color=-1):
+    """Draw markers and tails on a PIL Image, see draw_marks.
+
+    Args:
+        im (Image): Image of mode 'L' or 'RGB'.
+        coord (list of 2-tuple): Positions (x, y) of the tracks.
+        tails, marker, size: See draw_marks.
+        color (int or tuple, optional): Color, see draw_marks. -1 for white, as the text of overlay_text. Defaults
+        to -1.
+    Returns:
+        A new PIL Image with the same mode.
+
+    """
+    if isinstance(color, list):  # as provided by argparse
+        color = tuple(color)
+    if color in (-1, (-1,), (-1, -1, -1)):
+        color = 255 if im.mode == 'L' else (255, 255, 255)
+    arr = np.array(im)
+    draw_marks(arr, np.asarray(coord, dtype=np.float64).reshape(-1, 2), tails=tails, marker=marker, size=size,
+               color=color)
+    return Image.fromarray(arr, mode=im.mode)
@@ -0,0 +1,226 @@
+# Contact sheets: crops of cells laid out in a grid on a single image, for review.
+#
+# A sheet gathers either every time point of a track or one time point of many tracks. Its canvas is allocated once
+# with the final size, as a 4D view (grid rows, tile rows, grid columns, tile columns): all windows cropped from a
+# frame are copied into their tiles with one indexed assignment, straight from crop_engine.crop_windows, without
+# intermediate files. Captions (time or track ID) are written in a band above each tile with a LabelCache.
+# Sheets are split into jobs that run in parallel worker processes. Each job decodes a frame once for all its sheets.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import math
+from collections import namedtuple
+from multiprocessing import Pool
+import numpy as np
+from PIL import Image, ImageFont
+from crop_engine import crop_windows
+from frame_stack import open_frame_source
+from label_cache import LabelCache
+from encoding import save_image
+
+MONTAGE_MODES = ('track', 'time')
+
+# One contact sheet: output path and its tiles as (image name, center (x, y), caption) in the order of the grid.
+Sheet = namedtuple('Sheet', ['output', 'tiles'])
+
+
+def grid_shape(n_tiles, columns=None):
+    """Number of rows and columns of a grid of n_tiles, as square as possible if columns is None."""
+    if columns is None:
+        columns = max(1, int(math.ceil(math.sqrt(n_tiles))))
+    return max(1, int(math.ceil(n_tiles / columns))), columns
+
+
+class Montage:
+    """Canvas of a contact sheet, tiles of equal size in a grid.
+
+    Args:
+        n_tiles (int): Number of tiles.
+        tile_shape (tuple): Shape of a tile, (h, w) or (h, w, C).
+        dtype: Type of the pixels.
+        columns (int, optional): Number of columns of the grid. Defaults to None, as square as possible.
+        gap (int, optional): Pixels between tiles. Defaults to 2.
+        caption_height (int, optional): Height of the band above each tile where its caption is written. Defaults to
+        0, no caption.
+        background (optional): Value of the pixels between tiles and of missing tiles. Defaults to 0.
+    """
+
+    def __init__(self, n_tiles, tile_shape, dtype, columns=None, gap=2, caption_height=0, background=0):
+        self.n_tiles = n_tiles
+        self.rows, self.columns = grid_shape(n_tiles, columns)
+        self.tile_shape = tuple(tile_shape)
+        self.gap = gap
+        self.caption_height = caption_height
+        h, w = self.tile_shape[:2]
+        # Each grid cell holds the caption band, the tile and the gap after it
+        self._cells = np.full((self.rows, caption_height + h + gap, self.columns, w + gap) + self.tile_shape[2:],
+                              background, dtype=dtype)
+        self.captions = [None] * n_tiles
+
+    def place(self, tiles, windows, captions=None):
+        """Copy windows into their tiles.
+
+        Args:
+            tiles (list of int): Index of the tile of each window, in row-major order of the grid.
+            windows (numpy array): Windows of shape (n,) + tile_shape, see crop_engine.crop_windows.
+            captions (list of str, optional): Caption of each tile. Defaults to None.
+        Returns:
+            None
+
+        """
+        tiles = np.asarray(tiles, dtype=np.int64)
+        h, w = self.tile_shape[:2]
+        self._cells[tiles // self.columns, self.caption_height:self.caption_height + h, tiles % self.columns, :w] = \
+            windows
+        if captions is not None:
+            for k, caption in zip(tiles.tolist(), captions):
+                self.captions[k] = caption
+
+    @property
+    def canvas(self):
+        """Pixels of the sheet, shape (H, W) or (H, W, C), without the gap after the last row and column."""
+        cells = self._cells.shape
+        canvas = self._cells.reshape((cells[0] * cells[1], cells[2] * cells[3]) + cells[4:])
+        return canvas[:canvas.shape[0] - self.gap, :canvas.shape[1] - self.gap]
+
+    def to_image(self, palette=None, label_cache=None, color=-1):
+        """PIL Image of the sheet, with the captions.
+
+        Args:
+            palette (list, optional): Palette of 'P' tiles. The sheet is converted to RGB if captions are written.
+            Defaults to None.
+            label_cache (LabelCache, optional): Renders the captions with its font. Defaults to None, no caption.
+            color (int or tuple, optional): Color of the captions, -1 for white. Defaults to -1.
+        Returns:
+            A PIL Image.
+            Raise ValueError if captions are requested on tiles which are not 8-bit grayscale or color.
+
+        """
+        im = Image.fromarray(np.ascontiguousarray(self.canvas))
+        if palette is not None:
+            im.putpalette(palette)
+        if label_cache is None or self.caption_height == 0:
+            return im
+        if im.mode == 'P':
+            im = im.convert('RGB')
+        if im.mode not in ('L', 'RGB'):
+            raise ValueError('Captions need 8-bit grayscale or RGB tiles, got mode ' + im.mode + '. Scale raw frames '
+                             'with a display range.')
+        if color in (-1, (-1,), (-1, -1, -1), [-1]):
+            color = 255 if im.mode == 'L' else (255, 255, 255)
+        h, w = self.tile_shape[:2]
+        for k, caption in enumerate(self.captions):
+            if caption is None:
+                continue
+            row, column = divmod(k, self.columns)
+            label_cache.draw(im, (column * (w + self.gap) + 1, row * (self.caption_height + h + self.gap)), caption,
+                             color)
+        return im
+
+
+# ---------------------------------
+# Rendering of sheets, in the current process or in workers. Fonts are passed as (path, size) and loaded once per
+# process.
+
+_fonts = {}
+
+
+def _label_cache(font_spec):
+    if font_spec is None:
+        return None
+    if font_spec not in _fonts:
+        _fonts[font_spec] = LabelCache(ImageFont.truetype(font=font_spec[0], size=font_spec[1]))
+    return _fonts[font_spec]
+
+
+def render_sheets(in_im, sheets, size, display=None, columns=None, gap=2, font=None, color=-1, encoding=None,
+                  source=None):
+    """Crop the tiles of several contact sheets and write the sheets. Each frame is decoded once for all sheets.
+
+    Args:
+        in_im (str): Folder with the frames, or frame stack created by script_pack_frames.py.
+        sheets (list of Sheet): Sheets to render.
+        size (4-tuple of int): Extent of the crops around their center, see crop_engine.crop_windows.
+        display (DisplayScaling, optional): Scaling of raw frames to 8 bits, applied to the crops only. Defaults to
+        None, pixels are kept as they are.
+        columns, gap: Layout of the grid, see Montage.
+        font (2-tuple, optional): (path, size) of the TrueType font of the captions. Defaults to None, no caption.
+        color (optional): Color of the captions, see Montage.to_image. Defaults to -1, white.
+        encoding (dict, optional): Keyword arguments of encoding.save_image. Defaults to None, PNG.
+        source (optional): Frames of in_im already opened, see frame_stack.open_frame_source. Defaults to None.
+    Returns:
+        The list of the paths of the sheets written.
+
+    """
+    source = source or open_frame_source(in_im)
+    labels = _label_cache(font)
+    caption_height = 0 if labels is None else font[1] + 3
+    # Tiles of all sheets by frame, in order of the frames
+    order = {image: k for k, (_, image) in enumerate(source.frames)}
+    by_frame = {}
+    for s, sheet in enumerate(sheets):
+        for t, (image, center, caption) in enumerate(sheet.tiles):
+            by_frame.setdefault(image, []).append((s, t, center, caption))
+    montages = [None] * len(sheets)
+    palette = None
+    for image in sorted(by_frame, key=lambda name: order[name]):
+        tiles = by_frame[image]
+        frame = source.load(image)
+        windows = crop_windows(frame.array, [center for _, _, center, _ in tiles], size)
+        palette = frame.palette
+        if display is not None:
+            windows = display.apply(windows)
+            palette = None
+        # Windows of each sheet
+        picks = {}
+        for k, (s, _, _, _) in enumerate(tiles):
+            picks.setdefault(s, []).append(k)
+        for s, ks in picks.items():
+            if montages[s] is None:
+                montages[s] = Montage(len(sheets[s].tiles), windows.shape[1:], windows.dtype, columns=columns,
+                                      gap=gap, caption_height=caption_height)
+            montages[s].place([tiles[k][1] for k in ks], windows[ks], [tiles[k][3] for k in ks])
+    written = []
+    for sheet, montage in zip(sheets, montages):
+        if montage is None:
+            continue
+        save_image(montage.to_image(palette=palette, label_cache=labels, color=color), sheet.output,
+                   **(encoding or {}))
+        written.append(sheet.output)
+    return written
+
+
+def _render_job(job):
+    return render_sheets(**job)
+
+
+def split_sheets(sheets, sheets_per_job=None, workers=1):
+    """Group sheets into jobs of sheets_per_job sheets, by default one job per worker."""
+    if sheets_per_job is None:
+        sheets_per_job = max(1, int(math.ceil(len(sheets) / max(1, workers))))
+    return [sheets[i:i + sheets_per_job] for i in range(0, len(sheets), sheets_per_job)]
+
+
+def run_montages(in_im, sheets, size, workers=1, sheets_per_job=None, source=None, **kwargs):
+    """Render contact sheets, in parallel over groups of sheets.
+
+    Args:
+        in_im, sheets, size, source: See render_sheets. source is only used with 1 worker.
+        workers (int, optional): Number of worker processes. Defaults to 1, in the current process.
+        sheets_per_job (int, optional): Number of sheets per job. A job decodes every frame its sheets need, so fewer
+        and larger jobs decode less. Defaults to None, one job per worker.
+        **kwargs: Other arguments of render_sheets.
+    Yields:
+        The list of sheets written by each job, as jobs complete.
+
+    """
+    jobs = [dict(in_im=in_im, sheets=group, size=size, **kwargs)
+            for group in split_sheets(sheets, sheets_per_job, workers)]
+    if workers <= 1:
+        for job in jobs:
+            yield render_sheets(source=source, **job)
+        return
+    with Pool(processes=workers) as pool:
+        for written in pool.imap_unordered(_render_job, jobs):
+            yield written
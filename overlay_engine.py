@@ -0,0 +1,710 @@
+# Frame-level execution of overlays, shared by script_overlay.py, script_overlay_cfg.py and script_overlay_batch.py.
+#
+# Each frame is an independent job (input image, output image, positions and labels of the tracks at this time).
+# Jobs are run either in the current process or fanned out to a pool of worker processes. Annotated frames are written
+# as images, or encoded by the workers and appended in order to an animated film (film_writer.open_animation).
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, re, queue, threading, traceback, hashlib
+from collections import namedtuple
+from multiprocessing import Pool
+from PIL import Image, ImageFont
+import script_overlay
+from label_cache import LabelCache
+from frame_stack import IMAGE_EXTENSIONS, open_frame_source, is_frame_stack, resolve_image, resolve_array, \
+    frame_fingerprint, StackFrameRef
+from manifest import Manifest, digest
+from encoding import FRAME_FORMATS, save_image, replace_extension
+from film_writer import ANIMATED_FORMATS, DEFAULT_FPS, encode_film_frame, open_animation
+from stage_timer import StageTimer, profile_block
+from markers import MARKERS, TrackHistory, mark_image
+from display import COLORS, display_for_source
+from track_table import load_track_table
+from track_stream import EXTERNAL_SORT, DEFAULT_CHUNK_ROWS, iter_frames, join_frames
+
+
+# One frame to annotate. coord and text are the positions and labels of the tracks present in this frame, text is None
+# if labels are not drawn. display is the scaling of raw frames to 8 bits (display.DisplayScaling), None to draw on the
+# frames as they are. marks are the keyword arguments of markers.mark_image, None to draw no marker nor tail, and
+# tails the last positions of the tracks (see markers.TrackHistory).
+OverlayJob = namedtuple('OverlayJob', ['imfile', 'output', 'coord', 'text', 'display', 'marks', 'tails'],
+                        defaults=(None, None, None))
+
+
+def build_overlay_jobs(tracks, in_im, in_out, prefix='ovl_', frame_format='png', display=None, marks=None, tail=0,
+                       labels=True, image_ext='png'):
+    """Create one job per image of in_im, with the tracks of the corresponding frame.
+
+    Args:
+        tracks (TrackTable): Tracks positions.
+        in_im (str): Folder with the images to annotate, or frame stack created by script_pack_frames.py.
+        in_out (str): Folder where the annotated images are written.
+        prefix (str, optional): Prefix added to the name of the annotated images. Defaults to 'ovl_'.
+        frame_format (str, optional): Format of the annotated images, gives their extension. Defaults to 'png'.
+        display (DisplayScaling, optional): Scaling of raw frames (16-bit, multi-channel) to 8 bits before drawing,
+        see display.display_for_source. Defaults to None, frames are drawn as they are.
+        marks (dict, optional): Style of markers and tails, keyword arguments of markers.mark_image (marker, size,
+        color). Defaults to None, no marker.
+        tail (int, optional): Number of positions in the tail of each track, the current one included. Tails are
+        computed here, frame after frame, and carried by the jobs. Defaults to 0, no tail.
+        labels (bool, optional): Whether to write the track IDs. Defaults to True.
+        image_ext (str, optional): Extension of the images of in_im, see frame_stack.list_frames. Defaults to 'png'.
+    Returns:
+        A list of OverlayJob, sorted by time. Frames absent from the tracks table get None as coord and text,
+        they are reported as failed when the jobs are run.
+
+    """
+    jobs = []
+    stack = is_frame_stack(in_im)
+    history = TrackHistory(tracks, tail) if tail > 0 else None
+    if history is not None and marks is None:
+        marks = {}
+    for time, image in open_frame_source(in_im, image_ext).frames:
+        present = time in tracks
+        jobs.append(OverlayJob(imfile=StackFrameRef(in_im, image) if stack else in_im + '/' + image,
+                               output=replace_extension(in_out + '/' + prefix + image, frame_format),
+                               coord=tracks.coords(time) if present else None,
+                               text=tracks.labels(time) if present and labels else None, display=display,
+                               marks=marks, tails=history.tails(time) if history is not None else None))
+    return jobs
+
+
+def iter_stream_jobs(stream, in_im, in_out, prefix='ovl_', frame_format='png', display=None, marks=None,
+                     labels=True, image_ext='png'):
+    """Create the jobs of build_overlay_jobs one at a time, from a stream of track frames instead of a TrackTable.
+
+    Args:
+        stream (iterable of FrameRows): Rows of each frame in time order, see track_stream.iter_frames. Only the rows
+        of the current frame are held in memory.
+        in_im, in_out, prefix, frame_format, display, marks, labels, image_ext: See build_overlay_jobs. Tails need the
+        whole table and are not available.
+    Yields:
+        OverlayJob, sorted by time. Frames absent from the stream get None as coord and text.
+
+    """
+    stack = is_frame_stack(in_im)
+    for time, image, rows in join_frames(open_frame_source(in_im, image_ext).frames, stream):
+        yield OverlayJob(imfile=StackFrameRef(in_im, image) if stack else in_im + '/' + image,
+                         output=replace_extension(in_out + '/' + prefix + image, frame_format),
+                         coord=list(zip(rows.x.tolist(), rows.y.tolist())) if rows is not None else None,
+                         text=rows.track_id.tolist() if rows is not None and labels else None, display=display,
+                         marks=marks)
+
+
+# ---------------------------------
+# Worker side. The font and the cache of rendered labels are created once per worker process, jobs only carry the
+# tracks of their own frame.
+
+_worker_font = None
+_worker_labels = None
+_worker_params = None
+_worker_encoding = None
+_worker_timer = StageTimer(enabled=False)
+
+
+def _init_worker(spec, params, encoding, font=None, profile=False):
+    global _worker_font, _worker_labels, _worker_params, _worker_encoding, _worker_timer
+    if spec is not None:
+        font = ImageFont.truetype(font=spec[0], size=spec[1])
+    _worker_font = font
+    # Rendered labels are kept from one run to the next as long as the font is the same
+    if font is None:
+        _worker_labels = None
+    elif _worker_labels is None or _worker_labels.font is not font:
+        _worker_labels = LabelCache(font)
+    _worker_params = params
+    _worker_encoding = encoding or {}
+    _worker_timer = StageTimer(enabled=profile)
+
+
+# Decoded input frames kept in memory between runs by long-running processes, see set_frame_cache
+_frame_cache = None
+
+
+def set_frame_cache(cache):
+    """Keep the frames decoded by the current process in cache (frame_stack.FrameCache), None to stop caching."""
+    global _frame_cache
+    _frame_cache = cache
+
+
+def _decode(imfile, raw):
+    if raw:
+        return resolve_array(imfile)
+    im = resolve_image(imfile)
+    if not isinstance(im, Image.Image):
+        im = Image.open(im)
+    im.load()
+    return im
+
+
+def decode_frame(imfile, raw=False):
+    """Read and decode an input frame (path or StackFrameRef) into a PIL Image, or into a numpy array if raw (pages of
+    multi-page TIFF as channels, see crop_engine.image_array)."""
+    if _frame_cache is None:
+        return _decode(imfile, raw)
+    frame = _frame_cache.get(imfile, lambda: _decode(imfile, raw), variant=raw)
+    # Labels are drawn in place, the cached image must stay untouched
+    return frame if raw else frame.copy()
+
+
+def to_drawable(im, display=None):
+    """Convert 'P' frames to RGB as overlay_text does, done beforehand so that the conversion is timed apart. With a
+    display scaling, im is the raw array of the frame and is scaled to an 8-bit image."""
+    if display is not None:
+        return display.to_image(im)
+    return im.convert('RGB') if im.mode == 'P' else im
+
+
+def write_frame(im, output, encoding):
+    """Save an annotated frame to output with encoding (keyword arguments of encoding.save_image). If encoding has a
+    'film_format', the frame is encoded for an animated film instead and returned as bytes."""
+    encoding = dict(encoding or {})
+    film_format = encoding.pop('film_format', None)
+    if film_format is None:
+        save_image(im, output, **encoding)
+        return None
+    return encode_film_frame(im, film_format, quality=encoding.get('quality'),
+                             compress_level=encoding.get('compress_level'))
+
+
+def _run_job(job):
+    """Annotate one frame. Return the formatted error (None on success), the stage timings of the frame and the
+    encoded frame for films."""
+    try:
+        if job.coord is None:
+            raise KeyError('No track found in the tracks table for image: ' + str(job.imfile))
+        with _worker_timer.stage('decode'):
+            im = decode_frame(job.imfile, raw=job.display is not None)
+        with _worker_timer.stage('convert'):
+            im = to_drawable(im, job.display)
+        with _worker_timer.stage('draw'):
+            im = draw_job(job, im, _worker_font, _worker_labels, **_worker_params)
+        with _worker_timer.stage('encode'):
+            data = write_frame(im, job.output, _worker_encoding)
+    except Exception:
+        return traceback.format_exc(), _worker_timer.take(), None
+    return None, _worker_timer.take(), data
+
+
+def draw_job(job, im, font, label_cache, color, shift_coord):
+    """Draw the markers, tails and labels of a job on a drawable frame (see to_drawable), labels on top."""
+    if job.marks is not None:
+        im = mark_image(im, job.coord, tails=job.tails, **dict({'color': color}, **job.marks))
+    if job.text is not None:
+        im = script_overlay.overlay_text(im, coord=job.coord, text=job.text, shift_coord=shift_coord, font=font,
+                                         color=color, label_cache=label_cache, save=False)
+    return im
+
+
+def _run_indexed_job(indexed_job):
+    i, job = indexed_job
+    return i, _run_job(job)
+
+
+def font_spec(font):
+    """Picklable description (path, size) of a TrueType font, used to reload it in worker processes."""
+    if font is None:
+        return None
+    return font.path, font.size
+
+
+def job_record(job, params):
+    """Manifest record of a job: fingerprint of the input frame and of its tracks, rendering parameters."""
+    record = {'input': frame_fingerprint(job.imfile), 'tracks': digest([job.coord, job.text]), 'params': params}
+    if job.display is not None:
+        record['display'] = job.display.params()
+    if job.marks is not None:
+        record['marks'] = job.marks
+        record['tails'] = None if job.tails is None else hashlib.sha1(job.tails.tobytes()).hexdigest()
+    return record
+
+
+def skip_up_to_date(jobs, manifest, params):
+    """Remove the jobs whose output is up to date in a manifest.
+
+    Args:
+        jobs (list of OverlayJob): Frames to annotate.
+        manifest (Manifest): Manifest of the output folder.
+        params (dict): Rendering parameters recorded in the manifest.
+    Returns:
+        A 2-tuple (jobs to run, dictionary of manifest records by output path).
+
+    """
+    records = {}
+    todo = []
+    for job in jobs:
+        if job.coord is not None:
+            records[job.output] = job_record(job, params)
+            if manifest.is_current(job.output, records[job.output]):
+                continue
+        todo.append(job)
+    return todo, records
+
+
+def _iter_todo(jobs, manifest, params, records, skipped, timer):
+    """Lazy skip_up_to_date for streamed jobs: records are added to records, skipped[0] counts the skipped jobs."""
+    for job in jobs:
+        if job.coord is not None:
+            with timer.stage('manifest'):
+                record = job_record(job, params)
+                current = manifest.is_current(job.output, record)
+            if current:
+                skipped[0] += 1
+                continue
+            records[job.output] = record
+        yield job
+
+
+def run_overlay_jobs(jobs, font, color, shift_coord, workers=1, manifest=None, inflight=None, encoding=None,
+                     timer=None, film=None):
+    """Annotate all frames, possibly in parallel.
+
+    Args:
+        jobs (list or iterable of OverlayJob): Frames to annotate. An iterable (e.g. from iter_stream_jobs) is
+        consumed lazily, with a bounded number of jobs in memory.
+        font (FreeTypeFont): Font of the text.
+        color: Color of the text, see overlay_text.
+        shift_coord (list of 2 int): Shift for text.
+        workers (int, optional): Number of worker processes. 1 runs all frames in the current process. Defaults to 1.
+        manifest (Manifest, optional): Manifest of the output folder. If provided, frames whose output is up to date
+        are skipped and the manifest is updated as frames complete. Defaults to None.
+        inflight (int, optional): If provided, run in pipeline mode, see iter_pipeline_results. Defaults to None.
+        encoding (dict, optional): Keyword arguments of encoding.save_image (frame_format, compress_level, quality).
+        Defaults to None, i.e. PNG with Pillow's default settings.
+        timer (StageTimer, optional): Collects the time spent in each stage of each frame (decode, convert, draw,
+        encode), including frames run in worker processes. Defaults to None.
+        film (optional): Writer of an animated film (film_writer.open_animation). If provided, annotated frames are
+        appended to the film in order instead of being written as images, frames that fail are left out. The film is
+        not closed. Defaults to None.
+    Returns:
+        A list of 2-tuples (job, error message) for the frames that failed, in the order of jobs. Output files do
+        not depend on the number of workers.
+
+    """
+    timer = timer or StageTimer(enabled=False)
+    skipped = [0]
+    if manifest is not None:
+        params = {'color': color, 'shift_coord': shift_coord, 'font': font_spec(font), 'encoding': encoding}
+        if isinstance(jobs, list):
+            n_jobs = len(jobs)
+            with timer.stage('manifest'):
+                jobs, records = skip_up_to_date(jobs, manifest, params)
+            if len(jobs) < n_jobs:
+                print('Skipping ' + str(n_jobs - len(jobs)) + ' frame(s) already up to date.')
+        else:
+            records = {}
+            jobs = _iter_todo(jobs, manifest, params, records, skipped, timer)
+
+    failed = []
+    try:
+        for job, err in iter_overlay_results(jobs, font, color, shift_coord, workers=workers, inflight=inflight,
+                                             encoding=encoding, timer=timer, film=film):
+            if err is not None:
+                failed.append((job, err))
+            elif manifest is not None:
+                manifest.update(job.output, records.pop(job.output))
+    finally:
+        if manifest is not None:
+            manifest.save()
+    if skipped[0]:
+        print('Skipped ' + str(skipped[0]) + ' frame(s) already up to date.')
+    return failed
+
+
+def iter_overlay_results(jobs, font, color, shift_coord, workers=1, ordered=True, inflight=None, encoding=None,
+                         timer=None, film=None):
+    """Annotate frames and yield (job, error message or None) as they complete.
+
+    Args:
+        jobs (list or iterable of OverlayJob): Frames to annotate.
+        font, color, shift_coord, workers, encoding, timer, film: See run_overlay_jobs.
+        ordered (bool, optional): If False, results are yielded in order of completion, which keeps all workers busy
+        when frames have very different costs. Ignored with a film, whose frames are written in order. Defaults to
+        True.
+        inflight (int, optional): If provided, run the frames in the current process with iter_pipeline_results,
+        with this maximum number of frames per queue. workers and ordered are then ignored. Defaults to None.
+    Yields:
+        2-tuples (job, error message), error message is None for successful frames.
+
+    """
+    params = {'color': color, 'shift_coord': shift_coord}
+    profile = timer is not None and timer.enabled
+    if film is not None:
+        # Workers return the encoded frames, appended here in order
+        encoding = dict(encoding or {}, film_format=film.format)
+        ordered = True
+
+    def result(job, err, data):
+        if err is None and film is not None:
+            film.append_encoded(data)
+        return job, err
+
+    if inflight is not None:
+        for job, err, data in iter_pipeline_results(jobs, font, color, shift_coord, inflight=inflight,
+                                                    encoding=encoding, timer=timer):
+            yield result(job, err, data)
+        return
+    if workers <= 1:
+        _init_worker(None, params, encoding, font=font, profile=profile)
+        for job in jobs:
+            err, samples, data = _run_job(job)
+            if profile:
+                timer.merge(samples)
+            yield result(job, err, data)
+        return
+    # The pool reads its input ahead in a thread: jobs not yet finished are kept in pending, at most slots of them
+    # for iterables so that streamed jobs are not all loaded in memory
+    pending = {}
+    slots = threading.Semaphore(len(jobs) if isinstance(jobs, list) else 4 * workers)
+
+    def feed():
+        for i, job in enumerate(jobs):
+            slots.acquire()
+            pending[i] = job
+            yield i, job
+
+    with Pool(processes=workers, initializer=_init_worker,
+              initargs=(font_spec(font), params, encoding, None, profile)) as pool:
+        # Workers return the index of the job along with the result
+        imap = pool.imap if ordered else pool.imap_unordered
+        for i, (err, samples, data) in imap(_run_indexed_job, feed()):
+            job = pending.pop(i)
+            slots.release()
+            if profile:
+                timer.merge(samples)
+            yield result(job, err, data)
+
+
+# ---------------------------------
+# Pipeline mode: decoding, drawing and encoding run in separate threads connected by bounded queues, so that disk
+# I/O and zlib (de)compression, which release the GIL in Pillow, overlap with drawing.
+
+_DONE = object()
+
+
+class _Failed:
+    """Exception raised while iterating over the items of a stage, forwarded to the next stages and to the consumer."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _put_all(items, out_queue, process):
+    """Stage of the pipeline: apply process to each (job, image, error) item and pass it to out_queue."""
+    try:
+        for job, im, err in items:
+            if err is None:
+                try:
+                    im = process(job, im)
+                except Exception:
+                    im, err = None, traceback.format_exc()
+            out_queue.put((job, im, err))
+    except BaseException as e:
+        # Failure of the items themselves (e.g. a tracks file found unsorted), not of a frame
+        out_queue.put(_Failed(e))
+    finally:
+        out_queue.put(_DONE)
+
+
+def _drain(in_queue):
+    """Iterate over the items of a queue until the end marker. Raise the exception of a failed stage."""
+    while True:
+        item = in_queue.get()
+        if item is _DONE:
+            return
+        if isinstance(item, _Failed):
+            raise item.error
+        yield item
+
+
+def iter_pipeline_results(jobs, font, color, shift_coord, inflight=8, encoding=None, timer=None):
+    """Annotate frames with a 3-stage threaded pipeline and yield the results in order of jobs.
+
+    Args:
+        jobs (list or iterable of OverlayJob): Frames to annotate.
+        font, color, shift_coord, encoding, timer: See run_overlay_jobs.
+        inflight (int, optional): Maximum number of frames waiting between 2 stages, bounds the memory used.
+        Defaults to 8.
+    Yields:
+        3-tuples (job, error message, encoded frame), error message is None for successful frames, encoded frame is
+        None unless encoding has a 'film_format' (see write_frame).
+
+    """
+    labels = LabelCache(font) if font is not None else None
+    timer = timer or StageTimer(enabled=False)
+
+    def decode(job, _):
+        if job.coord is None:
+            raise KeyError('No track found in the tracks table for image: ' + str(job.imfile))
+        with timer.stage('decode'):
+            return decode_frame(job.imfile, raw=job.display is not None)
+
+    def draw(job, im):
+        with timer.stage('convert'):
+            im = to_drawable(im, job.display)
+        with timer.stage('draw'):
+            return draw_job(job, im, font, labels, color=color, shift_coord=shift_coord)
+
+    def encode(job, im):
+        with timer.stage('encode'):
+            return write_frame(im, job.output, encoding)
+
+    decoded = queue.Queue(maxsize=inflight)
+    annotated = queue.Queue(maxsize=inflight)
+    results = queue.Queue(maxsize=inflight)
+    stages = [threading.Thread(target=_put_all, args=(((job, None, None) for job in jobs), decoded, decode)),
+              threading.Thread(target=_put_all, args=(_drain(decoded), annotated, draw)),
+              threading.Thread(target=_put_all, args=(_drain(annotated), results, encode))]
+    for stage in stages:
+        stage.daemon = True
+        stage.start()
+    for job, data, err in _drain(results):
+        yield job, err, data
+
+
+def report_errors(failed):
+    """Print the frames that could not be annotated. Return the number of failures."""
+    for job, err in failed:
+        print('Failed to annotate frame: ' + str(job.imfile) + '\n' + err)
+    if failed:
+        print(str(len(failed)) + ' frame(s) failed.')
+    return len(failed)
+
+
+# -----------------------------
+# Command line options and setup shared by script_overlay.py, script_overlay_cfg.py and script_overlay_batch.py
+
+
+def add_overlay_arguments(parser, single_run=True, defaults=True):
+    """Add the optional arguments of the overlay scripts to an argument parser.
+
+    Args:
+        parser (ArgumentParser): Parser of the script.
+        single_run (bool, optional): Whether to add the options of the scripts annotating a single folder: streaming
+        of the tracks file, workers, pipeline, film and profiling. Defaults to True.
+        defaults (bool, optional): Whether the columns and the shift have default values. script_overlay_cfg.py
+        leaves them to None, to take them from the config file. Defaults to True.
+
+    """
+    parser.add_argument('-f', '--font_color', help='Font color of the overlaid text. Must be an integer (resp. a'
+                                                   ' 3-tuple of integers) between 0 and 255 if the image if 8-bits'
+                                                   ' grayscale (resp. 8-bits RGB). Default to white. Can also pass -1'
+                                                   ' to use default color.', type=int,
+                        default=-1, nargs='+')
+    parser.add_argument('-t', '--time', help='Name of time column in _tracks.csv file.', type=str,
+                        default='Image_Metadata_T' if defaults else None)
+    parser.add_argument('-i', '--id', help='Name of track ID column in _tracks.csv file.', type=str,
+                        default='track_id' if defaults else None)
+    parser.add_argument('-x', '--xpos', help='Name of x-position column in _tracks.csv file.', type=str,
+                        default='objNuclei_Location_Center_X' if defaults else None)
+    parser.add_argument('-y', '--ypos', help='Name of y-position column in _tracks.csv file.', type=str,
+                        default='objNuclei_Location_Center_Y' if defaults else None)
+    parser.add_argument('-s', '--shift', help='Shift the position of the writing. Useful to center writings in cells. \
+     Provide as 2 integers separated by a white space.',
+                        nargs=2, type=int, default=(-4, -5) if defaults else None)
+    parser.add_argument('--image_ext', help='Extension of the images to annotate: "png", or "tif" for .tif and .tiff \
+     files (e.g. 16-bit or multi-page). Other images in the folder are ignored. Not used for frame stacks.', type=str,
+                        choices=IMAGE_EXTENSIONS, default='png')
+
+    # Cache of parsed _tracks.csv files
+    parser.add_argument('--no_cache', help='Do not read nor write the on-disk cache of parsed _tracks.csv files.',
+                        action='store_true')
+    parser.add_argument('--rebuild_cache', help='Parse the _tracks.csv files again and overwrite their cache entry.',
+                        action='store_true')
+
+    if single_run:
+        # Streaming of large _tracks.csv files
+        parser.add_argument('--stream', help='Read the _tracks.csv file by chunks and hold only the rows of the \
+         current frame in memory, instead of loading the whole table. For very large files, e.g. the export of a full \
+         plate. Not compatible with --tails.', action='store_true')
+        parser.add_argument('--chunk_rows', help='With --stream, number of rows parsed at once.', type=int,
+                            default=DEFAULT_CHUNK_ROWS)
+        parser.add_argument('--where', help='With --stream, only use the rows with this value in this column, e.g. \
+         "--where Metadata_Well B02". Can be repeated.', nargs=2, action='append', default=None,
+                            metavar=('COLUMN', 'VALUE'))
+        parser.add_argument('--external_sort', help='With --stream, what to do if the file is not sorted by time: \
+         "auto" reads the time column once to check it and sorts the file on disk if needed, "never" stops with an \
+         error, "always" sorts without checking.', type=str, choices=EXTERNAL_SORT, default='auto')
+
+        # Parallel execution
+        parser.add_argument('-w', '--workers', help='Number of worker processes annotating frames in parallel.',
+                            type=int, default=1)
+        parser.add_argument('--pipeline', help='Run decoding, drawing and encoding of frames as 3 threads connected \
+         by queues holding at most the given number of frames. Useful when the file system is slow. Replaces \
+         --workers.', type=int, default=None, metavar='INFLIGHT')
+
+    # Encoding of the output images
+    parser.add_argument('--frame_format', help='Format of the output images: "png", "tiff" (uncompressed), "jpeg" \
+     (lossy, for previews) or "npy" (raw pixels). See script_encoding_bench.py to compare them on your images.',
+                        type=str, choices=FRAME_FORMATS, default='png')
+    parser.add_argument('--compress_level', help='zlib compression level of png outputs, from 0 (fastest) to 9 \
+     (smallest). Defaults to Pillow default (6).', type=int, default=None)
+    parser.add_argument('--quality', help='Quality of jpeg outputs, from 1 to 95. Defaults to Pillow default (75).',
+                        type=int, default=None)
+
+    if single_run:
+        # Animated film instead of images
+        parser.add_argument('--film', help='Write the annotated frames into a single animated film "ovl_film" in the \
+         output folder, as they are produced, instead of one image per frame: "apng" (lossless), "gif" (256 colors \
+         per frame) or "avi" (Motion JPEG, see --quality). The film is always regenerated.', type=str,
+                            choices=ANIMATED_FORMATS, default=None)
+        parser.add_argument('--fps', help='Frame rate of the film.', type=float, default=DEFAULT_FPS)
+
+    # Markers and trajectory tails
+    parser.add_argument('--markers', help='Draw a marker at each tracked position: "plus", "cross", "square" \
+     (outline) or "disk" (filled).', type=str, choices=MARKERS, default=None)
+    parser.add_argument('--marker_size', help='Size of the markers in pixels: length of the arms, half side of the \
+     square or radius of the disk.', type=int, default=3)
+    parser.add_argument('--tails', help='Draw the trajectory of each track through its last positions, the current \
+     one included. E.g. 10 joins the positions of the last 10 detections of each track.', type=int, default=0)
+    parser.add_argument('--mark_color', help='Color of markers and tails, same format as --font_color. Defaults to \
+     the font color.', type=int, nargs='+', default=None)
+    parser.add_argument('--no_labels', help='Do not write the track IDs, e.g. to draw only markers and tails.',
+                        action='store_true')
+
+    # Display of raw frames (16-bit, multi-channel TIFF)
+    parser.add_argument('--display_range', help='Fixed contrast of raw frames: intensities shown as black and as full \
+     intensity, 2 numbers for all channels or 2 numbers per channel. Frames which are not 8-bit grayscale or RGB are \
+     scaled at percentiles by default, see --percentiles.', nargs='+', type=float, default=None)
+    parser.add_argument('--percentiles', help='Contrast of raw frames given by a lower and an upper percentile of the \
+     intensities of each channel, computed once per folder over frames sampled in its whole stack. Defaults to 0.1 \
+     99.9 for frames which are not 8-bit grayscale or RGB.', nargs=2, type=float, default=None)
+    parser.add_argument('--colors', help='Pseudocolor of each channel, channels are merged into an RGB image. By \
+     default, a single channel is gray and the pages of multi-page TIFF are red, green, blue...', nargs='+', type=str,
+                        choices=COLORS, default=None)
+    parser.add_argument('--display_samples', help='Number of frames sampled to compute the percentiles.', type=int,
+                        default=16)
+
+    # Incremental runs
+    parser.add_argument('--force', help='Regenerate all outputs. By default, outputs recorded as up to date in the \
+     manifest.json of the output folder are skipped.', action='store_true')
+
+    if single_run:
+        # Profiling
+        parser.add_argument('--profile', help='Print the time spent in each stage (csv parsing, listing of the \
+         frames, decoding, conversion to an 8-bit image, drawing, encoding): total, mean and 95th percentile per \
+         frame.', action='store_true')
+        parser.add_argument('--metrics', help='Write the stage timings to this .json file. Implies --profile.',
+                            type=str, default=None)
+        parser.add_argument('--cprofile', help='Run the annotation loop under cProfile and dump the statistics to \
+         this file. Only the main process is profiled, use with 1 worker or --pipeline.', type=str, default=None)
+
+
+def marks_from_args(args):
+    """Style of markers and tails requested by the arguments, see build_overlay_jobs. None if nothing is marked."""
+    if args.markers is None and args.tails == 0:
+        return None
+    marks = {'marker': args.markers, 'size': args.marker_size}
+    if args.mark_color is not None:
+        marks['color'] = args.mark_color[0] if len(args.mark_color) == 1 else tuple(args.mark_color)
+    return marks
+
+
+def display_from_args(source, args):
+    """Scaling of the raw frames of source requested by the arguments, see display.display_for_source."""
+    return display_for_source(source, display_range=args.display_range, percentiles=args.percentiles,
+                              colors=args.colors, n_samples=args.display_samples)
+
+
+def encoding_from_args(args):
+    """Encoding of the output images requested by the arguments, see write_frame."""
+    return {'frame_format': args.frame_format, 'compress_level': args.compress_level, 'quality': args.quality}
+
+
+def run_overlay(args, font, load_tracks=load_track_table, open_source=open_frame_source, script=None):
+    """Annotate the frames of a folder as requested by the arguments of script_overlay.py or script_overlay_cfg.py.
+
+    Args:
+        args: Parsed arguments, see add_overlay_arguments. Paths are relative to the current directory, which is
+        changed to args.in_wd.
+        font (FreeTypeFont): Font of the labels.
+        load_tracks (function, optional): Loader of the tracks table, same arguments as track_table.load_track_table.
+        Defaults to load_track_table.
+        open_source (function, optional): Opener of the frames, same arguments as frame_stack.open_frame_source. Used
+        to compute the display range. Defaults to open_frame_source.
+        script (str, optional): Name of the script, recorded in the metrics file. Defaults to None.
+    Returns:
+        The number of frames that could not be annotated.
+
+    """
+    timer = StageTimer(enabled=args.profile or args.metrics is not None)
+    # Profiling outputs are relative to the directory the script is launched from
+    metrics_file = None if args.metrics is None else os.path.abspath(args.metrics)
+    cprofile_file = None if args.cprofile is None else os.path.abspath(args.cprofile)
+
+    os.chdir(args.in_wd)
+    # If output folder does not exist, create it
+    if not os.path.exists(args.in_out):
+        print('Creating output directory: ' + args.in_wd + args.in_out)
+        os.makedirs(args.in_out)
+
+    # Match name of the file that ends with _tracks.csv
+    for file in os.listdir(args.in_tracks):
+        if re.search('_tracks\.csv', file):
+            csvfi = args.in_tracks + '/' + file
+            if args.stream:
+                # Parsed frame by frame while annotating
+                break
+            with timer.stage('csv_parse'):
+                tracks = load_tracks(csvfi=csvfi,
+                                     time_col=args.time,
+                                     id_col=args.id,
+                                     xpos_col=args.xpos,
+                                     ypos_col=args.ypos,
+                                     use_cache=not args.no_cache,
+                                     rebuild=args.rebuild_cache)
+            break
+
+    # Identify right image and annotate it, one job per frame
+    encoding = encoding_from_args(args)
+    with timer.stage('display_range'):
+        # Contrast of raw frames, computed once for the whole stack
+        source = open_source(args.in_im, args.image_ext)
+        display = display_from_args(source, args)
+    if display is not None:
+        print('Display scaling of the frames: ' + str(display.params()))
+    # Markers and tails, drawn below the labels
+    marks = marks_from_args(args)
+    if args.stream:
+        if args.tails > 0:
+            raise ValueError('--tails needs the whole tracks table and cannot be used with --stream.')
+        # Jobs are created lazily, as the frames of the tracks file are read
+        stream = iter_frames(csvfi, time_col=args.time, id_col=args.id, xpos_col=args.xpos, ypos_col=args.ypos,
+                             where=dict(args.where or []), chunk_rows=args.chunk_rows,
+                             external_sort=args.external_sort)
+        jobs = iter_stream_jobs(stream, in_im=args.in_im, in_out=args.in_out, frame_format=args.frame_format,
+                                display=display, marks=marks, labels=not args.no_labels,
+                                image_ext=args.image_ext)
+    else:
+        with timer.stage('list_frames'):
+            jobs = build_overlay_jobs(tracks, in_im=args.in_im, in_out=args.in_out, frame_format=args.frame_format,
+                                      display=display, marks=marks, tail=args.tails, labels=not args.no_labels,
+                                      image_ext=args.image_ext)
+    film = None
+    if args.film is not None:
+        # Frames are appended to the film in order, the manifest of the images is not used
+        film = open_animation(args.in_out + '/ovl_film', args.film, fps=args.fps, quality=args.quality,
+                              compress_level=args.compress_level)
+    try:
+        with profile_block(cprofile_file):
+            failed = run_overlay_jobs(jobs, font=font, color=args.font_color, shift_coord=args.shift,
+                                      workers=args.workers,
+                                      manifest=Manifest(args.in_out, force=args.force) if film is None else None,
+                                      inflight=args.pipeline, encoding=encoding, timer=timer, film=film)
+    except BaseException:
+        # A film interrupted before its end has incomplete headers
+        if film is not None:
+            film.abort()
+        raise
+    if film is not None:
+        film.close()
+        print('Film of ' + str(film.n_frames) + ' frame(s) written to: ' + film.path)
+    if timer.enabled:
+        timer.report(n_frames=len(source.frames))
+        if metrics_file is not None:
+            timer.write_json(metrics_file, script=script, frames=len(source.frames),
+                             workers=args.workers, pipeline=args.pipeline, encoding=encoding)
+            print('Metrics written to: ' + metrics_file)
+    return report_errors(failed)
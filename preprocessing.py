@@ -0,0 +1,309 @@
+# Preprocessing of tracking tables, replaces preprocessing.R and select_random_save.R.
+#
+# 1) Select only full trajectories: tracks with as many rows as the longest track (".N == max(N)" by uniqID).
+# 2) Impute missing measurements by linear interpolation inside each trajectory, like imputeTS::na.interpolation:
+#    gaps are interpolated along the rows of the track, leading and trailing gaps take the first and last measured value.
+# 3) Save one table per condition with a random subset of trajectories.
+# The input is read in 2 passes with csv.reader: the first pass only counts the rows of each track, the second pass only
+# keeps the rows of the selected tracks. Imputation works on numpy columns for all tracks at once.
+# Values which are not imputed are written back exactly as read.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, csv
+import numpy as np
+
+NA_STRINGS = ('', 'NA', 'NaN', 'nan', 'NAN', 'None')
+DEFAULT_ID_COLS = ('Image_Metadata_Well', 'Image_Metadata_Site', 'track_id')
+
+
+def _uid_getter(header, uniq_col, id_cols):
+    """Function extracting the unique track ID of a row: column uniq_col if present, otherwise id_cols pasted with "_"."""
+    if uniq_col in header:
+        i_uid = header.index(uniq_col)
+        return lambda row: row[i_uid]
+    missing = [col for col in id_cols if col not in header]
+    if missing:
+        raise ValueError('Column ' + uniq_col + ' is absent and cannot be built, missing columns: ' + ', '.join(missing) +
+                         '; Found: ' + ', '.join(header))
+    i_ids = [header.index(col) for col in id_cols]
+    return lambda row: '_'.join([row[i] for i in i_ids])
+
+
+def scan_tracks(csvfi, uniq_col='uniqID', id_cols=DEFAULT_ID_COLS, cond_col=None):
+    """First pass over a csv file: number of rows and condition of each track.
+
+    Args:
+        csvfi (str): Path to the csv file.
+        uniq_col (str, optional): Column with unique track IDs. If absent from the file, IDs are built by pasting
+        id_cols with "_", as in preprocessing.R. Defaults to 'uniqID'.
+        id_cols (tuple of str, optional): Columns identifying a track. Defaults to well, site and track_id.
+        cond_col (str, optional): Column with the condition of each track, used for stratified sampling. Defaults to
+        None (all tracks in one condition).
+    Returns:
+        A 2-tuple of dictionaries, ordered by first appearance of the tracks: number of rows by track ID, condition by
+        track ID (None if cond_col is None).
+
+    """
+    counts, conditions = {}, {}
+    with open(csvfi, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        uid = _uid_getter(header, uniq_col, id_cols)
+        if cond_col is not None and cond_col not in header:
+            raise ValueError('Condition column ' + cond_col + ' not found. Found: ' + ', '.join(header))
+        i_cond = header.index(cond_col) if cond_col is not None else None
+        for row in reader:
+            if not row:
+                continue
+            track = uid(row)
+            if track in counts:
+                counts[track] += 1
+            else:
+                counts[track] = 1
+                conditions[track] = row[i_cond] if i_cond is not None else None
+    return counts, conditions
+
+
+def complete_tracks(counts):
+    """IDs of the tracks with the maximal number of rows, in order of first appearance."""
+    if not counts:
+        return []
+    n_max = max(counts.values())
+    return [track for track, n in counts.items() if n == n_max]
+
+
+def sample_tracks(tracks, conditions, ntraj, min_obs=None, counts=None, seed=None):
+    """Draw a random subset of tracks in each condition, without replacement.
+
+    Args:
+        tracks (list of str): Candidate track IDs.
+        conditions (dict): Condition of each track, see scan_tracks.
+        ntraj (int): Number of tracks per condition. Conditions with fewer candidates keep all of them.
+        min_obs (int, optional): Minimum number of rows of a candidate. Requires counts. Defaults to None.
+        counts (dict, optional): Number of rows of each track, see scan_tracks. Defaults to None.
+        seed (int, optional): Seed of the random generator. Defaults to None.
+    Returns:
+        A dictionary {condition: list of sampled track IDs}, conditions in order of first appearance. Sampled IDs keep
+        the order of tracks.
+
+    """
+    rng = np.random.default_rng(seed)
+    if min_obs is not None:
+        tracks = [track for track in tracks if counts[track] >= min_obs]
+    strata = {}
+    for track in tracks:
+        strata.setdefault(conditions[track], []).append(track)
+    samples = {}
+    for condition, candidates in strata.items():
+        if len(candidates) > ntraj:
+            keep = np.sort(rng.choice(len(candidates), size=ntraj, replace=False))
+            candidates = [candidates[i] for i in keep]
+        elif len(candidates) < ntraj:
+            print('Condition ' + str(condition) + ': only ' + str(len(candidates)) + ' trajectories available, ' +
+                  str(ntraj) + ' requested.')
+        samples[condition] = candidates
+    return samples
+
+
+def read_tracks(csvfi, tracks, uniq_col='uniqID', id_cols=DEFAULT_ID_COLS):
+    """Second pass over a csv file: keep the rows of some tracks only.
+
+    Args:
+        csvfi (str): Path to the csv file.
+        tracks (collection of str): IDs of the tracks to keep.
+        uniq_col, id_cols: See scan_tracks.
+    Returns:
+        A dictionary {column name: numpy array of str}, in the order of the columns of the file. A column uniq_col is
+        appended if it is not in the file.
+
+    """
+    tracks = set(tracks)
+    with open(csvfi, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        uid = _uid_getter(header, uniq_col, id_cols)
+        build_uid = uniq_col not in header
+        rows = []
+        for row in reader:
+            if row:
+                track = uid(row)
+                if track in tracks:
+                    rows.append(row + [track] if build_uid else row)
+    names = header + [uniq_col] if build_uid else header
+    values = list(zip(*rows)) if rows else [[] for _ in names]
+    return {name: np.asarray(column, dtype=str) for name, column in zip(names, values)}
+
+
+def to_float(values):
+    """Convert an array of str to float64, NA_STRINGS become NaN. Raise ValueError if a value is not a number."""
+    values = np.asarray(values, dtype=str)
+    out = np.full(values.shape, np.nan)
+    measured = ~np.isin(values, NA_STRINGS)
+    out[measured] = values[measured].astype(np.float64)
+    return out
+
+
+def numeric_columns(columns, exclude=()):
+    """Names of the columns whose values are all numbers or NA, except exclude."""
+    names = []
+    for name, values in columns.items():
+        if name in exclude:
+            continue
+        try:
+            to_float(values)
+        except ValueError:
+            continue
+        names.append(name)
+    return names
+
+
+def interpolate_gaps(values, groups):
+    """Linear interpolation of NaN inside groups of consecutive rows, like imputeTS::na.interpolation on each group.
+
+    Gaps are interpolated along the rows (not the time values). Leading (resp. trailing) NaN of a group take the first
+    (resp. last) measured value of the group. Groups without any measure stay NaN.
+
+    Args:
+        values (numpy array of float): Values, rows of a group must be contiguous and in time order.
+        groups (numpy array): Group of each row.
+    Returns:
+        A new array with imputed values.
+
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n == 0:
+        return values.copy()
+    idx = np.arange(n)
+    # First and last row of the group of each row
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = groups[1:] != groups[:-1]
+    start = np.maximum.accumulate(np.where(new_group, idx, 0))
+    end_group = np.append(new_group[1:], True)
+    end = np.minimum.accumulate(np.where(end_group, idx, n - 1)[::-1])[::-1]
+    # Previous and next measured row, if inside the group
+    measured = ~np.isnan(values)
+    prev = np.maximum.accumulate(np.where(measured, idx, -1))
+    nxt = np.minimum.accumulate(np.where(measured, idx, n)[::-1])[::-1]
+    has_prev = prev >= start
+    has_next = nxt <= end
+    prev_value = values[np.clip(prev, 0, n - 1)]
+    next_value = values[np.clip(nxt, 0, n - 1)]
+    both = has_prev & has_next & (nxt > prev)
+    weight = np.where(both, (idx - prev) / np.where(both, nxt - prev, 1), 0)
+    out = np.where(both, prev_value + weight * (next_value - prev_value), np.nan)
+    out = np.where(has_prev & ~has_next, prev_value, out)
+    out = np.where(~has_prev & has_next, next_value, out)
+    out[measured] = values[measured]
+    return out
+
+
+def impute_columns(columns, names, uniq_col='uniqID', time_col='Image_Metadata_T'):
+    """Interpolate the missing values of some columns inside each track, in place.
+
+    Args:
+        columns (dict): Output of read_tracks.
+        names (list of str): Columns to impute.
+        uniq_col (str, optional): Column with unique track IDs. Defaults to 'uniqID'.
+        time_col (str, optional): Column with time, gives the order of the rows of a track. Defaults to
+        'Image_Metadata_T'.
+    Returns:
+        Number of imputed values by column.
+
+    """
+    n_imputed = {}
+    if len(columns[uniq_col]) == 0:
+        return {name: 0 for name in names}
+    # Rows grouped by track, in time order within a track
+    order = np.lexsort((to_float(columns[time_col]), columns[uniq_col]))
+    groups = columns[uniq_col][order]
+    for name in names:
+        values = to_float(columns[name])
+        missing = np.isnan(values)
+        n_imputed[name] = 0
+        if not missing.any():
+            continue
+        imputed = np.empty_like(values)
+        imputed[order] = interpolate_gaps(values[order], groups)
+        filled = missing & ~np.isnan(imputed)
+        # Values not imputed are kept as read, imputed ones are written with 15 significant digits like R
+        text = columns[name].astype(object)
+        text[filled] = ['%.15g' % v for v in imputed[filled]]
+        text[missing & ~filled] = 'NA'
+        columns[name] = text.astype(str)
+        n_imputed[name] = int(filled.sum())
+    return n_imputed
+
+
+def write_columns(path, columns, names, rows=None):
+    """Write some columns to a csv file, without quotes when possible.
+
+    Args:
+        path (str): Path of the csv file.
+        columns (dict): Columns of the table, arrays of str.
+        names (list of str): Columns to write, in order.
+        rows (numpy array, optional): Boolean mask or indices of the rows to write. Defaults to all rows.
+    Returns:
+        Number of rows written.
+
+    """
+    data = [columns[name] if rows is None else columns[name][rows] for name in names]
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        writer.writerows(zip(*data))
+    return len(data[0]) if data else 0
+
+
+def preprocess(csvfi, out_dir, ntraj=None, cond_col=None, impute=None, keep_incomplete=False, min_obs=None,
+               uniq_col='uniqID', id_cols=DEFAULT_ID_COLS, time_col='Image_Metadata_T', drop=(), seed=None,
+               prefix='condition'):
+    """Select complete tracks, impute missing values and save random subsets of tracks, per condition.
+
+    Args:
+        csvfi (str): Path to the csv file with one row per track and per frame.
+        out_dir (str): Folder where output tables are written. Created if it does not exist.
+        ntraj (int, optional): Number of tracks sampled per condition. Defaults to None (all tracks).
+        cond_col (str, optional): Column with the condition of the tracks, one table is written per condition.
+        Defaults to None, i.e. one table.
+        impute (list of str, optional): Columns to impute. Defaults to None, all numeric columns except track IDs,
+        time and condition.
+        keep_incomplete (bool, optional): If True, do not remove tracks shorter than the longest one. Defaults to False.
+        min_obs (int, optional): Minimum number of rows of a sampled track. Defaults to None.
+        uniq_col, id_cols: See scan_tracks.
+        time_col (str, optional): Name of the time column. Defaults to 'Image_Metadata_T'.
+        drop (tuple of str, optional): Columns not written in the outputs. Defaults to ().
+        seed (int, optional): Seed of the random sampling. Defaults to None.
+        prefix (str, optional): Outputs are named prefix1.csv, prefix2.csv... in order of first appearance of the
+        conditions. Defaults to 'condition'.
+    Returns:
+        A list of dictionaries, one per output: path, condition, number of tracks and rows, imputed values per column.
+
+    """
+    counts, conditions = scan_tracks(csvfi, uniq_col=uniq_col, id_cols=id_cols, cond_col=cond_col)
+    tracks = list(counts) if keep_incomplete else complete_tracks(counts)
+    if ntraj is None:
+        strata = {}
+        for track in tracks:
+            strata.setdefault(conditions[track], []).append(track)
+    else:
+        strata = sample_tracks(tracks, conditions, ntraj, min_obs=min_obs, counts=counts, seed=seed)
+
+    columns = read_tracks(csvfi, [track for selected in strata.values() for track in selected], uniq_col=uniq_col,
+                          id_cols=id_cols)
+    if impute is None:
+        impute = numeric_columns(columns, exclude=set(id_cols) | {uniq_col, time_col, cond_col})
+    n_imputed = impute_columns(columns, impute, uniq_col=uniq_col, time_col=time_col)
+
+    # Same columns as select_random_save: unique ID, time, then the other columns
+    names = [uniq_col, time_col] + [name for name in columns if name not in (uniq_col, time_col) and name not in drop]
+    os.makedirs(out_dir, exist_ok=True)
+    outputs = []
+    for i, (condition, selected) in enumerate(strata.items()):
+        path = os.path.join(out_dir, prefix + str(i + 1) + '.csv')
+        n_rows = write_columns(path, columns, names, rows=np.isin(columns[uniq_col], selected))
+        outputs.append({'path': path, 'condition': condition, 'tracks': len(selected), 'rows': n_rows,
+                        'imputed': n_imputed})
+    return outputs
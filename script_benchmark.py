@@ -0,0 +1,297 @@
+# Script usage:
+#
+# python3 path/to/script_benchmark.py
+#
+# Measure the throughput of the scripts on a synthetic well (see synthetic_data.py), or on an existing well folder with
+# --well: parse rate of the _tracks.csv file, frames per second of script_overlay.py and script_cropfilm.py, and peak
+# memory (RSS) of each of them. Every measure runs in a fresh process, best time over --repeat runs.
+# Results can be written to a .json file with --json, and compared to the .json file of another commit with --compare.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, sys, json, time, shutil, argparse, platform, tempfile, threading, subprocess
+import numpy as np
+from synthetic_data import make_well, IMAGE_MODES
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CSV_READERS = ('read_csv_track', 'from_csv', 'cache')
+
+
+def parseArguments_benchmark():
+    # Create argument parser
+    parser = argparse.ArgumentParser(description='Benchmark csv parsing, overlay and crop throughput.')
+
+    # Dataset
+    parser.add_argument('--well', help='Existing well folder to benchmark, with a _tracks.csv file in tables/ and \
+     .png images in segmented/. Defaults to a synthetic well, see the options below.', type=str, default=None)
+    parser.add_argument('-f', '--frames', help='Number of frames of the synthetic well.', type=int, default=50)
+    parser.add_argument('-k', '--tracks', help='Number of tracks of the synthetic well.', type=int, default=200)
+    parser.add_argument('-s', '--size', help='Width and height of the synthetic frames.', nargs=2, type=int,
+                        default=(512, 512))
+    parser.add_argument('-m', '--mode', help='PIL mode of the synthetic frames.', type=str, choices=IMAGE_MODES,
+                        default='L')
+
+    # Measures
+    parser.add_argument('-w', '--workers', help='Numbers of worker processes for the overlay, several values can be \
+     provided.', nargs='+', type=int, default=[1])
+    parser.add_argument('-c', '--crop_tracks', help='Number of tracks cropped by script_cropfilm.py.', type=int,
+                        default=20)
+    parser.add_argument('-r', '--repeat', help='Number of runs of each measure, the fastest is kept.', type=int,
+                        default=3)
+
+    # Outputs
+    parser.add_argument('--json', help='Write the results to this .json file.', type=str, default=None)
+    parser.add_argument('--compare', help='.json file of a previous run, e.g. on another commit. Prints the ratio of \
+     the rates.', type=str, default=None)
+    parser.add_argument('--keep', help='Keep the synthetic well and the outputs in this folder instead of a temporary \
+     one.', type=str, default=None)
+
+    # Parse arguments
+    args = parser.parse_args()
+    args.size = tuple(args.size)
+
+    return args
+
+
+# -----------------------------
+
+
+def _process_tree(pid):
+    """IDs of a process and of all its descendants, from /proc."""
+    parents = {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open('/proc/' + name + '/stat') as f:
+                    # The process name may contain spaces and parentheses, the parent ID follows its state
+                    parents[int(name)] = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    tree, todo = [], [pid]
+    while todo:
+        current = todo.pop()
+        tree.append(current)
+        todo.extend([child for child, parent in parents.items() if parent == current])
+    return tree
+
+
+def _peak_rss(pid):
+    """Largest VmHWM (peak RSS) in kB among a process and its descendants, 0 if they have exited."""
+    peak = 0
+    for member in _process_tree(pid):
+        try:
+            with open('/proc/' + str(member) + '/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        peak = max(peak, int(line.split()[1]))
+                        break
+        except OSError:
+            continue
+    return peak
+
+
+def run_measured(cmd, cwd=None, interval=0.01):
+    """Run a command in a new process and measure it.
+
+    The peak RSS is sampled from /proc while the command runs: os.wait4 is not used because on Linux its ru_maxrss
+    keeps the peak of the benchmark process itself across fork and exec.
+
+    Args:
+        cmd (list of str): Command line.
+        cwd (str, optional): Working directory of the command. Defaults to the current directory.
+        interval (float, optional): Time between two samples of the peak RSS, in seconds. A peak reached less than
+        interval before a process exits can be missed. Defaults to 0.01.
+    Returns:
+        A 3-tuple (wall time in seconds, largest peak RSS in MB of the process and of its worker processes, standard
+        output). The peak RSS is None on systems without /proc (Windows, macOS). Raises RuntimeError if the command
+        fails.
+
+    """
+    env = dict(os.environ, PYTHONPATH=HERE + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    sample = os.path.isfile('/proc/self/status')
+    with tempfile.TemporaryFile() as out:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=out, stderr=subprocess.STDOUT)
+        # Sampled in a thread, so that the wall time is not rounded to the interval
+        peaks, done = [0], threading.Event()
+
+        def watch():
+            while not done.wait(interval):
+                peaks.append(_peak_rss(proc.pid))
+
+        watcher = threading.Thread(target=watch)
+        watcher.daemon = True
+        if sample:
+            watcher.start()
+        proc.wait()
+        seconds = time.perf_counter() - start
+        done.set()
+        if sample:
+            watcher.join()
+        peak_kb = max(peaks)
+        out.seek(0)
+        output = out.read().decode(errors='replace')
+    if proc.returncode != 0:
+        raise RuntimeError('Benchmark command failed: ' + ' '.join(cmd) + '\n' + output)
+    return seconds, (peak_kb / 1024 if sample else None), output
+
+
+def best_of(repeat, cmd, cwd=None):
+    """Fastest of repeat runs of run_measured, with the largest peak RSS."""
+    runs = [run_measured(cmd, cwd=cwd) for _ in range(repeat)]
+    seconds = min([run[0] for run in runs])
+    peaks = [run[1] for run in runs if run[1] is not None]
+    return seconds, (max(peaks) if peaks else None), runs[-1][2]
+
+
+def child_csv_parse(csvfi, reader):
+    """Parse csvfi with one of CSV_READERS and print the parse time and number of rows as json. Run in a new process.
+
+    'read_csv_track' is the dictionary interface of script_overlay.py, 'from_csv' parses into a TrackTable, 'cache'
+    reads the on-disk cache written by load_track_table (built beforehand if missing).
+    """
+    from track_table import TrackTable, load_track_table
+    from script_overlay import read_csv_track
+    columns = dict(time_col='Image_Metadata_T', id_col='track_id', xpos_col='objNuclei_Location_Center_X',
+                   ypos_col='objNuclei_Location_Center_Y')
+    if reader == 'cache':
+        load_track_table(csvfi, **columns)
+    start = time.perf_counter()
+    if reader == 'read_csv_track':
+        n_rows = sum([len(frame) for frame in read_csv_track(csvfi, **columns).values()])
+    elif reader == 'from_csv':
+        n_rows = len(TrackTable.from_csv(csvfi, **columns).time)
+    else:
+        table = load_track_table(csvfi, **columns)
+        # Touch the memory maps, so that the cost of reading is included
+        float(table.x.sum() + table.y.sum())
+        n_rows = len(table.time)
+    print(json.dumps({'seconds': time.perf_counter() - start, 'rows': n_rows}))
+
+
+def find_tracks_csv(tables):
+    """Path of the first file ending by _tracks.csv in a folder."""
+    for file in sorted(os.listdir(tables)):
+        if file.endswith('_tracks.csv'):
+            return os.path.join(tables, file)
+    raise ValueError('No file ending by "_tracks.csv" found in: ' + tables)
+
+
+def first_track_ids(csvfi, n):
+    """The n most frequent track IDs of a _tracks.csv file."""
+    from track_table import TrackTable
+    table = TrackTable.from_csv(csvfi, time_col='Image_Metadata_T', id_col='track_id',
+                                xpos_col='objNuclei_Location_Center_X', ypos_col='objNuclei_Location_Center_Y')
+    ids, counts = np.unique(table.track_id, return_counts=True)
+    return [str(track_id) for track_id in ids[np.argsort(-counts, kind='stable')][:n]]
+
+
+def run_benchmarks(well, out, workers=(1,), crop_tracks=20, repeat=3):
+    """Run all measures on a well folder.
+
+    Args:
+        well (str): Well folder with tables/ and segmented/ subfolders.
+        out (str): Folder where outputs are written, emptied between runs.
+        workers (list of int, optional): Numbers of worker processes of the overlay. Defaults to (1,).
+        crop_tracks (int, optional): Number of tracks cropped. Defaults to 20.
+        repeat (int, optional): Number of runs of each measure, the fastest is kept. Defaults to 3.
+    Returns:
+        A list of dictionaries, one per measure: name, seconds, rate, unit of the rate, peak RSS in MB.
+
+    """
+    csvfi = find_tracks_csv(os.path.join(well, 'tables'))
+    n_frames = len([f for f in os.listdir(os.path.join(well, 'segmented')) if f.endswith('.png')])
+    results = []
+
+    # Parse rate of the tracks table, timed inside the process to leave out interpreter startup and imports
+    for reader in CSV_READERS:
+        seconds, peak_rss = None, None
+        for _ in range(repeat):
+            _, rss, output = run_measured([sys.executable, '-c', 'import sys, script_benchmark; '
+                                           'script_benchmark.child_csv_parse(sys.argv[1], sys.argv[2])',
+                                           csvfi, reader])
+            measure = json.loads(output.strip().splitlines()[-1])
+            seconds = measure['seconds'] if seconds is None else min(seconds, measure['seconds'])
+            peak_rss = rss if peak_rss is None else max(peak_rss, rss)
+        results.append({'name': 'csv_' + reader, 'seconds': seconds, 'rate': measure['rows'] / seconds,
+                        'unit': 'rows/s', 'peak_rss_mb': peak_rss})
+
+    # Whole scripts, timed from the outside: includes startup and parsing (--no_cache) as seen by users
+    for w in workers:
+        shutil.rmtree(out, ignore_errors=True)
+        seconds, peak_rss, _ = best_of(repeat, [sys.executable, os.path.join(HERE, 'script_overlay.py'), './',
+                                                'tables', 'segmented', out, '--force', '--no_cache', '-w', str(w)],
+                                       cwd=well)
+        results.append({'name': 'overlay_w' + str(w), 'seconds': seconds, 'rate': n_frames / seconds,
+                        'unit': 'frames/s', 'peak_rss_mb': peak_rss})
+
+    track_ids = first_track_ids(csvfi, crop_tracks)
+    for output in ('png', 'tiff', 'npy'):
+        shutil.rmtree(out, ignore_errors=True)
+        seconds, peak_rss, _ = best_of(repeat, [sys.executable, os.path.join(HERE, 'script_cropfilm.py'), './',
+                                                'tables', 'segmented', out] + track_ids +
+                                       ['-o', output, '--force', '--no_cache'], cwd=well)
+        results.append({'name': 'crop_' + output, 'seconds': seconds, 'rate': n_frames / seconds,
+                        'unit': 'frames/s', 'peak_rss_mb': peak_rss})
+    shutil.rmtree(out, ignore_errors=True)
+    return results
+
+
+def git_commit():
+    """Hash of the checked out commit of the repository, None if not available."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# -----------------------------
+
+
+if __name__ == "__main__":
+    # Read arguments
+    args = parseArguments_benchmark()
+
+    # Raw print arguments
+    print("You are running the script with arguments: ")
+    for a in args.__dict__:
+        print(str(a) + ": " + str(args.__dict__[a]))
+
+    work = args.keep if args.keep is not None else tempfile.mkdtemp(prefix='bench_')
+    try:
+        if args.well is None:
+            well = os.path.join(work, 'out_0001')
+            dataset = {'frames': args.frames, 'tracks': args.tracks, 'size': args.size, 'mode': args.mode}
+            print('Writing synthetic well in: ' + well)
+            make_well(well, n_frames=args.frames, n_tracks=args.tracks, width=args.size[0], height=args.size[1],
+                      mode=args.mode)
+        else:
+            well = os.path.abspath(args.well)
+            dataset = {'well': well}
+        results = run_benchmarks(well, os.path.join(work, 'bench_out'), workers=args.workers,
+                                 crop_tracks=args.crop_tracks, repeat=args.repeat)
+    finally:
+        if args.keep is None:
+            shutil.rmtree(work, ignore_errors=True)
+
+    report = {'commit': git_commit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+              'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'dataset': dataset, 'results': results}
+    previous = {}
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous = {result['name']: result for result in json.load(f)['results']}
+
+    print('\nmeasure\tseconds\trate\tpeak RSS (MB)' + ('\tvs ' + os.path.basename(args.compare) if previous else ''))
+    for result in results:
+        line = [result['name'], str(round(result['seconds'], 3)), str(round(result['rate'], 1)) + ' ' + result['unit'],
+                str(None if result['peak_rss_mb'] is None else round(result['peak_rss_mb'], 1))]
+        if previous:
+            old = previous.get(result['name'])
+            line.append('x' + str(round(result['rate'] / old['rate'], 2)) if old else '-')
+        print('\t'.join(line))
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=1)
+        print('Results written to: ' + args.json)
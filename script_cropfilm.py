@@ -7,17 +7,33 @@
 # subfold_png: subfolder of "work_fold", containing images to annotate with .png extension
 # subfold_out: subfolder of "work_fold", annotated images will be saved there.
 # track_id: ID of the cell to crop out from the images. Must correspond to entry in the column "track_id" in the csv table
-# Alternatively can crop around a fixed position using --pos x y
+# Alternatively can crop around a fixed position using --pos x y, or every cell inside a rectangle using --roi x0 y0 x1 y1
+# or every cell within a distance of a track using --near track_id radius
+# With --montage, crops are laid out in contact sheets instead: one per track with all its time points, or one per
+# frame with all the cells cropped in it.
+# With --shard_queue, several nodes sharing the folders split the crops: each node starts this script with the same
+# arguments and claims tasks (ranges of frames, or groups of films) from a work queue in a shared folder, see
+# work_queue.py.
 # Work with Python 3, not 2!
 
 # ---------------------------------
 
 import os, sys, re, argparse, warnings
-from script_overlay import read_csv_track
-from PIL import Image
+import numpy as np
+from track_table import load_track_table
+from frame_stack import IMAGE_EXTENSIONS, open_frame_source
+from crop_engine import Frame, crop_windows, window_to_image
+from film_writer import FILM_FORMATS, FILM_EXTENSIONS, ANIMATED_FORMATS, DEFAULT_FPS, open_film
+from manifest import Manifest, digest
+from encoding import FRAME_FORMATS, save_image, replace_extension
+from stage_timer import StageTimer, profile_block
+from display import COLORS, display_for_source
+from work_queue import WorkQueue, FailedTasks, frame_ranges, task_name
+from montage import MONTAGE_MODES, Sheet, run_montages
+from label_cache import DEFAULT_FONT
 
 
-def parseArguments_crop():
+def parseArguments_crop(argv=None):
     # Create argument parser
     parser = argparse.ArgumentParser()
 
@@ -27,7 +43,8 @@ def parseArguments_crop():
     parser.add_argument('in_tracks', help='Subfolder of "in_wd", containing one .csv file ending by "_tracks.csv".',
                         type=str)
     parser.add_argument('in_im', help='Subfolder of "in_wd", containing images to annotate with .png extension. Name of\
-                                      the files must end by "T[0-9]+.png", to indicate time of the image.', type=str)
+                                      the files must end by "T[0-9]+.png", to indicate time of the image.\
+                                      Can also be a frame stack created by script_pack_frames.py.', type=str)
     parser.add_argument('in_out', help='Subfolder of "in_wd", annotated images will be saved there.', type=str)
     # nargs='*' so that if not provided, reads position instead (optional positional argument)
     parser.add_argument('in_trackid', help='ID of the tracks to crop. Must correspond to entry in the column "track_id"\
@@ -39,6 +56,16 @@ def parseArguments_crop():
                                             'by white space',
                         nargs=2, type=int, default=None)
 
+    # Crop every cell found by a spatial query, in each frame
+    parser.add_argument('--roi', help='Instead of tracks IDs, crop every cell whose center is inside a rectangle, in \
+     each frame. Specified as 4 integers x0 y0 x1 y1 separated by white space, cells with x0 <= x < x1 and \
+     y0 <= y < y1 are cropped.', nargs=4, type=int, default=None)
+    parser.add_argument('--near', help='Instead of tracks IDs, crop every cell within a distance of a track, in each \
+     frame, the track included. Specified as a track ID and a radius in pixels separated by white space.', nargs=2,
+                        type=str, default=None)
+    parser.add_argument('--cell_size', help='Side in pixels of the grid cells of the spatial index used by --roi and \
+     --near. Only affects speed.', type=int, default=64)
+
     # Optional arguments for reading track file
     parser.add_argument('-t', '--time', help='Name of time column in _tracks.csv file.', type=str,
                         default='Image_Metadata_T')
@@ -50,10 +77,94 @@ def parseArguments_crop():
                         default='objNuclei_Location_Center_Y')
     parser.add_argument('-s', '--size', help='Define the size around the area of the cell center to crop. Must be \
      specify as 4 integers separated by a white space. Each integer give length of crop in direction: left, right, top,\
-     bottom respectively.', nargs=4, type=int, default=(25, 25, 25, 25))
+     bottom respectively. All crops have the same size, parts outside of the image are padded with 0.', nargs=4,
+                        type=int, default=(25, 25, 25, 25))
+
+    # Gaps of the tracks
+    parser.add_argument('--interpolate', help='At frames where a track is missing, crop around the position linearly \
+     interpolated between the surrounding detections instead of skipping the frame. Frames before the first or after \
+     the last detection of the track are still skipped.', action='store_true')
+
+    # Output format
+    parser.add_argument('-o', '--output', help='Output format. "png" writes one image per track and per frame, named \
+     "trackid_imagename". "tiff" (multi-page TIFF) and "npy" (stack of shape (T, H, W[, C]) with a .json sidecar giving \
+     the time of each frame) write a single film per track, named "trackid_film". "apng", "gif" and "avi" (Motion \
+     JPEG) write an animated film per track, played at --fps.', type=str, choices=('png',) + FILM_FORMATS,
+                        default='png')
+    parser.add_argument('--fps', help='Frame rate of "apng", "gif" and "avi" films.', type=float, default=DEFAULT_FPS)
+
+    # Contact sheets
+    parser.add_argument('--montage', help='Instead of one file per crop, write contact sheets: "track" puts every time \
+     point of a track in a grid ("trackid_montage"), "time" puts all the cells cropped in a frame in a grid \
+     ("montage_imagename"). Sheets are written with --frame_format.', type=str, choices=MONTAGE_MODES, default=None)
+    parser.add_argument('--columns', help='With --montage, number of columns of the grid. Defaults to a square grid.',
+                        type=int, default=None)
+    parser.add_argument('--gap', help='With --montage, pixels between the crops.', type=int, default=2)
+    parser.add_argument('--captions', help='With --montage, write the time ("track" sheets) or the track ID ("time" \
+     sheets) above each crop.', action='store_true')
+    parser.add_argument('--caption_font', help='TrueType font of the captions.', type=str, default=DEFAULT_FONT)
+    parser.add_argument('--caption_size', help='Size of the font of the captions.', type=int, default=10)
+    parser.add_argument('-w', '--workers', help='With --montage, number of worker processes rendering sheets in \
+     parallel.', type=int, default=1)
+    parser.add_argument('--sheets_per_job', help='With --montage, number of sheets rendered by a worker at once. Each \
+     job decodes all the frames its sheets need. Defaults to the number of sheets divided by the number of workers.',
+                        type=int, default=None)
+    parser.add_argument('--frame_format', help='With "-o png", format of the per-frame images: "png", "tiff" \
+     (uncompressed), "jpeg" (lossy, for previews) or "npy" (raw pixels). The extension of the output is changed \
+     accordingly.', type=str, choices=FRAME_FORMATS, default='png')
+    parser.add_argument('--compress_level', help='zlib compression level of png outputs, from 0 (fastest) to 9 \
+     (smallest). Defaults to Pillow default (6).', type=int, default=None)
+    parser.add_argument('--quality', help='Quality of jpeg outputs, from 1 to 95. Defaults to Pillow default (75).',
+                        type=int, default=None)
+
+    # Display of raw frames (16-bit, multi-channel TIFF)
+    parser.add_argument('--image_ext', help='Extension of the images of "in_im": "png", or "tif" for .tif and .tiff \
+     files. Other images in the folder are ignored. Not used for frame stacks.', type=str,
+                        choices=IMAGE_EXTENSIONS, default='png')
+    parser.add_argument('--display_range', help='Scale the crops to 8-bit images with a fixed contrast: intensities \
+     shown as black and as full intensity, 2 numbers for all channels or 2 numbers per channel. By default, raw pixels \
+     are cropped as they are.', nargs='+', type=float, default=None)
+    parser.add_argument('--percentiles', help='Scale the crops to 8-bit images with a contrast given by a lower and an \
+     upper percentile of the intensities of each channel, computed once over frames sampled in the whole stack.',
+                        nargs=2, type=float, default=None)
+    parser.add_argument('--colors', help='Scale the crops to 8-bit images with a pseudocolor for each channel, \
+     channels are merged into an RGB image. Contrast defaults to percentiles 0.1 99.9.', nargs='+', type=str,
+                        choices=COLORS, default=None)
+    parser.add_argument('--display_samples', help='Number of frames sampled to compute the percentiles.', type=int,
+                        default=16)
+
+    # Incremental runs
+    parser.add_argument('--force', help='Regenerate all outputs. By default, outputs recorded as up to date in the \
+     manifest.json of the output folder are skipped.', action='store_true')
+
+    # Profiling
+    parser.add_argument('--profile', help='Print the time spent in each stage (csv parsing, listing of the frames, \
+     decoding, cropping, encoding): total, mean and 95th percentile per frame.', action='store_true')
+    parser.add_argument('--metrics', help='Write the stage timings to this .json file. Implies --profile.', type=str,
+                        default=None)
+    parser.add_argument('--cprofile', help='Run the crop loop under cProfile and dump the statistics to this file.',
+                        type=str, default=None)
 
-    # Parse arguments
-    args = parser.parse_args()
+    # Cache of parsed _tracks.csv files
+    parser.add_argument('--no_cache', help='Do not read nor write the on-disk cache of parsed _tracks.csv files.',
+                        action='store_true')
+    parser.add_argument('--rebuild_cache', help='Parse the _tracks.csv file again and overwrite its cache entry.',
+                        action='store_true')
+
+    # Sharded execution on several nodes
+    parser.add_argument('--shard_queue', help='Folder of a work queue shared by several nodes, created if needed. \
+     Start the script with the same arguments on each node: the nodes claim ranges of frames (png output) or groups \
+     of films (film outputs) until all are done. Use a new folder for each run.', type=str, default=None)
+    parser.add_argument('--frames_per_task', help='With --shard_queue and png output, number of frames per task.',
+                        type=int, default=50)
+    parser.add_argument('--films_per_task', help='With --shard_queue and film outputs, number of films per task. A \
+     task decodes each frame once for all its films: larger groups decode less in total, smaller groups share the \
+     work more evenly between nodes and keep fewer films open at once.', type=int, default=20)
+    parser.add_argument('--lease', help='With --shard_queue, seconds after which the task of a node that stopped \
+     responding is claimed by another node.', type=float, default=600)
+
+    # Parse arguments, from the command line if argv is None
+    args = parser.parse_args(argv)
     args.size = tuple(args.size)
 
     return args
@@ -62,86 +173,350 @@ def parseArguments_crop():
 # -------------------------------
 
 
-if __name__ == "__main__":
-    # Read arguments
-    args = parseArguments_crop()
-    # Length of cropping frame left, right, top, bottom
-    crop_l, crop_r, crop_t, crop_b = args.size
+def run_cropfilm(args, load_tracks=load_track_table, open_source=open_frame_source):
+    """Crop the frames as requested by the command line arguments.
+
+    Args:
+        args: Parsed arguments, see parseArguments_crop. Paths are relative to the current directory, which is changed
+        to args.in_wd.
+        load_tracks (function, optional): Loader of the tracks table, same arguments as track_table.load_track_table.
+        Defaults to load_track_table.
+        open_source (function, optional): Opener of the frames, same arguments as frame_stack.open_frame_source.
+        Defaults to open_frame_source.
+    Returns:
+        The number of frames cropped, or the number of contact sheets written with --montage.
+        Raise FailedTasks if tasks of the work queue failed on this node (--shard_queue), after saving the manifest.
+
+    """
     if (len(args.in_trackid) > 0) and (args.pos is not None):
         warnings.warn('Both position and track IDs were provided, only positional cropping is performed.')
-    if (len(args.in_trackid) == 0) and (args.pos is None):
-        raise ValueError('None of position and track IDs were provided.')
+    queries = [name for name in ('pos', 'roi', 'near') if getattr(args, name) is not None]
+    if len(queries) > 1:
+        raise ValueError('Only one of --' + ', --'.join(queries) + ' can be provided.')
+    if queries and queries != ['pos'] and len(args.in_trackid) > 0:
+        warnings.warn('Both a spatial query and track IDs were provided, only the spatial query is performed.')
+    if (len(args.in_trackid) == 0) and not queries:
+        raise ValueError('None of position, region and track IDs were provided.')
+    if args.montage is not None and args.shard_queue is not None:
+        raise ValueError('Contact sheets (--montage) are not written with --shard_queue, use --workers instead.')
+    if args.near is not None:
+        near_id, near_radius = args.near[0], float(args.near[1])
 
-    # Raw print arguments
-    print("You are running the script with arguments: ")
-    for a in args.__dict__:
-        print(str(a) + ": " + str(args.__dict__[a]))
+    timer = StageTimer(enabled=args.profile or args.metrics is not None)
+    # Profiling outputs are relative to the directory the script is launched from
+    metrics_file = None if args.metrics is None else os.path.abspath(args.metrics)
+    cprofile_file = None if args.cprofile is None else os.path.abspath(args.cprofile)
+    shard_queue = None if args.shard_queue is None else os.path.abspath(args.shard_queue)
 
     os.chdir(args.in_wd)
     # If output folder does not exist, create it
     if not os.path.exists(args.in_out):
         print('Creating output directory: ' + args.in_wd + args.in_out)
-        os.makedirs(args.in_out)
+        os.makedirs(args.in_out, exist_ok=True)
 
     # If crop by track ID, read tracks csv
     if args.pos is None:
         for file in os.listdir(args.in_tracks):
             if re.search('_tracks\.csv', file):
-                tracks = read_csv_track(csvfi=args.in_tracks + '/' + file,
-                                        time_col=args.time,
-                                        id_col=args.id,
-                                        xpos_col=args.xpos,
-                                        ypos_col=args.ypos)
+                with timer.stage('csv_parse'):
+                    tracks = load_tracks(csvfi=args.in_tracks + '/' + file,
+                                         time_col=args.time,
+                                         id_col=args.id,
+                                         xpos_col=args.xpos,
+                                         ypos_col=args.ypos,
+                                         use_cache=not args.no_cache,
+                                         rebuild=args.rebuild_cache)
                 break
 
-    image_list = [f for f in os.listdir(args.in_im) if re.search('\.png$', f)]
-    # Crop by track ID
-    if args.pos is None:
-        for image in image_list:
-            time = re.search('T[0-9]+\.png$', image).group()[1:-4]  # trim T and .png extension
+    with timer.stage('list_frames'):
+        source = open_source(args.in_im, args.image_ext)
+        frames = source.frames
+    with timer.stage('display_range'):
+        # Contrast of raw frames, computed once for the whole stack
+        display = display_for_source(source, display_range=args.display_range, percentiles=args.percentiles,
+                                     colors=args.colors, n_samples=args.display_samples, auto=False)
+    if display is not None:
+        print('Display scaling of the crops: ' + str(display.params()))
+    # Plan crops: for each frame, the name and center of the windows to extract
+    if args.roi is not None or args.near is not None:
+        # Cells found in each frame by the grid index, named by their track ID
+        grid = tracks.spatial_index(args.cell_size)
+        plan = []
+        for time, image in frames:
+            if args.roi is not None:
+                rows = grid.in_rectangle(time, *args.roi)
+            else:
+                rows = grid.neighbors(time, near_id, near_radius, interpolate=args.interpolate)
+                if len(rows) == 0 and time in tracks:
+                    print('Track ID: ' + near_id + ' not found at time: ' + time)
+            plan.append((time, image, list(zip(tracks.track_id[rows].astype(str).tolist(),
+                                               zip(tracks.x[rows].astype(np.int64).tolist(),
+                                                   tracks.y[rows].astype(np.int64).tolist())))))
+        print('Found ' + str(sum([len(found) for _, _, found in plan])) + ' cell(s) to crop in ' +
+              str(sum([len(found) > 0 for _, _, found in plan])) + ' frame(s).')
+    elif args.pos is None:
+        # Positions of each track at all frames, looked up in the per-track index
+        index = tracks.track_index()
+        times = [int(time) for time, _ in frames]
+        positions = {track_id: index.positions(track_id, times, interpolate=args.interpolate)
+                     for track_id in args.in_trackid}
+        plan = []
+        for k, (time, image) in enumerate(frames):
+            found = []
             for track_id in args.in_trackid:
                 # If track id is not found, skip and go on with the other IDs
-                if track_id not in tracks[time]:
+                x, y = positions[track_id][0][k], positions[track_id][1][k]
+                if np.isnan(x):
                     print('Track ID: ' + track_id + ' not found at time: ' + time)
                     continue
-                cell_x, cell_y = tracks[time][track_id]
-                cell_x, cell_y = int(cell_x), int(cell_y)
-                im = Image.open(args.in_im+image)
-                # Check if position + radius do not exceed size of the image
-                # Right, left, top, bottom
-                w, h = im.size
-                if cell_x + crop_r > w:
-                    crop_r = w - cell_x
-                if cell_x - crop_l < 1:
-                    crop_l = cell_x - 1
-                if cell_y + crop_b > h:
-                    crop_b = h - cell_y
-                if cell_y - crop_t < 1:
-                    crop_t = cell_y - 1
-                im.crop((cell_x-crop_l, cell_y-crop_t,
-                         cell_x+crop_r, cell_y+crop_b)).save(args.in_out + track_id + '_' + image)
-    # Crop by position
+                found.append((track_id, (int(x), int(y))))
+            plan.append((time, image, found))
     else:
         cell_x, cell_y = args.pos
-        for image in image_list:
-            im = Image.open(args.in_im + image)
-            w, h = im.size
-            # Check that arguments are in good range
-            if cell_x > w or cell_x < 1:
-                raise ValueError('Position x (image column) is out of [1, image width]')
-            if cell_y > h or cell_y < 1:
-                raise ValueError('Position y (image row) is out of [1, image height]')
-            # Check if position + radius do not exceed size of the image
-            # Right, left, top, bottom
-            if cell_x + crop_r > w:
-                crop_r = w - cell_x
-            if cell_x - crop_l < 1:
-                crop_l = cell_x - 1
-            if cell_y + crop_b > h:
-                crop_b = h - cell_y
-            if cell_y - crop_t < 1:
-                crop_t = cell_y - 1
-            im.crop((cell_x - crop_l, cell_y - crop_t,
-                     cell_x + crop_r, cell_y + crop_b)).save(args.in_out +
-                                                             'x' + str(cell_x) + '_y' + str(cell_y) +
-                                                             '_' + image)
+        plan = [(time, image, [('x' + str(cell_x) + '_y' + str(cell_y), (cell_x, cell_y))]) for time, image in frames]
+
+    # Times at which each film has a frame
+    film_times = {}
+    for time, image, found in plan:
+        for name, _ in found:
+            film_times.setdefault(name, []).append(time)
+
+    # Skip outputs recorded as up to date in the manifest of the output folder
+    manifest = Manifest(args.in_out, force=args.force)
+    encoding = {'frame_format': args.frame_format, 'compress_level': args.compress_level, 'quality': args.quality}
+    if args.montage is not None:
+        with profile_block(cprofile_file), timer.stage('montage'):
+            n_sheets = write_montages(args, plan, source, display, manifest, encoding)
+        manifest.save()
+        if timer.enabled:
+            timer.report(n_frames=len(frames))
+            if metrics_file is not None:
+                timer.write_json(metrics_file, script=os.path.basename(__file__), sheets=n_sheets,
+                                 montage=args.montage, encoding=encoding)
+                print('Metrics written to: ' + metrics_file)
+        return n_sheets
+    params = {'size': args.size, 'output': args.output}
+    if args.output == 'png':
+        params['encoding'] = encoding
+    elif args.output in ANIMATED_FORMATS:
+        params['fps'] = args.fps
+        params['encoding'] = encoding
+    if display is not None:
+        params['display'] = display.params()
+    records = {}
+    if args.output == 'png':
+        for time, image, found in plan:
+            for name, center in found:
+                records[name + '_' + image] = {'input': source.fingerprint(image), 'tracks': center, 'params': params}
+        plan = [(time, image, [(name, center) for name, center in found
+                               if not manifest.is_current(replace_extension(args.in_out + name + '_' + image,
+                                                                            args.frame_format),
+                                                          records[name + '_' + image])])
+                for time, image, found in plan]
+        n_skipped = len(records) - sum([len(found) for _, _, found in plan])
+    else:
+        film_frames = {}
+        for time, image, found in plan:
+            for name, center in found:
+                film_frames.setdefault(name, []).append([source.fingerprint(image), center])
+        for name in film_frames:
+            records[name] = {'input': digest([frame for frame, _ in film_frames[name]]),
+                             'tracks': digest([center for _, center in film_frames[name]]), 'params': params}
+        current = [name for name in records
+                   if manifest.is_current(args.in_out + name + '_film' + FILM_EXTENSIONS[args.output], records[name])]
+        plan = [(time, image, [(name, center) for name, center in found if name not in current])
+                for time, image, found in plan]
+        n_skipped = len(current)
+    if n_skipped > 0:
+        print('Skipping ' + str(n_skipped) + ' output(s) already up to date.')
+
+    def crop(plan):
+        """Crop the frames of plan, each frame is decoded once for all windows. Return the number of frames."""
+        films = {}
+        n_frames = 0
+        try:
+            for time, image, found in plan:
+                if not found:
+                    continue
+                n_frames += 1
+                with timer.stage('decode'):
+                    frame = source.load(image)
+                if args.pos is not None:
+                    h, w = frame.array.shape[:2]
+                    # Check that arguments are in good range
+                    if cell_x > w or cell_x < 1:
+                        raise ValueError('Position x (image column) is out of [1, image width]')
+                    if cell_y > h or cell_y < 1:
+                        raise ValueError('Position y (image row) is out of [1, image height]')
+                with timer.stage('crop'):
+                    windows = crop_windows(frame.array, [center for _, center in found], args.size)
+                if display is not None:
+                    # Only the pixels of the crops are scaled, not the whole frame
+                    with timer.stage('display'):
+                        windows = display.apply(windows)
+                        frame = Frame(array=None, mode=display.mode, palette=None)
+                with timer.stage('encode'):
+                    for (name, _), window in zip(found, windows):
+                        if args.output == 'png':
+                            output = replace_extension(args.in_out + name + '_' + image, args.frame_format)
+                            save_image(window_to_image(window, frame), output, **encoding)
+                            manifest.update(output, records[name + '_' + image])
+                        else:
+                            # One film per track, frames are appended as they are cropped
+                            if name not in films:
+                                films[name] = open_film(args.in_out + name + '_film', args.output, film_times[name],
+                                                        window, frame, fps=args.fps, quality=args.quality,
+                                                        compress_level=args.compress_level)
+                            films[name].append(window, frame)
+        except BaseException:
+            # Films interrupted before their end are incomplete
+            for film in films.values():
+                film.abort()
+            raise
+        for name, film in films.items():
+            with timer.stage('close_film'):
+                film.close()
+            manifest.update(film.path, records[name])
+        return n_frames
+
+    failed_tasks = 0
+    with profile_block(cprofile_file):
+        if shard_queue is None:
+            n_frames = crop(plan)
+        else:
+            n_frames, failed_tasks = crop_sharded(shard_queue, args, crop, plan, frames, sorted(film_times), manifest)
+    manifest.save()
+    if timer.enabled:
+        timer.report(n_frames=n_frames)
+        if metrics_file is not None:
+            timer.write_json(metrics_file, script=os.path.basename(__file__), frames=n_frames, output=args.output,
+                             encoding=encoding)
+            print('Metrics written to: ' + metrics_file)
+    if failed_tasks:
+        raise FailedTasks(str(failed_tasks) + ' task(s) of the work queue failed on this node, see the errors above.')
+    return n_frames
+
+
+def write_montages(args, plan, source, display, manifest, encoding):
+    """Write the contact sheets of a crop plan, see run_cropfilm.
+
+    Args:
+        args: Parsed arguments, see parseArguments_crop.
+        plan (list of 3-tuple): (time, image, [(name, center)...]) for all frames.
+        source: Frames, see frame_stack.open_frame_source.
+        display (DisplayScaling): Scaling of the crops to 8 bits, None to keep raw pixels.
+        manifest (Manifest): Manifest of the output folder, sheets up to date are skipped.
+        encoding (dict): Encoding of the sheets, keyword arguments of encoding.save_image.
+    Returns:
+        The number of sheets written.
+
+    """
+    sheets = []
+    if args.montage == 'track':
+        tiles = {}
+        for time, image, found in plan:
+            for name, center in found:
+                tiles.setdefault(name, []).append((image, center, 'T' + time))
+        for name, name_tiles in tiles.items():
+            sheets.append(Sheet(output=replace_extension(args.in_out + name + '_montage', args.frame_format),
+                                tiles=name_tiles))
+    else:
+        for time, image, found in plan:
+            if found:
+                sheets.append(Sheet(output=replace_extension(args.in_out + 'montage_' + image, args.frame_format),
+                                    tiles=[(image, center, name) for name, center in found]))
+    font = (args.caption_font, args.caption_size) if args.captions else None
+    params = {'size': args.size, 'montage': args.montage, 'columns': args.columns, 'gap': args.gap, 'font': font,
+              'encoding': encoding}
+    if display is not None:
+        params['display'] = display.params()
+    records = {sheet.output: {'input': digest([source.fingerprint(image) for image, _, _ in sheet.tiles]),
+                              'tracks': digest([[center, caption] for _, center, caption in sheet.tiles]),
+                              'params': params} for sheet in sheets}
+    todo = [sheet for sheet in sheets if not manifest.is_current(sheet.output, records[sheet.output])]
+    if len(todo) < len(sheets):
+        print('Skipping ' + str(len(sheets) - len(todo)) + ' contact sheet(s) already up to date.')
+    n_sheets = 0
+    for written in run_montages(args.in_im, todo, args.size, workers=args.workers, sheets_per_job=args.sheets_per_job,
+                                source=source, display=display, columns=args.columns, gap=args.gap, font=font,
+                                encoding=encoding):
+        for output in written:
+            manifest.update(output, records[output])
+        n_sheets += len(written)
+    print(str(n_sheets) + ' contact sheet(s) written to: ' + args.in_out)
+    return n_sheets
+
+
+def crop_sharded(queue_folder, args, crop, plan, frames, film_names, manifest):
+    """Crop the tasks claimed from a work queue shared with other nodes, until all tasks are done.
+
+    Args:
+        queue_folder (str): Folder of the work queue.
+        args: Parsed arguments, see parseArguments_crop.
+        crop (function): Crops the frames of a plan, see run_cropfilm.
+        plan (list of 3-tuple): (time, image, [(name, center)...]) for all frames, outputs up to date excluded.
+        frames (list of 2-tuple): (time, image) of all frames.
+        film_names (list of str): Names of all films, for film outputs.
+        manifest (Manifest): Manifest of the output folder, saved after each task.
+    Returns:
+        A 2-tuple: number of frames cropped by this node, number of its tasks that failed.
+
+    """
+    queue = WorkQueue(queue_folder, lease_seconds=args.lease)
+    if args.output == 'png':
+        # Ranges of frames
+        tasks = [{'id': task_name('frames', start, end), 'frames': [start, end]}
+                 for start, end in frame_ranges(len(frames), args.frames_per_task)]
+    else:
+        # A film needs all its frames: tasks are groups of films, whose frames are decoded once for the group
+        if args.films_per_task < 1:
+            raise ValueError('Number of films per task must be at least 1.')
+        tasks = [{'id': task_name('films', start, start + len(group)), 'films': group}
+                 for start, group in [(start, film_names[start:start + args.films_per_task])
+                                      for start in range(0, len(film_names), args.films_per_task)]]
+    # Options which may differ between nodes are not part of the run
+    run_params = {k: v for k, v in vars(args).items()
+                  if k not in ('in_wd', 'shard_queue', 'lease', 'profile', 'metrics', 'cprofile')}
+    queue.publish(tasks, params=run_params)
+    print('Work queue: ' + queue_folder + ', ' + str(len(tasks)) + ' task(s), ' + str(queue.status()))
+
+    counts = []
+
+    def process(task):
+        if 'frames' in task:
+            start, end = task['frames']
+            sub_plan = plan[start:end]
+        else:
+            films = set(task['films'])
+            # Frames without any film of the task are skipped by crop without being decoded
+            sub_plan = [(time, image, [(name, center) for name, center in found if name in films])
+                        for time, image, found in plan]
+        n_frames = crop(sub_plan)
+        manifest.save()
+        counts.append(n_frames)
+        print('Task ' + task['id'] + ': ' + str(n_frames) + ' frame(s) cropped.')
+        return {'frames': n_frames}
+
+    # Tasks which raised are recorded as done by the queue, with the error as result
+    failed = [task_id for task_id, result in queue.run(process) if 'error' in result]
+    return sum(counts), len(failed)
+
+
+# -------------------------------
+
+
+if __name__ == "__main__":
+    # Read arguments
+    args = parseArguments_crop()
+
+    # Raw print arguments
+    print("You are running the script with arguments: ")
+    for a in args.__dict__:
+        print(str(a) + ": " + str(args.__dict__[a]))
+
+    try:
+        run_cropfilm(args)
+    except FailedTasks as e:
+        # Errors of the tasks were printed as they happened
+        print(e)
+        sys.exit(1)
@@ -0,0 +1,111 @@
+# Script usage:
+#
+# python3 path/to/script_daemon.py serve
+# python3 path/to/script_daemon.py crop work_fold subfold_csv subfold_png subfold_out track_id [options]
+# python3 path/to/script_daemon.py overlay -c config.csv [options]
+# python3 path/to/script_daemon.py stats
+# python3 path/to/script_daemon.py stop
+#
+# serve: start the daemon, which keeps tracks tables, fonts and decoded frames in memory (see daemon.py).
+# crop: same arguments as script_cropfilm.py, run by the daemon.
+# overlay: same arguments as script_overlay_cfg.py, run by the daemon.
+# stats: print the counters of the caches of the daemon.
+# stop: stop the daemon.
+# The client only forwards the arguments and the current directory, it does not import numpy nor Pillow: repeated
+# requests on the same well return in milliseconds.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, sys, json, socket, argparse, tempfile
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'track_overlay_daemon.sock')
+CLIENT_COMMANDS = {'crop': 'crop', 'overlay': 'overlay', 'stats': 'stats', 'stop': 'shutdown'}
+
+
+def parseArguments_daemon():
+    # Create argument parser
+    parser = argparse.ArgumentParser(description='Run script_cropfilm.py and script_overlay_cfg.py in a long-running \
+     daemon which keeps tracks, fonts and decoded frames in memory.')
+
+    # Positional mandatory arguments
+    parser.add_argument('command', help='"serve" starts the daemon. "crop" and "overlay" take the arguments of \
+     script_cropfilm.py and script_overlay_cfg.py. "stats" prints the state of the caches, "stop" stops the daemon.',
+                        type=str, choices=('serve',) + tuple(CLIENT_COMMANDS))
+    parser.add_argument('script_args', help='Arguments of the script, for "crop" and "overlay".',
+                        nargs=argparse.REMAINDER)
+
+    # Optional arguments, before the command
+    parser.add_argument('--socket', help='Path of the Unix socket of the daemon.', type=str, default=DEFAULT_SOCKET)
+    parser.add_argument('--max_frames', help='With "serve", maximum number of decoded frames kept in memory.',
+                        type=int, default=256)
+    parser.add_argument('--max_tables', help='With "serve", maximum number of tracks tables kept in memory.', type=int,
+                        default=16)
+    parser.add_argument('--font', help='With "serve", path of the TrueType font of the overlays. Defaults to DejaVu \
+     Sans on Linux and Arial on Windows.', type=str, default=None)
+    parser.add_argument('--font_size', help='With "serve", size of the font of the overlays.', type=int, default=10)
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+
+# -------------------------------
+
+
+def send_request(socket_path, request):
+    """Send a request to the daemon and wait for its answer.
+
+    Args:
+        socket_path (str): Path of the Unix socket of the daemon.
+        request (dict): Request, see daemon.Daemon.handle.
+    Returns:
+        The answer of the daemon (dict).
+        Raise ConnectionError if no daemon listens on socket_path.
+
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            client.connect(socket_path)
+        except OSError:
+            raise ConnectionError('No daemon listening on: ' + socket_path + '. Start it with: python3 ' +
+                                  os.path.basename(__file__) + ' serve')
+        client.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        answer = b''
+        while not answer.endswith(b'\n'):
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            answer += chunk
+    finally:
+        client.close()
+    return json.loads(answer.decode('utf-8'))
+
+
+# -------------------------------
+
+
+if __name__ == "__main__":
+    # Read arguments
+    args = parseArguments_daemon()
+
+    if args.command == 'serve':
+        # Raw print arguments
+        print("You are running the script with arguments: ")
+        for a in args.__dict__:
+            print(str(a) + ": " + str(args.__dict__[a]))
+        # Imported here so that the client does not load numpy and Pillow
+        from daemon import serve, DEFAULT_FONT
+        serve(args.socket, max_frames=args.max_frames, max_tables=args.max_tables,
+              font=args.font if args.font is not None else DEFAULT_FONT, font_size=args.font_size)
+        sys.exit(0)
+
+    answer = send_request(args.socket, {'command': CLIENT_COMMANDS[args.command], 'argv': args.script_args,
+                                        'cwd': os.getcwd()})
+    sys.stdout.write(answer.get('output', ''))
+    if 'stats' in answer:
+        print(json.dumps(answer['stats'], indent=1))
+    print('Done by the daemon in ' + str(answer.get('elapsed')) + ' s.')
+    sys.exit(answer.get('status', 1))
@@ -0,0 +1,80 @@
+# Script usage:
+#
+# python3 path/to/script_encoding_bench.py subfold_im
+#
+# subfold_im: folder containing images with .png extension (names ending by "T[0-9]+.png"), or a frame stack created by
+# script_pack_frames.py. A sample of its frames is encoded in memory with each output encoding supported by
+# script_overlay.py and script_cropfilm.py (--frame_format, --compress_level, --quality), and the mean time and size
+# per frame are printed. Use it to choose the encoding of a deployment.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import json, argparse
+from frame_stack import open_frame_source
+from encoding import benchmark_encodings
+
+DEFAULT_SETTINGS = [{'frame_format': 'png', 'compress_level': level} for level in (0, 1, 3, 6, 9)] + \
+                   [{'frame_format': 'tiff'}] + \
+                   [{'frame_format': 'jpeg', 'quality': quality} for quality in (75, 90)] + \
+                   [{'frame_format': 'npy'}]
+
+
+def parseArguments_bench():
+    # Create argument parser
+    parser = argparse.ArgumentParser(description='Compare the speed and size of the output image encodings.')
+
+    # Positional mandatory arguments
+    parser.add_argument('in_im', help='Folder containing images with .png extension, or a frame stack created by \
+     script_pack_frames.py.', type=str)
+
+    # Optional arguments
+    parser.add_argument('-n', '--n_frames', help='Number of frames sampled evenly across the series.', type=int,
+                        default=10)
+    parser.add_argument('-r', '--repeat', help='Number of times each frame is encoded, the fastest time is kept.',
+                        type=int, default=3)
+    parser.add_argument('--json', help='Also write the results to this .json file.', type=str, default=None)
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+
+def setting_name(setting):
+    """Short label of an encoding setting, e.g. png/compress_level=1."""
+    options = [k + '=' + str(v) for k, v in sorted(setting.items()) if k != 'frame_format']
+    return '/'.join([setting['frame_format']] + options)
+
+
+# -------------------------------
+
+
+if __name__ == "__main__":
+    # Read arguments
+    args = parseArguments_bench()
+
+    # Raw print arguments
+    print("You are running the script with arguments: ")
+    for a in args.__dict__:
+        print(str(a) + ": " + str(args.__dict__[a]))
+
+    source = open_frame_source(args.in_im)
+    if len(source) == 0:
+        raise ValueError('No image ending with "T[0-9]+.png" found in: ' + args.in_im)
+    n = min(args.n_frames, len(source))
+    sample = [source.frames[i * len(source) // n][1] for i in range(n)]
+    images = [source.image(image) for image in sample]
+    print('Encoding ' + str(n) + ' frame(s) of size ' + str(images[0].size) + ', mode ' + images[0].mode + '.')
+
+    results = benchmark_encodings(images, DEFAULT_SETTINGS, repeat=args.repeat)
+    print('\nencoding\tms/frame\tkB/frame')
+    for result in results:
+        setting = {k: v for k, v in result.items() if k not in ('ms_per_frame', 'kb_per_frame')}
+        print(setting_name(setting) + '\t' + str(round(result['ms_per_frame'], 2)) + '\t' +
+              str(round(result['kb_per_frame'], 1)))
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'in_im': args.in_im, 'frames': sample, 'results': results}, f, indent=1)
+        print('Results written to: ' + args.json)
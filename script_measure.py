@@ -0,0 +1,156 @@
+# Script usage:
+#
+# python3 path/to/script_measure.py work_fold subfold_csv subfold_png out_csv
+#
+# work_fold: working directory, must comprise a subfolder with .csv tables and a subfolder with .png images
+# subfold_csv: subfolder of "work_fold", containing one .csv files ending by _tracks.csv
+# subfold_png: subfolder of "work_fold", containing the images to measure with .png extension
+# out_csv: path of the output table, relative to "work_fold"
+# For every track and every frame, measures the mean, sum, min and max intensity in a box or a disk around the tracked
+# position, optionally in other image folders (e.g. the KTR channel) at the same positions. The output has one row per
+# track, frame and channel. Changing the size of the window only requires to run this script again, not CellProfiler.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, re, csv, time, argparse
+import numpy as np
+from track_table import load_track_table
+from frame_stack import IMAGE_EXTENSIONS, open_frame_source
+from intensity import measure_frame, STATS, SHAPES
+
+
+def parseArguments_measure():
+    # Create argument parser
+    parser = argparse.ArgumentParser(description='Measure intensities around tracked cells, in every frame.')
+
+    # Positional mandatory arguments
+    parser.add_argument('in_wd', help='Working directory, must comprise a subfolder with .csv tables and a subfolder \
+     with .png images.', type=str)
+    parser.add_argument('in_tracks', help='Subfolder of "in_wd", containing one .csv file ending by "_tracks.csv".',
+                        type=str)
+    parser.add_argument('in_im', help='Subfolder of "in_wd", containing images with .png extension. Name of the files \
+     must end by "T[0-9]+.png", to indicate time of the image. Can also be a frame stack created by \
+     script_pack_frames.py.', type=str)
+    parser.add_argument('out_csv', help='Path of the output .csv table, relative to "in_wd".', type=str)
+    parser.add_argument('in_trackid', help='ID of the tracks to measure, separated by white space. By default, all \
+     tracks are measured.', nargs='*', type=str)
+
+    # Measurement
+    parser.add_argument('-c', '--channels', help='Other subfolders of "in_wd" (or frame stacks) measured at the same \
+     positions, e.g. the KTR images. Frames are matched by time.', nargs='+', type=str, default=[])
+    parser.add_argument('--image_ext', help='Extension of the images of "in_im" and of the channels: "png", or "tif" \
+     for .tif and .tiff files. Other images in the folder are ignored. Not used for frame stacks.', type=str,
+                        choices=IMAGE_EXTENSIONS, default='png')
+    parser.add_argument('--shape', help='Shape of the measured region: "box" (see --size) or "disk" (see --radius).',
+                        type=str, choices=SHAPES, default='box')
+    parser.add_argument('-s', '--size', help='Extent of the box in directions: left, right, top, bottom of the cell \
+     center. 4 integers separated by a white space.', nargs=4, type=int, default=(5, 5, 5, 5))
+    parser.add_argument('-r', '--radius', help='Radius of the disk, in pixels.', type=int, default=5)
+    parser.add_argument('--stats', help='Statistics to compute.', nargs='+', type=str, choices=STATS,
+                        default=list(STATS))
+
+    # Optional arguments for reading track file
+    parser.add_argument('-t', '--time', help='Name of time column in _tracks.csv file.', type=str,
+                        default='Image_Metadata_T')
+    parser.add_argument('-i', '--id', help='Name of track ID column in _tracks.csv file.', type=str,
+                        default='track_id')
+    parser.add_argument('-x', '--xpos', help='Name of x-position column in _tracks.csv file.', type=str,
+                        default='objNuclei_Location_Center_X')
+    parser.add_argument('-y', '--ypos', help='Name of y-position column in _tracks.csv file.', type=str,
+                        default='objNuclei_Location_Center_Y')
+
+    # Cache of parsed _tracks.csv files
+    parser.add_argument('--no_cache', help='Do not read nor write the on-disk cache of parsed _tracks.csv files.',
+                        action='store_true')
+    parser.add_argument('--rebuild_cache', help='Parse the _tracks.csv file again and overwrite its cache entry.',
+                        action='store_true')
+
+    # Parse arguments
+    args = parser.parse_args()
+    args.size = tuple(args.size)
+
+    return args
+
+
+# -------------------------------
+
+
+def channel_names(folder, frame):
+    """Names of the channels of the images of a folder: the folder name, followed by the band for RGB(A) images."""
+    name = os.path.basename(os.path.normpath(folder))
+    if frame.array.ndim == 2:
+        return [name]
+    # Bands of RGB(A) images, page numbers of multi-page TIFF whose mode is the one of a single page (e.g. I;16)
+    bands = frame.mode if frame.mode.isalpha() and len(frame.mode) == frame.array.shape[2] else \
+        [str(k) for k in range(frame.array.shape[2])]
+    return [name + '_' + band for band in bands]
+
+
+# -------------------------------
+
+
+if __name__ == "__main__":
+    # Read arguments
+    args = parseArguments_measure()
+
+    # Raw print arguments
+    print("You are running the script with arguments: ")
+    for a in args.__dict__:
+        print(str(a) + ": " + str(args.__dict__[a]))
+
+    start = time.time()
+    os.chdir(args.in_wd)
+    for file in os.listdir(args.in_tracks):
+        if re.search('_tracks\.csv', file):
+            tracks = load_track_table(csvfi=args.in_tracks + '/' + file,
+                                      time_col=args.time,
+                                      id_col=args.id,
+                                      xpos_col=args.xpos,
+                                      ypos_col=args.ypos,
+                                      use_cache=not args.no_cache,
+                                      rebuild=args.rebuild_cache)
+            break
+
+    source = open_frame_source(args.in_im, args.image_ext)
+    others = [(folder, open_frame_source(folder, args.image_ext)) for folder in args.channels]
+    wanted = np.asarray(args.in_trackid, dtype=str) if args.in_trackid else None
+    stats = [stat for stat in STATS if stat in args.stats]
+
+    n_rows = 0
+    with open(args.out_csv, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([args.time, args.id, args.xpos, args.ypos, 'channel', 'shape'] + stats + ['n_pixels'])
+        shape_name = args.shape + '_' + ('_'.join([str(s) for s in args.size]) if args.shape == 'box'
+                                         else str(args.radius))
+        for t, image in source.frames:
+            if t not in tracks:
+                print('No track found at time: ' + t)
+                continue
+            ids, x, y = tracks.frame(t)
+            if wanted is not None:
+                keep = np.isin(ids.astype(str), wanted)
+                ids, x, y = ids[keep], x[keep], y[keep]
+            if len(ids) == 0:
+                continue
+            # Same pixel as script_cropfilm.py for the center of each cell
+            centers = np.stack([x.astype(np.int64), y.astype(np.int64)], axis=1)
+            frames = [(args.in_im, source.load(image))]
+            for folder, other in others:
+                try:
+                    frames.append((folder, other.frame_at(t)))
+                except KeyError:
+                    print('No image at time ' + t + ' in: ' + folder)
+            for folder, frame in frames:
+                values = measure_frame(frame.array, centers, shape=args.shape, size=args.size, radius=args.radius,
+                                       stats=stats)
+                for k, channel in enumerate(channel_names(folder, frame)):
+                    columns = [values[stat] if frame.array.ndim == 2 else values[stat][:, k] for stat in stats]
+                    n = len(ids)
+                    writer.writerows(zip([int(t)] * n, ids.tolist(), x.tolist(), y.tolist(), [channel] * n,
+                                         [shape_name] * n, *[column.tolist() for column in columns],
+                                         values['n_pixels'].tolist()))
+                    n_rows += n
+
+    print('Wrote ' + str(n_rows) + ' measurements in ' + str(round(time.time() - start, 2)) + ' s to: ' +
+          os.path.join(args.in_wd, args.out_csv))
@@ -0,0 +1,115 @@
+# Script usage:
+#
+# python3 path/to/script_outlier_review.py out_fold condition1.csv [condition2.csv ...]
+#
+# out_fold: folder where the results are written, one subfolder per condition table (e.g. out_fold/condition1/)
+# conditionX.csv: condition tables, one row per trajectory and per time, e.g. written by script_preprocessing.py
+# Replaces the one-plot-at-a-time review of script_stop_and_watch.R. For each condition:
+# 1) Score every trajectory: deviation from the mean curve of the condition, jumps and flat lines
+# 2) Draw thumbnails of the trajectories on contact sheets (sheet_01.png, sheet_02.png...), most suspicious first
+# 3) Write the scores (scores.csv, ranked) and the outlier table of script_stop_and_watch.R (is_outlier.csv)
+# After looking at the sheets, run again with --outliers (and --not_outliers) to record the decisions in is_outlier.csv,
+# --no_sheets skips the drawing.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, argparse
+from trajectory_review import review_condition, read_trajectories, score_trajectories, rank_tracks, write_scores, \
+    outlier_table, write_outlier_table, DEFAULT_FEATURES, SCORES
+from label_cache import DEFAULT_FONT
+
+
+def parseArguments_review():
+    # Create argument parser
+    parser = argparse.ArgumentParser(description='Rank trajectories by outlier scores and draw them on contact \
+     sheets, most suspicious first. Writes the is.outlier table of script_stop_and_watch.R.')
+
+    # Positional mandatory arguments
+    parser.add_argument('out_dir', help='Folder where the results are written, one subfolder per condition table.',
+                        type=str)
+    parser.add_argument('in_csv', help='Condition tables, one row per trajectory and per time.', nargs='+', type=str)
+
+    # Columns
+    parser.add_argument('-u', '--uniq', help='Name of the column with unique trajectory IDs.', type=str,
+                        default='uniqID')
+    parser.add_argument('-t', '--time', help='Name of time column.', type=str, default='Image_Metadata_T')
+    parser.add_argument('-f', '--features', help='Columns to review, one panel per column on the thumbnails.',
+                        nargs='+', type=str, default=list(DEFAULT_FEATURES))
+
+    # Scores
+    parser.add_argument('--flat_tolerance', help='Steps smaller than this fraction of the typical step of a feature \
+     count as flat.', type=float, default=0.01)
+    parser.add_argument('--weights', help='Weights of the deviation, jump and flat scores in the total score. 3 \
+     numbers separated by white space.', nargs=3, type=float, default=[1.0, 1.0, 1.0])
+
+    # Contact sheets
+    parser.add_argument('--no_sheets', help='Only write the scores and the outlier table.', action='store_true')
+    parser.add_argument('--per_sheet', help='Number of trajectories per contact sheet.', type=int, default=100)
+    parser.add_argument('--max_tracks', help='Only draw this number of the most suspicious trajectories. All are \
+     scored.', type=int, default=None)
+    parser.add_argument('--panel', help='Width and height in pixels of the plot of a feature, 2 integers separated by \
+     white space.', nargs=2, type=int, default=(80, 50))
+    parser.add_argument('--columns', help='Number of thumbnails per row of a sheet. Defaults to a square grid.',
+                        type=int, default=None)
+    parser.add_argument('--no_captions', help='Do not write the rank and ID above the thumbnails.', action='store_true')
+    parser.add_argument('--font', help='TrueType font of the captions.', type=str, default=DEFAULT_FONT)
+    parser.add_argument('--font_size', help='Size of the font of the captions.', type=int, default=10)
+    parser.add_argument('-w', '--workers', help='Number of worker processes drawing sheets in parallel.', type=int,
+                        default=1)
+
+    # Outlier table
+    parser.add_argument('--threshold', help='Trajectories with a score at least this value are marked "yes", the \
+     others "no". By default, trajectories are marked "." (not reviewed).', type=float, default=None)
+    parser.add_argument('--outliers', help='IDs of the trajectories reviewed as outliers ("yes").', nargs='+', type=str,
+                        default=[])
+    parser.add_argument('--not_outliers', help='IDs of the trajectories reviewed as not outliers ("no").', nargs='+',
+                        type=str, default=[])
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+
+# -------------------------------
+
+
+if __name__ == "__main__":
+    # Read arguments
+    args = parseArguments_review()
+
+    # Raw print arguments
+    print("You are running the script with arguments: ")
+    for a in args.__dict__:
+        print(str(a) + ": " + str(args.__dict__[a]))
+
+    weights = dict(zip(SCORES, args.weights))
+    outliers, not_outliers = set(args.outliers), set(args.not_outliers)
+    for csvfi in args.in_csv:
+        condition = os.path.splitext(os.path.basename(csvfi))[0]
+        out_dir = os.path.join(args.out_dir, condition)
+        os.makedirs(out_dir, exist_ok=True)
+        if args.no_sheets:
+            ids, _, values = read_trajectories(csvfi, uniq_col=args.uniq, time_col=args.time, features=args.features)
+            scores = score_trajectories(values, flat_tolerance=args.flat_tolerance, weights=weights)
+            write_scores(os.path.join(out_dir, 'scores.csv'), ids, scores, rank_tracks(scores), uniq_col=args.uniq)
+            sheets = []
+        else:
+            ids, scores, sheets = review_condition(csvfi, out_dir, uniq_col=args.uniq, time_col=args.time,
+                                                   features=args.features, per_sheet=args.per_sheet,
+                                                   max_tracks=args.max_tracks, panel=tuple(args.panel),
+                                                   columns=args.columns,
+                                                   font=None if args.no_captions else (args.font, args.font_size),
+                                                   workers=args.workers, flat_tolerance=args.flat_tolerance,
+                                                   weights=weights)
+        # IDs may come from several tables, each table keeps its own
+        status = outlier_table(ids, scores, threshold=args.threshold, outliers=outliers.intersection(ids),
+                               not_outliers=not_outliers.intersection(ids))
+        write_outlier_table(os.path.join(out_dir, 'is_outlier.csv'), ids, status, uniq_col=args.uniq)
+        outliers -= set(ids)
+        not_outliers -= set(ids)
+        print('Condition ' + condition + ': ' + str(len(ids)) + ' trajectories, ' + str(len(sheets)) +
+              ' contact sheet(s), ' + str(status.count('yes')) + ' outlier(s). Written in: ' + out_dir)
+    if outliers or not_outliers:
+        print('Reviewed IDs not found in any table: ' + ', '.join(sorted(outliers | not_outliers)))
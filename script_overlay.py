@@ -11,8 +11,9 @@
 # ---------------------------------
 
 
-import os, sys, csv, re, argparse
+import os, sys, csv, argparse
 from PIL import Image, ImageDraw, ImageFont
+from track_table import TrackTable
 
 
 def read_csv_track(csvfi, time_col, id_col, xpos_col, ypos_col):
@@ -27,42 +28,22 @@ def read_csv_track(csvfi, time_col, id_col, xpos_col, ypos_col):
         ypos_col (str): name of y-position column.
     Returns:
         A dictionary of depth 2. 1st keys refer to time, 2nd keys refers to track ID. Values are (x,y) coordinates.
+        For large files prefer TrackTable.from_csv, which returns columnar arrays instead of nested dictionaries, and
+        track_stream.iter_frames for files that do not fit in memory.
 
     """
-    # Check if headers are present on the first line
-    with open(csvfi, newline='') as csvfile:
-        first_line = csvfile.readline().rstrip()
-        fl = first_line.split(',')
-        if time_col in fl and id_col in fl and xpos_col in fl and ypos_col in fl:
-            pass
-        else:
-            raise ValueError('At least one of the provided column name is not found in the first line of the csv file. Expected: ' +
-                             ', '.join([time_col, id_col, xpos_col, ypos_col]) +
-                             "; Found: " + ', '.join(fl))
-          
-    # 2-level dictionary
-    # 1stKey: time;
-    # 2nd key: track_id;
-    # Val: [(x0,y0), (x1,y1), ...]
-    dict_track = {}
-    with open(csvfi, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            if row[time_col] in dict_track.keys():
-                dict_track[row[time_col]][row[id_col]] = (float(row[xpos_col]), float(row[ypos_col]))
-            else:
-                dict_track[row[time_col]] = {}
-                dict_track[row[time_col]][row[id_col]] = (float(row[xpos_col]), float(row[ypos_col]))
-    return dict_track
+    # Kept for compatibility, parsing is done by TrackTable in a single pass over the file
+    return TrackTable.from_csv(csvfi, time_col, id_col, xpos_col, ypos_col).to_dict()
 
 # ---------------------------------
 
 
-def overlay_text(imfile, coord, text, output=None, shift_coord=None, font=None, color=-1, show=False):
+def overlay_text(imfile, coord, text, output=None, shift_coord=None, font=None, color=-1, show=False,
+                 label_cache=None, save=True):
     """"Read image file, add text at specified positions and save.
 
     Args:
-        imfile (str): Path to the image file.
+        imfile (str or Image): Path to the image file, or image already in memory.
         coord (list of 2-tuple): Coordinates (x,y) where text is written.
         text (list of str): Text to be written.
         output(str, optional): Path to save the image with overlayed text. Defaults to imfile with 'ovl_' prefix.
@@ -71,8 +52,11 @@ def overlay_text(imfile, coord, text, output=None, shift_coord=None, font=None,
         color (n-tuple, optional): Color of text. Should have same length as the number of channels in image. Defaults
         to white. Can also pass -1 for default.
         show (bool, optional): Whether to display the annotated image. Defaults to False.
+        label_cache (LabelCache, optional): Cache of rendered labels for font. When provided, labels are blitted
+        from the cache instead of being rasterized again, with identical result. Defaults to None.
+        save (bool, optional): Whether to write the annotated image to output. Defaults to True.
     Returns:
-        None
+        The annotated image (PIL Image).
     Examples:
         # Custom font (tested on Windows, see doc if error)
         myfont= ImageFont.truetype(font='calibri.ttf', size=20)
@@ -103,7 +87,7 @@ def overlay_text(imfile, coord, text, output=None, shift_coord=None, font=None,
     if shift_coord is None:
         shift_coord = [0, 0]
     # Read image file and create drawing object
-    im = Image.open(imfile)
+    im = imfile if isinstance(imfile, Image.Image) else Image.open(imfile)
     # If mode is 'P' (8bits + palette, common for imagej export) font color is bound to the palette,
     # usually not desirable, go to RGB (e.g. intensity 255 in 8 bits with red mapping renders a red font instead of white)
     # see http://effbot.org/imagingbook/concepts.htm#mode
@@ -112,7 +96,7 @@ def overlay_text(imfile, coord, text, output=None, shift_coord=None, font=None,
     assert im.mode == 'L' or im.mode == 'RGB'
     imdraw = ImageDraw.Draw(im)
     # Set defaults
-    if output is None:
+    if output is None and save:
         output = 'ovl_'+imfile
     if font is None:
         font = ImageFont.truetype(font='arial', size=12)
@@ -126,11 +110,17 @@ def overlay_text(imfile, coord, text, output=None, shift_coord=None, font=None,
 
     # Add text and save
     coord = [(i[0]+shift_coord[0], i[1]+shift_coord[1]) for i in coord]
-    for xy, txt in zip(coord, text):
-        imdraw.text(xy, txt, font=font, fill=color)
-    im.save(output)
+    if label_cache is not None and label_cache.font is font:
+        for xy, txt in zip(coord, text):
+            label_cache.draw(im, xy, txt, color)
+    else:
+        for xy, txt in zip(coord, text):
+            imdraw.text(xy, txt, font=font, fill=color)
+    if save:
+        im.save(output)
     if show:
         im.show()
+    return im
 
 
 # -----------------------------
@@ -146,28 +136,16 @@ def parseArguments_overlay():
     parser.add_argument('in_tracks', help='Subfolder of "in_wd", containing one .csv file ending by "_tracks.csv".',
                         type=str, default=None, nargs='?')
     parser.add_argument('in_im', help='Subfolder of "in_wd", containing images to annotate with .png extension. Name of\
-                                      the files must end by "T[0-9]+.png", to indicate time of the image.', type=str,
+                                      the files must end by "T[0-9]+.png", to indicate time of the image.\
+                                      Can also be a frame stack created by script_pack_frames.py.', type=str,
                         default=None, nargs='?')
     parser.add_argument('in_out', help='Subfolder of "in_wd", annotated images will be saved there.', type=str,
                         default=None, nargs='?')
 
-    # Optional arguments
-    parser.add_argument('-f', '--font_color', help='Font color of the overlaid text. Must be an integer (resp. a'
-                                                   ' 3-tuple of integers) between 0 and 255 if the image if 8-bits'
-                                                   ' grayscale (resp. 8-bits RGB). Default to white. Can also pass -1'
-                                                   ' to use default color.', type=int,
-                        default=-1, nargs='+')
-    parser.add_argument('-t', '--time', help='Name of time column in _tracks.csv file.', type=str,
-                        default='Image_Metadata_T')
-    parser.add_argument('-i', '--id', help='Name of track ID column in _tracks.csv file.', type=str,
-                        default='track_id')
-    parser.add_argument('-x', '--xpos', help='Name of x-position column in _tracks.csv file.', type=str,
-                        default='objNuclei_Location_Center_X')
-    parser.add_argument('-y', '--ypos', help='Name of y-position column in _tracks.csv file.', type=str,
-                        default='objNuclei_Location_Center_Y')
-    parser.add_argument('-s', '--shift', help='Shift the position of the writing. Useful to center writings in cells. \
-     Provide as 2 integers separated by a white space.',
-                        nargs=2, type=int, default=(-4, -5))
+    # Optional arguments, shared with script_overlay_cfg.py and script_overlay_batch.py
+    # Imported here since overlay_engine itself imports overlay_text from this file
+    from overlay_engine import add_overlay_arguments
+    add_overlay_arguments(parser)
 
     # If provided a config file, replaces command line arguments
     parser.add_argument('-c', '--config', help='Path to config file, replaces positional arguments.', type=str,
@@ -177,6 +155,7 @@ def parseArguments_overlay():
     args = parser.parse_args()
 
     if args.config is not None:
+        args_cmd = vars(args)
         args = read_config(args.config)
         # Remove unused parameters
         entriesToRemove = ('file_cpout', 'file_suffix_1line', 'column_well', 'column_site', 'column_objnum',
@@ -196,6 +175,10 @@ def parseArguments_overlay():
         # Convert from string to tuple
         from ast import literal_eval
         args['shift'] = literal_eval(args['shift'])
+        # Options that are not part of the config file are taken from the command line
+        for key in args_cmd:
+            if key not in args:
+                args[key] = args_cmd[key]
 
         # Make dictionary entries indexable with .XXX notation, consistent with parser
         class Struct:
@@ -226,6 +209,9 @@ def read_config(file, param_col='parameter', value_col='value'):
 
 
 if __name__ == "__main__":
+    # Imported here since overlay_engine itself imports overlay_text from this file
+    from overlay_engine import run_overlay
+
     if sys.platform == 'Windows':
         myfont = ImageFont.truetype(font='ARIALNB.TTF', size=10)
     elif sys.platform == 'linux':
@@ -245,27 +231,5 @@ if __name__ == "__main__":
     for a in args.__dict__:
         print(str(a) + ": " + str(args.__dict__[a]))
 
-    os.chdir(args.in_wd)
-    # If output folder does not exist, create it
-    if not os.path.exists(args.in_out):
-        print('Creating output directory: ' + args.in_wd + args.in_out)
-        os.makedirs(args.in_out)
-
-    # Match name of the file that ends with _tracks.csv
-    for file in os.listdir(args.in_tracks):
-        if re.search('_tracks\.csv', file):
-            tracks = read_csv_track(csvfi=args.in_tracks + '/' + file,
-                                    time_col=args.time,
-                                    id_col=args.id,
-                                    xpos_col=args.xpos,
-                                    ypos_col=args.ypos)
-            break
-
-    # Identify right image and annotate it
-    image_list = [f for f in os.listdir(args.in_im) if re.search('\.png$', f)]
-    for image in image_list:
-        time = re.search('T[0-9]+\.png$', image).group()[1:-4]
-        relevant_tracks = tracks[time]
-        overlay_text(args.in_im + '/' + image, coord=list(relevant_tracks.values()),
-                     text=list(relevant_tracks.keys()), color=args.font_color, output=args.in_out + '/ovl_' + image,
-                     shift_coord=args.shift, font=myfont)
+    if run_overlay(args, myfont, script=os.path.basename(__file__)):
+        sys.exit(1)
@@ -0,0 +1,262 @@
+# Script usage:
+#
+# python3 path/to/script_overlay_batch.py root_fold
+#
+# root_fold: folder containing one subfolder per well/site (e.g. out_0001, out_0002...), see example_dir.txt.
+# Each well subfolder must comprise a folder with one .csv file ending by _tracks.csv (default: tables) and a folder
+# with the .png images to annotate (default: segmented). Annotated images are written in a third folder of each well
+# (default: out_ovl).
+# All frames of all wells are scheduled on a single pool of worker processes: the font is loaded once per worker and
+# small wells do not leave cores idle while a big well finishes.
+# With --shard_queue, several nodes sharing the folder (e.g. on NFS) split the run: each node starts this script with
+# the same arguments and claims (well, range of frames) tasks from a work queue in the shared folder, see work_queue.py.
+# Nodes can join or leave at any time, the tasks of a crashed node are claimed again when its lease expires.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, sys, re, time, argparse
+from itertools import zip_longest
+from PIL import ImageFont
+from track_table import load_track_table
+from overlay_engine import build_overlay_jobs, skip_up_to_date, iter_overlay_results, font_spec, report_errors, \
+    add_overlay_arguments, marks_from_args, display_from_args, encoding_from_args
+from manifest import Manifest
+from frame_stack import open_frame_source
+from work_queue import WorkQueue, frame_ranges, task_name
+
+
+def parseArguments_batch():
+    # Create argument parser
+    parser = argparse.ArgumentParser(description='Overlay track labels on the images of all wells under a folder.')
+
+    # Positional mandatory arguments
+    parser.add_argument('in_root', help='Folder containing one subfolder per well.', type=str)
+
+    # Layout of the well folders
+    parser.add_argument('-k', '--in_tracks', help='Subfolder of each well, containing one .csv file ending by \
+     "_tracks.csv".', type=str, default='tables')
+    parser.add_argument('-m', '--in_im', help='Subfolder of each well, containing images to annotate with .png \
+     extension, or a frame stack created by script_pack_frames.py.', type=str, default='segmented')
+    parser.add_argument('-o', '--in_out', help='Subfolder of each well, annotated images will be saved there.',
+                        type=str, default='out_ovl')
+
+    # Optional arguments, shared with script_overlay.py and script_overlay_cfg.py
+    add_overlay_arguments(parser, single_run=False)
+    parser.add_argument('-w', '--workers', help='Number of worker processes shared by all wells.', type=int,
+                        default=os.cpu_count())
+
+    # Sharded execution on several nodes
+    parser.add_argument('--shard_queue', help='Folder of a work queue shared by several nodes, created if needed. \
+     Start the script with the same arguments on each node: the nodes claim (well, range of frames) tasks until all \
+     are done. Use a new folder for each run.', type=str, default=None)
+    parser.add_argument('--frames_per_task', help='With --shard_queue, number of frames of a well per task.', type=int,
+                        default=50)
+    parser.add_argument('--lease', help='With --shard_queue, seconds after which the task of a node that stopped \
+     responding is claimed by another node.', type=float, default=600)
+
+    # Parse arguments
+    args = parser.parse_args()
+    args.shift = tuple(args.shift)
+
+    return args
+
+
+# -----------------------------
+
+
+def discover_wells(root, tracks_dir, im_dir, image_ext='png'):
+    """Find the well folders under root.
+
+    Args:
+        root (str): Folder containing one subfolder per well.
+        tracks_dir (str): Subfolder of a well with the _tracks.csv file.
+        im_dir (str): Subfolder of a well with the images.
+        image_ext (str, optional): Extension of the images, see frame_stack.list_frames. Defaults to 'png'.
+    Returns:
+        A list of 2-tuples (well folder, path to _tracks.csv file), sorted by folder name. Wells without any frame are
+        skipped with a warning.
+
+    """
+    wells = []
+    for well in sorted(os.listdir(root)):
+        well_path = os.path.join(root, well)
+        if not (os.path.isdir(os.path.join(well_path, tracks_dir)) and os.path.isdir(os.path.join(well_path, im_dir))):
+            continue
+        if not open_frame_source(os.path.join(well_path, im_dir), image_ext).frames:
+            print('Warning: no frame found in ' + os.path.join(well_path, im_dir) + ', well skipped.')
+            continue
+        for file in sorted(os.listdir(os.path.join(well_path, tracks_dir))):
+            if re.search('_tracks\.csv', file):
+                wells.append((well_path, os.path.join(well_path, tracks_dir, file)))
+                break
+    return wells
+
+
+def build_well_jobs(well, csvfi, args, marks):
+    """Jobs of all frames of a well, see overlay_engine.build_overlay_jobs. The output folder is created if needed."""
+    out = os.path.join(well, args.in_out)
+    if not os.path.exists(out):
+        os.makedirs(out, exist_ok=True)
+    tracks = load_track_table(csvfi=csvfi, time_col=args.time, id_col=args.id, xpos_col=args.xpos,
+                              ypos_col=args.ypos, use_cache=not args.no_cache, rebuild=args.rebuild_cache)
+    # Contrast of raw frames, computed once per well and sent to the workers with each frame
+    display = display_from_args(open_frame_source(os.path.join(well, args.in_im), args.image_ext), args)
+    return build_overlay_jobs(tracks, in_im=os.path.join(well, args.in_im), in_out=out,
+                              frame_format=args.frame_format, display=display, marks=marks, tail=args.tails,
+                              labels=not args.no_labels, image_ext=args.image_ext)
+
+
+def run_sharded(args, wells, font, marks, params, encoding):
+    """Process tasks of the shared work queue until all frames of all wells are done.
+
+    Args:
+        args: Parsed arguments, see parseArguments_batch.
+        wells (list of 2-tuple): Wells, see discover_wells.
+        font (FreeTypeFont): Font of the labels.
+        marks (dict): Style of markers and tails, see overlay_engine.build_overlay_jobs.
+        params (dict): Rendering parameters recorded in the manifests.
+        encoding (dict): Encoding of the output images.
+    Returns:
+        A dictionary of the counts of frames of the tasks run by this node: 'frames', 'done', 'skipped', 'failed'. All
+        frames of a task that raised an error are failed.
+
+    """
+    queue = WorkQueue(args.shard_queue, lease_seconds=args.lease)
+    # Wells are recorded relative to the root folder, which may be mounted at different paths on the nodes
+    tasks = []
+    for well, csvfi in wells:
+        n_frames = len(open_frame_source(os.path.join(well, args.in_im), args.image_ext).frames)
+        for start, end in frame_ranges(n_frames, args.frames_per_task):
+            tasks.append({'id': task_name(os.path.basename(well), start, end), 'well': os.path.basename(well),
+                          'tracks': os.path.relpath(csvfi, well), 'frames': [start, end]})
+    # Options which may differ between nodes are not part of the run
+    run_params = {k: v for k, v in vars(args).items() if k not in ('in_root', 'workers', 'shard_queue', 'lease')}
+    queue.publish(tasks, params=run_params)
+    print('Work queue: ' + args.shard_queue + ', ' + str(len(tasks)) + ' task(s), ' + str(queue.status()))
+
+    # Jobs of the last well, consecutive tasks of a node often belong to the same well
+    current = {}
+    totals = {'frames': 0, 'done': 0, 'skipped': 0, 'failed': 0}
+
+    def process(task):
+        well = os.path.join(args.in_root, task['well'])
+        if current.get('well') != well:
+            current.clear()
+            current.update(well=well, jobs=build_well_jobs(well, os.path.join(well, task['tracks']), args, marks))
+        start, end = task['frames']
+        jobs = current['jobs'][start:end]
+        manifest = Manifest(os.path.join(well, args.in_out), force=args.force)
+        todo, records = skip_up_to_date(jobs, manifest, params)
+        failed = []
+        try:
+            for job, err in iter_overlay_results(todo, font=font, color=args.font_color, shift_coord=args.shift,
+                                                 workers=args.workers, ordered=False, encoding=encoding):
+                if err is None:
+                    manifest.update(job.output, records[job.output])
+                else:
+                    failed.append((job, err))
+        finally:
+            manifest.save()
+        report_errors(failed)
+        result = {'frames': len(jobs), 'done': len(todo) - len(failed), 'skipped': len(jobs) - len(todo),
+                  'failed': len(failed)}
+        print('Task ' + task['id'] + ': ' + str(result))
+        for k in totals:
+            totals[k] += result[k]
+        return result
+
+    # Tasks which raised are recorded as done by the queue, with the error as result: their frames are failed
+    frames_of = {task['id']: task['frames'][1] - task['frames'][0] for task in tasks}
+    for task_id, result in queue.run(process):
+        if 'error' in result:
+            totals['frames'] += frames_of[task_id]
+            totals['failed'] += frames_of[task_id]
+    return totals
+
+
+def interleave(lists):
+    """Merge lists in round-robin order, so that the frames of all wells are spread over the whole run."""
+    return [item for items in zip_longest(*lists) for item in items if item is not None]
+
+
+# -----------------------------
+
+
+if __name__ == "__main__":
+    if sys.platform == 'Windows':
+        myfont = ImageFont.truetype(font='ARIALNB.TTF', size=10)
+    elif sys.platform == 'linux':
+        myfont = ImageFont.truetype(font='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', size=10)
+    else:
+        raise OSError('No default text font for the OS (only Windows and Linux have a default value).'
+                      'Please modify the present script file in the following way:'
+                      '1) remove or comment this exception raise;'
+                      '2) define a variable "myfont" which points to a path with a correct font file on your system.'
+                      'You can use the lines right (Windows and Linux) above as a template.')
+
+    # Read arguments
+    args = parseArguments_batch()
+
+    # Raw print arguments
+    print("You are running the script with arguments: ")
+    for a in args.__dict__:
+        print(str(a) + ": " + str(args.__dict__[a]))
+
+    start = time.time()
+    wells = discover_wells(args.in_root, args.in_tracks, args.in_im, args.image_ext)
+    print('Found ' + str(len(wells)) + ' well(s) under: ' + args.in_root)
+
+    # Build the jobs of every well, skipping outputs already up to date
+    encoding = encoding_from_args(args)
+    # Markers and tails, drawn below the labels
+    marks = marks_from_args(args)
+    params = {'color': args.font_color, 'shift_coord': args.shift, 'font': font_spec(myfont), 'encoding': encoding}
+    if args.shard_queue is not None:
+        totals = run_sharded(args, wells, myfont, marks, params, encoding)
+        print('Total: ' + str(totals['done']) + ' frame(s) annotated by this node in ' +
+              str(round(time.time() - start, 1)) + ' s with ' + str(args.workers) + ' worker(s), ' +
+              str(totals['skipped']) + ' skipped, ' + str(totals['failed']) + ' failed.')
+        sys.exit(1 if totals['failed'] else 0)
+
+    well_jobs, manifests, records, summary = [], {}, {}, {}
+    for well, csvfi in wells:
+        jobs = build_well_jobs(well, csvfi, args, marks)
+        manifests[well] = Manifest(os.path.join(well, args.in_out), force=args.force)
+        todo, well_records = skip_up_to_date(jobs, manifests[well], params)
+        records.update(well_records)
+        summary[well] = {'frames': len(jobs), 'skipped': len(jobs) - len(todo), 'done': 0, 'failed': 0}
+        well_jobs.append([(well, job) for job in todo])
+
+    # Run all frames on a single pool, results come in order of completion
+    schedule = interleave(well_jobs)
+    well_of = {job.output: well for well, job in schedule}
+    failed = []
+    try:
+        for job, err in iter_overlay_results([job for _, job in schedule], font=myfont, color=args.font_color,
+                                             shift_coord=args.shift, workers=args.workers, ordered=False,
+                                             encoding=encoding):
+            well = well_of[job.output]
+            if err is None:
+                summary[well]['done'] += 1
+                manifests[well].update(job.output, records[job.output])
+            else:
+                summary[well]['failed'] += 1
+                failed.append((job, err))
+            s = summary[well]
+            if s['skipped'] + s['done'] + s['failed'] == s['frames']:
+                print('Well ' + os.path.basename(well) + ' complete: ' + str(s['done']) + ' annotated, ' +
+                      str(s['failed']) + ' failed.')
+    finally:
+        for manifest in manifests.values():
+            manifest.save()
+
+    # Summary
+    report_errors(failed)
+    print('\nwell\tframes\tannotated\tskipped\tfailed')
+    for well, s in summary.items():
+        print('\t'.join([os.path.basename(well)] + [str(s[k]) for k in ('frames', 'done', 'skipped', 'failed')]))
+    print('Total: ' + str(sum([s['done'] for s in summary.values()])) + ' frame(s) annotated in ' +
+          str(round(time.time() - start, 1)) + ' s with ' + str(args.workers) + ' worker(s).')
+    if failed:
+        sys.exit(1)
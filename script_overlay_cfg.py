@@ -12,132 +12,16 @@
 # SAME AS script_overlay.py BUT PARAMS PROVIDED FROM COMMAND LINE WILL OVERWRITE CONFIG FILE PARAMS. 
 # NO DEFAULT PARAMS, ALL PARAMS ARE OPTIONAL AND CAN BE REFERRED WITH -XXX FROM CMD LINE
 
-import os, sys, csv, re, argparse, copy
-from PIL import Image, ImageDraw, ImageFont
+import os, sys, csv, argparse, copy
+from PIL import ImageFont
+from track_table import load_track_table
+# Same functions as script_overlay.py, available from this script too
+from script_overlay import read_csv_track, overlay_text
+from overlay_engine import add_overlay_arguments, run_overlay
+from frame_stack import open_frame_source
 
 
-def read_csv_track(csvfi, time_col, id_col, xpos_col, ypos_col):
-    """Export content csv file with track info to a dictionary.
-
-    Args:
-        csvfi (str): path to csv file which contains the track information. A header must be present with columns for:
-        time, track id, position in x and position in y.
-        time_col (str): name of time column.
-        id_col (str): name of track id column.
-        xpos_col (str): name of x-position column.
-        ypos_col (str): name of y-position column.
-    Returns:
-        A dictionary of depth 2. 1st keys refer to time, 2nd keys refers to track ID. Values are (x,y) coordinates.
-
-    """
-    # Check if headers are present on the first line
-    with open(csvfi, newline='') as csvfile:
-        first_line = csvfile.readline().rstrip()
-        fl = first_line.split(',')
-        if time_col in fl and id_col in fl and xpos_col in fl and ypos_col in fl:
-            pass
-        else:
-            raise ValueError('At least one of the provided column name is not found in the first line of the csv file. Expected: ' +
-                             ', '.join([time_col, id_col, xpos_col, ypos_col]) +
-                             "; Found: " + ', '.join(fl))
-          
-    # 2-level dictionary
-    # 1stKey: time;
-    # 2nd key: track_id;
-    # Val: [(x0,y0), (x1,y1), ...]
-    dict_track = {}
-    with open(csvfi, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            if row[time_col] in dict_track.keys():
-                dict_track[row[time_col]][row[id_col]] = (float(row[xpos_col]), float(row[ypos_col]))
-            else:
-                dict_track[row[time_col]] = {}
-                dict_track[row[time_col]][row[id_col]] = (float(row[xpos_col]), float(row[ypos_col]))
-    return dict_track
-
-# ---------------------------------
-
-
-def overlay_text(imfile, coord, text, output=None, shift_coord=None, font=None, color=None, show=False):
-    """"Read image file, add text at specified positions and save.
-
-    Args:
-        imfile (str): Path to the image file.
-        coord (list of 2-tuple): Coordinates (x,y) where text is written.
-        text (list of str): Text to be written.
-        output(str, optional): Path to save the image with overlayed text. Defaults to imfile with 'ovl_' prefix.
-        shift_coord (list of 2 int): Shift for text.
-        font (ImageFont object, optional): Font of text. Defaults to arial, 12pt (Windows only).
-        color (n-tuple, optional): Color of text. Should have same length as the number of channels in image. Defaults
-        to white. Can also pass -1 for default.
-        show (bool, optional): Whether to display the annotated image. Defaults to False.
-    Returns:
-        None
-    Examples:
-        # Custom font (tested on Windows, see doc if error)
-        myfont= ImageFont.truetype(font='calibri.ttf', size=20)
-        overlay_text('path/to/image.jpg', [(40,10), (80,120)], ['1st coords', '2nd coords'], font=myfont)
-
-    """
-
-    def check_color_format(mode, color):
-        """Check if color is properly formatted for the image mode (L or RGB only)"""
-        if mode == 'L':
-            try:
-                color_check = isinstance(color, int) and (0 <= color <= 255)
-            except:
-                raise ValueError('For 8 bits grayscale (image mode "L"), color must be an integer between 0 and 255.')
-        elif mode == 'RGB':
-            try:
-                color_check = isinstance(color, tuple) and len(color) == 3 and all([0 <= i <= 255 for i in color])
-            except:
-                raise ValueError('For 8-bits RGB images color must be a 3-tuple of integers between 0 and 255.')
-        if not color_check:
-            error_message = 'For 8-bits grayscale (image mode "L"), color must be an integer between 0 and 255.' if mode == 'L' else 'For RGB images color must be a 3-tuple of integers between 0 and 255.'
-            raise ValueError(error_message)
-
-    if type(coord) != list or type(text) != list:
-        raise TypeError('coord and text must be lists')
-    if len(coord) != len(text):
-        raise ValueError('coord and text must have same length')
-    if shift_coord is None:
-        shift_coord = [0, 0]
-    # Read image file and create drawing object
-    im = Image.open(imfile)
-    # If mode is 'P' (8bits + palette, common for imagej export) font color is bound to the palette,
-    # usually not desirable, go to RGB (e.g. intensity 255 in 8 bits with red mapping renders a red font instead of white)
-    # see http://effbot.org/imagingbook/concepts.htm#mode
-    if im.mode == 'P':
-        im = im.convert('RGB')
-    assert im.mode == 'L' or im.mode == 'RGB'
-    imdraw = ImageDraw.Draw(im)
-    # Set defaults
-    if output is None:
-        output = 'ovl_'+imfile
-    if font is None:
-        font = ImageFont.truetype(font='arial', size=12)
-    if isinstance(color, list):  # as provided by argparse
-        color = tuple(color)
-    if color in [-1, (-1,), (-1,-1,-1), '-1', '(-1,)', '(-1,-1,-1)']:
-        # Default to white for grayscale('L') or RGB
-        default_col = {'L': 255, 'RGB': (255, 255, 255)}
-        color = default_col[im.mode]
-    check_color_format(im.mode, color)
-
-    # Add text and save
-    coord = [(i[0]+shift_coord[0], i[1]+shift_coord[1]) for i in coord]
-    for xy, txt in zip(coord, text):
-        imdraw.text(xy, txt, font=font, fill=color)
-    im.save(output)
-    if show:
-        im.show()
-
-
-# -----------------------------
-
-
-def parseArguments_overlay_cfg():
+def parseArguments_overlay_cfg(argv=None):
     # Create argument parser
     parser = argparse.ArgumentParser(description='Overlay track labels on top of images using LAP output.')
 
@@ -146,34 +30,23 @@ def parseArguments_overlay_cfg():
     parser.add_argument('-k','--in_tracks', help='Subfolder of "in_wd", containing one .csv file ending by "_tracks.csv".',
                         type=str, default=None)
     parser.add_argument('-m','--in_im', help='Subfolder of "in_wd", containing images to annotate with .png extension. Name of\
-                                      the files must end by "T[0-9]+.png", to indicate time of the image.', type=str,
+                                      the files must end by "T[0-9]+.png", to indicate time of the image.\
+                                      Can also be a frame stack created by script_pack_frames.py.', type=str,
                         default=None)
     parser.add_argument('-o','--in_out', help='Subfolder of "in_wd", annotated images will be saved there.', type=str,
                         default=None)
-    parser.add_argument('-f', '--font_color', help='Font color of the overlaid text. Must be an integer (resp. a'
-                                                   ' 3-tuple of integers) between 0 and 255 if the image if 8-bits'
-                                                   ' grayscale (resp. 8-bits RGB). Default to white. Can also pass -1'
-                                                   ' to use default color.', type=int,
-                        default=-1, nargs='+')
-    parser.add_argument('-t', '--time', help='Name of time column in _tracks.csv file.', type=str,
-                        default=None)
-    parser.add_argument('-i', '--id', help='Name of track ID column in _tracks.csv file.', type=str,
-                        default=None)
-    parser.add_argument('-x', '--xpos', help='Name of x-position column in _tracks.csv file.', type=str,
-                        default=None)
-    parser.add_argument('-y', '--ypos', help='Name of y-position column in _tracks.csv file.', type=str,
-                        default=None)
-    parser.add_argument('-s', '--shift', help='Shift the position of the writing. Useful to center writings in cells. \
-     Provide as 2 integers separated by a white space.',
-                        nargs=2, type=int, default=None)
+
+    # Optional arguments, shared with script_overlay.py and script_overlay_batch.py. Columns and shift have no
+    # default, they can be provided by the config file
+    add_overlay_arguments(parser, defaults=False)
 
     # If provided a config file, command line arguments will have priority
     parser.add_argument('-c', '--config', help='Path to config file. Parameters provided at the command line'
                                                'will overwrite the ones in config file.', type=str,
                         default=None)
 
-    # Parse arguments
-    args = parser.parse_args()
+    # Parse arguments, from the command line if argv is None
+    args = parser.parse_args(argv)
     # make correspondence dict: args config <=> args command line
     lookup = {'in_wd': 'path_wd',
               'in_tracks': 'dir_lapout',
@@ -222,6 +95,11 @@ def parseArguments_overlay_cfg():
             from ast import literal_eval
             args['font_color'] = literal_eval(args['font_color'])
 
+        # Options that are not part of the config file are taken from the command line
+        for key in args_cmd:
+            if key not in lookup and key != 'config':
+                args[key] = args_cmd[key]
+
         # Make dictionary entries indexable with .XXX notation, consistent with parser object
         class Struct:
             def __init__(self, **entries):
@@ -256,6 +134,28 @@ def read_config(file, param_col='parameter', value_col='value'):
 # -----------------------------
 
 
+def run_overlay_cfg(args, font, load_tracks=load_track_table, open_source=open_frame_source):
+    """Annotate the frames as requested by the command line arguments, see overlay_engine.run_overlay.
+
+    Args:
+        args: Parsed arguments, see parseArguments_overlay_cfg. Paths are relative to the current directory, which is
+        changed to args.in_wd.
+        font (FreeTypeFont): Font of the labels.
+        load_tracks (function, optional): Loader of the tracks table, same arguments as track_table.load_track_table.
+        Defaults to load_track_table.
+        open_source (function, optional): Opener of the frames, same arguments as frame_stack.open_frame_source. Used
+        to compute the display range. Defaults to open_frame_source.
+    Returns:
+        The number of frames that could not be annotated.
+
+    """
+    return run_overlay(args, font, load_tracks=load_tracks, open_source=open_source,
+                       script=os.path.basename(__file__))
+
+
+# -----------------------------
+
+
 if __name__ == "__main__":
     if sys.platform == 'Windows':
         myfont = ImageFont.truetype(font='ARIALNB.TTF', size=10)
@@ -276,27 +176,5 @@ if __name__ == "__main__":
     for a in args.__dict__:
         print(str(a) + ": " + str(args.__dict__[a]))
 
-    os.chdir(args.in_wd)
-    # If output folder does not exist, create it
-    if not os.path.exists(args.in_out):
-        print('Creating output directory: ' + args.in_wd + args.in_out)
-        os.makedirs(args.in_out)
-
-    # Match name of the file that ends with _tracks.csv
-    for file in os.listdir(args.in_tracks):
-        if re.search('_tracks\.csv', file):
-            tracks = read_csv_track(csvfi=args.in_tracks + '/' + file,
-                                    time_col=args.time,
-                                    id_col=args.id,
-                                    xpos_col=args.xpos,
-                                    ypos_col=args.ypos)
-            break
-
-    # Identify right image and annotate it
-    image_list = [f for f in os.listdir(args.in_im) if re.search('\.png$', f)]
-    for image in image_list:
-        time = re.search('T[0-9]+\.png$', image).group()[1:-4]
-        relevant_tracks = tracks[time]
-        overlay_text(args.in_im + '/' + image, coord=list(relevant_tracks.values()),
-                     text=list(relevant_tracks.keys()), color=args.font_color, output=args.in_out + '/ovl_' + image,
-                     shift_coord=args.shift, font=myfont)
+    if run_overlay_cfg(args, myfont):
+        sys.exit(1)
@@ -0,0 +1,51 @@
+# Script usage:
+#
+# python3 path/to/script_pack_frames.py subfold_png subfold_stack [--image_ext tif]
+#
+# subfold_png: folder containing the images of a well with .png extension, names ending by "T[0-9]+.png"
+# --image_ext tif: pack the .tif/.tiff images of the folder instead of the .png ones
+# subfold_stack: folder where the memory-mapped frame stack is written (frames.npy and index.json)
+# The stack folder can then be given instead of the .png folder to script_overlay.py, script_overlay_cfg.py and
+# script_cropfilm.py.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import argparse
+from frame_stack import IMAGE_EXTENSIONS, pack_frames
+
+
+def parseArguments_pack():
+    # Create argument parser
+    parser = argparse.ArgumentParser(description='Pack a series of .png frames into a memory-mapped frame stack.')
+
+    # Positional mandatory arguments
+    parser.add_argument('in_im', help='Folder containing images with .png extension. Name of the files must end by \
+     "T[0-9]+.png", to indicate time of the image. All images must have same size and mode.', type=str)
+    parser.add_argument('out_stack', help='Folder where the frame stack is written, created if it does not exist.',
+                        type=str)
+
+    # Optional arguments
+    parser.add_argument('--image_ext', help='Extension of the images to pack: "png", or "tif" for .tif and .tiff \
+     files. Other images in the folder are ignored.', type=str, choices=IMAGE_EXTENSIONS, default='png')
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+
+# -------------------------------
+
+
+if __name__ == "__main__":
+    # Read arguments
+    args = parseArguments_pack()
+
+    # Raw print arguments
+    print("You are running the script with arguments: ")
+    for a in args.__dict__:
+        print(str(a) + ": " + str(args.__dict__[a]))
+
+    stack = pack_frames(args.in_im, args.out_stack, args.image_ext)
+    print('Packed ' + str(len(stack)) + ' frames of shape ' + str(stack.array.shape[1:]) + ' in: ' + args.out_stack)
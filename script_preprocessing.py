@@ -0,0 +1,77 @@
+# Script usage:
+#
+# python3 path/to/script_preprocessing.py tracks_csv out_fold
+#
+# tracks_csv: .csv table with one row per track and per frame, e.g. objNuclei_clean_tracks.csv
+# out_fold: folder where the preprocessed tables are written, one per condition (condition1.csv, condition2.csv...)
+# Same steps as preprocessing.R and select_random_save.R, without R:
+# 1) Select only full trajectories
+# 2) Impute missing data by linear interpolation inside each trajectory
+# 3) Save one table for each condition with a random subset of trajectories
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import argparse
+from preprocessing import preprocess, DEFAULT_ID_COLS
+
+
+def parseArguments_preprocessing():
+    # Create argument parser
+    parser = argparse.ArgumentParser(description='Select complete trajectories, impute missing values and save random '
+                                                 'subsets of trajectories per condition.')
+
+    # Positional mandatory arguments
+    parser.add_argument('in_csv', help='Path to the .csv table, one row per track and per frame.', type=str)
+    parser.add_argument('out_dir', help='Folder where the tables are written, created if it does not exist.', type=str)
+
+    # Optional arguments
+    parser.add_argument('-n', '--ntraj', help='Number of trajectories randomly sampled in each condition. By default, \
+     all trajectories are kept.', type=int, default=None)
+    parser.add_argument('-c', '--cond', help='Name of the condition column, one table is written per condition. By \
+     default, all trajectories go to a single table.', type=str, default=None)
+    parser.add_argument('-u', '--uniq', help='Name of the column with unique trajectory IDs. If absent, it is created \
+     by pasting the columns given with --id_cols with "_".', type=str, default='uniqID')
+    parser.add_argument('--id_cols', help='Columns identifying a trajectory, used to create the unique IDs.', nargs='+',
+                        type=str, default=list(DEFAULT_ID_COLS))
+    parser.add_argument('-t', '--time', help='Name of time column.', type=str, default='Image_Metadata_T')
+    parser.add_argument('-i', '--impute', help='Columns whose missing values are interpolated. By default, all numeric \
+     columns except IDs, time and condition.', nargs='+', type=str, default=None)
+    parser.add_argument('-d', '--drop', help='Columns not written in the outputs.', nargs='+', type=str, default=[])
+    parser.add_argument('--keep_incomplete', help='Keep trajectories shorter than the longest one.',
+                        action='store_true')
+    parser.add_argument('--min_obs', help='Minimum number of observations of a sampled trajectory.', type=int,
+                        default=None)
+    parser.add_argument('--seed', help='Seed of the random sampling, same seed gives same subsets.', type=int,
+                        default=None)
+    parser.add_argument('--prefix', help='Name of the output tables, followed by the number of the condition.',
+                        type=str, default='condition')
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+
+# -------------------------------
+
+
+if __name__ == "__main__":
+    # Read arguments
+    args = parseArguments_preprocessing()
+
+    # Raw print arguments
+    print("You are running the script with arguments: ")
+    for a in args.__dict__:
+        print(str(a) + ": " + str(args.__dict__[a]))
+
+    outputs = preprocess(args.in_csv, args.out_dir, ntraj=args.ntraj, cond_col=args.cond, impute=args.impute,
+                         keep_incomplete=args.keep_incomplete, min_obs=args.min_obs, uniq_col=args.uniq,
+                         id_cols=tuple(args.id_cols), time_col=args.time, drop=tuple(args.drop), seed=args.seed,
+                         prefix=args.prefix)
+    if outputs:
+        imputed = outputs[0]['imputed']
+        print('Imputed values: ' + ', '.join([name + ': ' + str(n) for name, n in imputed.items()]))
+    for output in outputs:
+        print('Condition ' + str(output['condition']) + ': ' + str(output['tracks']) + ' trajectories, ' +
+              str(output['rows']) + ' rows written in: ' + output['path'])
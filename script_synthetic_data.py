@@ -0,0 +1,56 @@
+# Script usage:
+#
+# python3 path/to/script_synthetic_data.py root_fold
+#
+# root_fold: folder where synthetic wells out_0001, out_0002... are written, with the same layout as the real data (see
+# example_dir.txt): a _tracks.csv file in tables/ and .png frames in segmented/. The size of the dataset and the mode of
+# the images can be chosen, e.g. to benchmark the scripts (see script_benchmark.py) or to try options without real data.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import argparse
+from synthetic_data import make_dataset, IMAGE_MODES
+
+
+def parseArguments_synthetic():
+    # Create argument parser
+    parser = argparse.ArgumentParser(description='Write synthetic wells with tracks and frames.')
+
+    # Positional mandatory arguments
+    parser.add_argument('root', help='Folder where the wells are written, created if it does not exist.', type=str)
+
+    # Size of the dataset
+    parser.add_argument('-n', '--n_wells', help='Number of wells.', type=int, default=1)
+    parser.add_argument('-f', '--frames', help='Number of frames per well.', type=int, default=50)
+    parser.add_argument('-k', '--tracks', help='Number of tracks per well.', type=int, default=100)
+    parser.add_argument('-s', '--size', help='Width and height of the frames, 2 integers separated by a white space.',
+                        nargs=2, type=int, default=(512, 512))
+    parser.add_argument('-m', '--mode', help='PIL mode of the frames: "L" (8-bits grayscale), "P" (8-bits with a \
+     palette) or "RGB".', type=str, choices=IMAGE_MODES, default='L')
+    parser.add_argument('--seed', help='Seed of the random generator, same seed gives same files.', type=int,
+                        default=0)
+
+    # Parse arguments
+    args = parser.parse_args()
+    args.size = tuple(args.size)
+
+    return args
+
+
+# -------------------------------
+
+
+if __name__ == "__main__":
+    # Read arguments
+    args = parseArguments_synthetic()
+
+    # Raw print arguments
+    print("You are running the script with arguments: ")
+    for a in args.__dict__:
+        print(str(a) + ": " + str(args.__dict__[a]))
+
+    wells = make_dataset(args.root, n_wells=args.n_wells, seed=args.seed, n_frames=args.frames, n_tracks=args.tracks,
+                         width=args.size[0], height=args.size[1], mode=args.mode)
+    for well in wells:
+        print('Wrote ' + str(well['frames']) + ' frames and ' + str(well['rows']) + ' rows in: ' + well['csv'])
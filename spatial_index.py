@@ -0,0 +1,125 @@
+# Spatial queries on the cells of each frame: all cells inside a rectangle, or within a distance of a point.
+#
+# The positions of a frame are bucketed into a uniform grid of square cells. The rows of the frame are sorted by grid
+# cell, so that the cells of one row of the grid covered by a query are a contiguous range found by binary search.
+# Only the candidates of the covered grid cells are then tested exactly, instead of every cell of the frame.
+# Grids are built on first query of a frame, from the columns of a TrackTable (no copy of the table).
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import numpy as np
+
+
+class FrameGrid:
+    """Uniform grid over the positions of the cells of one frame.
+
+    Args:
+        x, y (numpy array): Positions of the cells.
+        cell_size (float): Side of the grid cells, in pixels. About the typical query size is a good choice.
+    """
+
+    def __init__(self, x, y, cell_size):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.cell_size = float(cell_size)
+        if len(self.x) == 0:
+            self.order = np.zeros(0, dtype=np.int64)
+            return
+        cx = np.floor(self.x / self.cell_size).astype(np.int64)
+        cy = np.floor(self.y / self.cell_size).astype(np.int64)
+        self.col0, self.row0 = int(cx.min()), int(cy.min())
+        self.n_cols = int(cx.max()) - self.col0 + 1
+        self.n_rows = int(cy.max()) - self.row0 + 1
+        keys = (cy - self.row0) * self.n_cols + (cx - self.col0)
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    def candidates(self, x0, y0, x1, y1):
+        """Indices of the cells in the grid cells overlapping the rectangle [x0, x1] x [y0, y1], unsorted."""
+        if len(self.order) == 0:
+            return self.order
+        c0 = max(int(np.floor(x0 / self.cell_size)) - self.col0, 0)
+        c1 = min(int(np.floor(x1 / self.cell_size)) - self.col0, self.n_cols - 1)
+        r0 = max(int(np.floor(y0 / self.cell_size)) - self.row0, 0)
+        r1 = min(int(np.floor(y1 / self.cell_size)) - self.row0, self.n_rows - 1)
+        if c0 > c1 or r0 > r1:
+            return np.zeros(0, dtype=np.int64)
+        rows = np.arange(r0, r1 + 1) * self.n_cols
+        starts = np.searchsorted(self.keys, rows + c0, side='left')
+        ends = np.searchsorted(self.keys, rows + c1, side='right')
+        if len(starts) == 1:
+            return self.order[starts[0]:ends[0]]
+        return np.concatenate([self.order[s:e] for s, e in zip(starts.tolist(), ends.tolist())])
+
+    def in_rectangle(self, x0, y0, x1, y1):
+        """Sorted indices of the cells with x0 <= x < x1 and y0 <= y < y1."""
+        i = self.candidates(x0, y0, x1, y1)
+        keep = (self.x[i] >= x0) & (self.x[i] < x1) & (self.y[i] >= y0) & (self.y[i] < y1)
+        return np.sort(i[keep])
+
+    def in_radius(self, x, y, radius):
+        """Sorted indices of the cells at distance at most radius from (x, y)."""
+        i = self.candidates(x - radius, y - radius, x + radius, y + radius)
+        keep = (self.x[i] - x) ** 2 + (self.y[i] - y) ** 2 <= radius * radius
+        return np.sort(i[keep])
+
+
+class SpatialIndex:
+    """Region and radius queries on the cells of every frame of a TrackTable.
+
+    Queries return row numbers of the table, e.g. table.track_id[rows] gives the IDs of the cells found.
+
+    Args:
+        table (TrackTable): Tracks positions.
+        cell_size (float, optional): Side of the grid cells, in pixels. Defaults to 64.
+    """
+
+    def __init__(self, table, cell_size=64):
+        self.table = table
+        self.cell_size = cell_size
+        self._grids = {}
+
+    def grid(self, time):
+        """Grid of a frame and the first row of the frame in the table. Raise KeyError if the frame is absent."""
+        time = int(time)
+        if time not in self._grids:
+            s = self.table.frame_slice(time)
+            self._grids[time] = (FrameGrid(self.table.x[s], self.table.y[s], self.cell_size), s.start)
+        return self._grids[time]
+
+    def in_rectangle(self, time, x0, y0, x1, y1):
+        """Rows of the cells of a frame with x0 <= x < x1 and y0 <= y < y1. Empty if the frame is absent."""
+        if time not in self.table:
+            return np.zeros(0, dtype=np.int64)
+        grid, start = self.grid(time)
+        return start + grid.in_rectangle(x0, y0, x1, y1)
+
+    def in_radius(self, time, x, y, radius):
+        """Rows of the cells of a frame at distance at most radius from (x, y). Empty if the frame is absent."""
+        if time not in self.table:
+            return np.zeros(0, dtype=np.int64)
+        grid, start = self.grid(time)
+        return start + grid.in_radius(x, y, radius)
+
+    def neighbors(self, time, track_id, radius, include_self=True, interpolate=False):
+        """Rows of the cells of a frame within radius of a track.
+
+        Args:
+            time (int or str): Frame.
+            track_id: Track ID, as stored in the table or as a string.
+            radius (float): Maximal distance to the track, in pixels.
+            include_self (bool, optional): Whether to return the row of the track itself. Defaults to True.
+            interpolate (bool, optional): If the track is missing at this frame, use its interpolated position, see
+            TrackIndex.positions. Defaults to False.
+        Returns:
+            A numpy array of rows, empty if the track has no position at this frame.
+
+        """
+        position = self.table.track_index().position(track_id, time, interpolate=interpolate)
+        if position is None:
+            return np.zeros(0, dtype=np.int64)
+        rows = self.in_radius(time, position[0], position[1], radius)
+        if not include_self:
+            rows = rows[self.table.track_id[rows] != self.table.id_from_str(track_id)]
+        return rows
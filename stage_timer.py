@@ -0,0 +1,105 @@
+# Lightweight timing of the stages of the overlay and crop scripts (--profile).
+#
+# Code wraps each stage in "with timer.stage('decode'):". Durations are collected per stage, one sample per frame, and
+# summarized as total, mean and 95th percentile. A disabled timer does nothing, so the hooks can stay in the hot loops.
+# Worker processes time their own frames and send the samples back with each result, see StageTimer.take and merge.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import json, time, cProfile, pstats
+from contextlib import contextmanager
+import numpy as np
+
+
+class StageTimer:
+    """Durations of named stages.
+
+    Args:
+        enabled (bool, optional): If False, stage, add and merge do nothing. Defaults to True.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.samples = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as one sample of stage name."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples.setdefault(name, []).append(time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        """Add one sample (in seconds) to stage name."""
+        if self.enabled:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def take(self):
+        """Return the samples collected so far and clear them, to send them from a worker process."""
+        samples, self.samples = self.samples, {}
+        return samples
+
+    def merge(self, samples):
+        """Add samples returned by take in another process."""
+        if self.enabled and samples:
+            for name, values in samples.items():
+                self.samples.setdefault(name, []).extend(values)
+
+    def summary(self):
+        """Statistics of each stage, in order of first occurrence.
+
+        Returns:
+            A dictionary {stage: {'count', 'total', 'mean', 'p95'}}, times in seconds.
+
+        """
+        stats = {}
+        for name, values in self.samples.items():
+            values = np.asarray(values)
+            stats[name] = {'count': int(values.size), 'total': float(values.sum()), 'mean': float(values.mean()),
+                           'p95': float(np.percentile(values, 95))}
+        return stats
+
+    def report(self, n_frames=None):
+        """Print a table of the stages, with their share of the wall time since the timer was created."""
+        wall = time.perf_counter() - self._start
+        print('\nstage\tcount\ttotal (s)\tmean (ms)\tp95 (ms)\t% of wall')
+        for name, s in self.summary().items():
+            print('\t'.join([name, str(s['count']), str(round(s['total'], 3)), str(round(1000 * s['mean'], 2)),
+                             str(round(1000 * s['p95'], 2)), str(round(100 * s['total'] / wall, 1))]))
+        rate = '' if not n_frames else ', ' + str(round(n_frames / wall, 1)) + ' frames/s'
+        print('Wall time: ' + str(round(wall, 3)) + ' s' + rate + '.')
+        if sum([s['total'] for s in self.summary().values()]) > wall:
+            print('Stages of worker processes or pipeline threads run concurrently, their totals exceed the wall time.')
+
+    def write_json(self, path, **extra):
+        """Write the summary, the wall time and any extra json-serializable information to a .json file."""
+        with open(path, 'w') as f:
+            json.dump(dict(extra, wall=time.perf_counter() - self._start, stages=self.summary()), f, indent=1)
+
+
+@contextmanager
+def profile_block(path=None, n_lines=20):
+    """Run the enclosed block under cProfile if path is provided.
+
+    Statistics are dumped to path (open with pstats or snakeviz) and the n_lines most expensive functions, by
+    cumulative time, are printed. Only the current process is profiled, not worker processes.
+    """
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print('\ncProfile statistics written to: ' + path)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(n_lines)
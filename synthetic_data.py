@@ -0,0 +1,193 @@
+# Synthetic wells with the same layout as the real data (see example_dir.txt), for benchmarks and tests by hand.
+#
+# Each well folder out_XXXX comprises:
+#  - tables/objNuclei_Well<well>_S00_tracks.csv: one row per detected nucleus and per frame, with the default column
+#    names of the CellProfiler pipeline (Image_Metadata_T, track_id, objNuclei_Location_Center_X/Y...) and KTR
+#    intensities. Tracks start and end at random frames, and some detections are missing.
+#  - segmented/imNuclei_Well<well>_S00_T<time>.png: noisy frames with a bright nucleus at each detected position.
+# Everything is drawn from a seeded generator, the same arguments always give the same files.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, csv
+import numpy as np
+from PIL import Image
+
+TRACKS_COLUMNS = ['Image_Metadata_Well', 'Image_Metadata_Site', 'Image_Metadata_T', 'track_id',
+                  'objNuclei_Location_Center_X', 'objNuclei_Location_Center_Y',
+                  'objNuclei_Intensity_MeanIntensity_imKTR', 'objCytoRing_Intensity_MeanIntensity_imKTR',
+                  'objCells_Intensity_MeanIntensity_imKTR']
+IMAGE_MODES = ('L', 'P', 'RGB')
+
+
+def simulate_tracks(n_frames, n_tracks, width, height, full_fraction=0.7, p_missing=0.02, rng=None):
+    """Random walks of nuclei with births, deaths and missing detections.
+
+    Args:
+        n_frames (int): Number of frames, times go from 1 to n_frames.
+        n_tracks (int): Number of tracks.
+        width, height (int): Size of the frames, positions stay inside.
+        full_fraction (float, optional): Fraction of the tracks present from the first to the last frame. Defaults to
+        0.7.
+        p_missing (float, optional): Probability that a detection is missing. Defaults to 0.02.
+        rng (numpy Generator, optional): Random generator. Defaults to a new generator with seed 0.
+    Returns:
+        A 3-tuple (present, x, y) of arrays of shape (n_frames, n_tracks): whether track is detected at each frame, and
+        its position.
+
+    """
+    rng = np.random.default_rng(0) if rng is None else rng
+    start = rng.integers(0, n_frames, n_tracks)
+    end = np.minimum(start + rng.integers(n_frames // 4 + 1, n_frames + 1, n_tracks), n_frames)
+    full = rng.random(n_tracks) < full_fraction
+    start[full], end[full] = 0, n_frames
+    frames = np.arange(n_frames)[:, None]
+    present = (frames >= start) & (frames < end) & (rng.random((n_frames, n_tracks)) >= p_missing)
+
+    # Random walk with a small drift per track, reflected on the borders
+    drift = rng.normal(0, 0.5, (1, n_tracks, 2))
+    steps = rng.normal(0, 1.5, (n_frames, n_tracks, 2)) + drift
+    steps[0] = rng.uniform(0, 1, (n_tracks, 2)) * [width - 1, height - 1]
+    xy = np.cumsum(steps, axis=0)
+    size = np.array([width - 1, height - 1], dtype=float)
+    xy = size - np.abs(np.mod(xy, 2 * size) - size)
+    return present, xy[..., 0], xy[..., 1]
+
+
+def simulate_ktr(n_frames, n_tracks, rng=None):
+    """KTR intensities of nucleus, cytoplasmic ring and whole cell, shape (n_frames, n_tracks) each.
+
+    The cytoplasm/nucleus ratio oscillates with a random period and phase per track, on top of a slow decay and noise.
+    """
+    rng = np.random.default_rng(0) if rng is None else rng
+    t = np.arange(n_frames)[:, None]
+    period = rng.uniform(8, 30, n_tracks)
+    phase = rng.uniform(0, 2 * np.pi, n_tracks)
+    ratio = 1 + 0.3 * np.sin(2 * np.pi * t / period + phase) + rng.normal(0, 0.03, (n_frames, n_tracks))
+    nuclei = 0.05 * np.exp(-t / (4 * n_frames)) * rng.uniform(0.8, 1.2, n_tracks) + \
+        rng.normal(0, 0.002, (n_frames, n_tracks))
+    ring = nuclei * ratio
+    cells = (nuclei + 2 * ring) / 3
+    return nuclei, ring, cells
+
+
+def write_tracks_csv(path, well, present, x, y, intensities, p_nan=0.005, rng=None):
+    """Write a _tracks.csv file, rows sorted by time then track ID as in CellProfiler outputs.
+
+    Args:
+        path (str): Path of the .csv file.
+        well (str): Name of the well, e.g. "C2".
+        present, x, y (numpy array): Outputs of simulate_tracks.
+        intensities (tuple of numpy array): Outputs of simulate_ktr.
+        p_nan (float, optional): Probability that an intensity is not measured ("nan"). Defaults to 0.005.
+        rng (numpy Generator, optional): Random generator. Defaults to a new generator with seed 0.
+    Returns:
+        Number of rows written.
+
+    """
+    rng = np.random.default_rng(0) if rng is None else rng
+    nan = rng.random((3,) + present.shape) < p_nan
+    n_rows = 0
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(TRACKS_COLUMNS)
+        for t, k in zip(*np.nonzero(present)):
+            values = ['nan' if nan[c, t, k] else '%.6f' % intensities[c][t, k] for c in range(3)]
+            writer.writerow([well, 0, t + 1, k + 1, '%.3f' % x[t, k], '%.3f' % y[t, k]] + values)
+            n_rows += 1
+    return n_rows
+
+
+def _nucleus_stamp(radius):
+    # Bright disk with a soft border
+    yy, xx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    return np.clip(1.5 - np.hypot(xx, yy) / radius, 0, 1).astype(np.float32)
+
+
+def render_frame(width, height, x, y, mode='L', radius=6, rng=None):
+    """Noisy frame with a nucleus at each position.
+
+    Args:
+        width, height (int): Size of the frame.
+        x, y (numpy array): Positions of the nuclei.
+        mode (str, optional): One of IMAGE_MODES. Defaults to 'L'.
+        radius (int, optional): Radius of the nuclei, in pixels. Defaults to 6.
+        rng (numpy Generator, optional): Random generator. Defaults to a new generator with seed 0.
+    Returns:
+        A PIL Image.
+
+    """
+    rng = np.random.default_rng(0) if rng is None else rng
+    stamp = _nucleus_stamp(radius)
+    canvas = np.zeros((height + 2 * radius, width + 2 * radius), dtype=np.float32)
+    for cx, cy in zip(np.rint(x).astype(int), np.rint(y).astype(int)):
+        canvas[cy:cy + 2 * radius + 1, cx:cx + 2 * radius + 1] += stamp
+    canvas = canvas[radius:radius + height, radius:radius + width]
+    pixels = np.clip(20 + 180 * canvas + rng.normal(0, 8, canvas.shape), 0, 255).astype(np.uint8)
+    if mode == 'L':
+        return Image.fromarray(pixels)
+    elif mode == 'P':
+        im = Image.fromarray(pixels).convert('P')
+        # "Fire" palette: black, red, yellow, white
+        ramp = np.arange(256)
+        im.putpalette(np.stack([np.clip(3 * ramp, 0, 255), np.clip(3 * ramp - 255, 0, 255),
+                                np.clip(3 * ramp - 510, 0, 255)], axis=1).astype(np.uint8).ravel().tolist())
+        return im
+    elif mode == 'RGB':
+        # Nuclei in red, dimmer cytoplasm signal around them in green
+        glow = np.clip(20 + 60 * np.sqrt(canvas) + rng.normal(0, 8, canvas.shape), 0, 255).astype(np.uint8)
+        return Image.fromarray(np.stack([pixels, glow, np.full_like(pixels, 10)], axis=2))
+    raise ValueError('Unknown image mode: ' + str(mode) + '. Expected one of: ' + ', '.join(IMAGE_MODES))
+
+
+def make_well(well_dir, well='C2', n_frames=50, n_tracks=100, width=512, height=512, mode='L', seed=0,
+              tracks_dir='tables', im_dir='segmented'):
+    """Write a synthetic well folder.
+
+    Args:
+        well_dir (str): Well folder, e.g. "root/out_0001". Created if it does not exist.
+        well (str, optional): Name of the well in file names and in the table. Defaults to "C2".
+        n_frames (int, optional): Number of frames. Defaults to 50.
+        n_tracks (int, optional): Number of tracks. Defaults to 100.
+        width, height (int, optional): Size of the frames. Defaults to 512.
+        mode (str, optional): PIL mode of the frames, one of IMAGE_MODES. Defaults to 'L'.
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+        tracks_dir, im_dir (str, optional): Subfolders of the table and of the images. Default to "tables" and
+        "segmented".
+    Returns:
+        A dictionary with the path of the _tracks.csv file, the image folder, and the numbers of frames and rows.
+
+    """
+    if mode not in IMAGE_MODES:
+        raise ValueError('Unknown image mode: ' + str(mode) + '. Expected one of: ' + ', '.join(IMAGE_MODES))
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(well_dir, tracks_dir), exist_ok=True)
+    os.makedirs(os.path.join(well_dir, im_dir), exist_ok=True)
+    present, x, y = simulate_tracks(n_frames, n_tracks, width, height, rng=rng)
+    csvfi = os.path.join(well_dir, tracks_dir, 'objNuclei_Well' + well + '_S00_tracks.csv')
+    n_rows = write_tracks_csv(csvfi, well, present, x, y, simulate_ktr(n_frames, n_tracks, rng=rng), rng=rng)
+    # Times are not zero-padded, in the file names as in the table, like the CellProfiler exports
+    for t in range(n_frames):
+        im = render_frame(width, height, x[t, present[t]], y[t, present[t]], mode=mode, rng=rng)
+        im.save(os.path.join(well_dir, im_dir, 'imNuclei_Well' + well + '_S00_T' + str(t + 1) + '.png'))
+    return {'csv': csvfi, 'images': os.path.join(well_dir, im_dir), 'frames': n_frames, 'rows': n_rows}
+
+
+def make_dataset(root, n_wells=1, seed=0, **kwargs):
+    """Write n_wells synthetic wells out_0001, out_0002... under root.
+
+    Args:
+        root (str): Folder of the dataset. Created if it does not exist.
+        n_wells (int, optional): Number of wells. Defaults to 1.
+        seed (int, optional): Seed of the first well, the next wells use seed+1, seed+2... Defaults to 0.
+        **kwargs: Other arguments of make_well.
+    Returns:
+        A list with the output of make_well for each well.
+
+    """
+    wells = []
+    for i in range(n_wells):
+        well = chr(ord('C') + i // 12) + str(2 + i % 12)
+        wells.append(make_well(os.path.join(root, 'out_' + str(i + 1).zfill(4)), well=well, seed=seed + i, **kwargs))
+    return wells
@@ -0,0 +1,84 @@
+# Regression tests of the display scaling chosen for a source of frames (display.py), run with:
+# python -m pytest tests
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, sys
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import crop_engine
+from frame_stack import open_frame_source, pack_frames
+from display import is_drawable, source_is_drawable, display_for_source, stack_percentiles
+
+
+def _folder(path, images, ext='png'):
+    os.makedirs(path)
+    for t, im in enumerate(images):
+        im.save(os.path.join(path, 'img_T' + str(t + 1) + '.' + ext))
+    return path
+
+
+def _count_decodes(monkeypatch):
+    """Count the frames decoded by the PngFolder sources."""
+    decoded = []
+    load_frame = crop_engine.load_frame
+
+    def counting(imfile):
+        decoded.append(imfile)
+        return load_frame(imfile)
+    monkeypatch.setattr('frame_stack.load_frame', counting)
+    return decoded
+
+
+def _images():
+    rng = np.random.default_rng(1)
+    gray = Image.fromarray(rng.integers(0, 256, (6, 7), dtype=np.uint8))
+    return {'L': [gray] * 3, 'RGB': [gray.convert('RGB')] * 3, 'P': [gray.convert('P')] * 3,
+            'I;16': [Image.fromarray(rng.integers(0, 4096, (6, 7), dtype=np.uint16)) for _ in range(3)],
+            'RGBA': [gray.convert('RGBA')] * 3}
+
+
+def test_header_check_matches_decoded_frames(tmp_path):
+    for mode, images in _images().items():
+        source = open_frame_source(_folder(str(tmp_path / mode), images))
+        expected = is_drawable(source.load(source.frames[0][1]))
+        assert source_is_drawable(source) == expected == (mode in ('L', 'RGB', 'P')), mode
+        stack = pack_frames(source.path, str(tmp_path / (mode + '_stack')))
+        assert source_is_drawable(stack) == expected
+    # Pages of a multi-page TIFF are channels
+    pages = _images()['L']
+    path = _folder(str(tmp_path / 'pages'), [])
+    pages[0].save(os.path.join(path, 'img_T1.tif'), save_all=True, append_images=pages[1:])
+    assert not source_is_drawable(open_frame_source(path, 'tif'))
+
+
+def test_8bit_frames_are_not_decoded(tmp_path, monkeypatch):
+    decoded = _count_decodes(monkeypatch)
+    for mode in ('L', 'RGB', 'P'):
+        assert display_for_source(open_frame_source(_folder(str(tmp_path / mode), _images()[mode]))) is None
+    assert decoded == []
+
+
+def test_first_frame_decoded_once(tmp_path, monkeypatch):
+    images = _images()['I;16']
+    source = open_frame_source(_folder(str(tmp_path / 'raw'), images))
+    decoded = _count_decodes(monkeypatch)
+    display = display_for_source(source)
+    assert sorted(decoded) == sorted([os.path.join(source.path, image) for _, image in source.frames])
+    low, high = stack_percentiles((np.asarray(im) for im in images), (0.1, 99.9))
+    assert np.array_equal(display.low, low) and np.array_equal(display.high, high)
+    # Fixed range: only the first frame is read
+    del decoded[:]
+    display_for_source(source, display_range=[0, 4095])
+    assert len(decoded) == 1
+
+
+def test_options_need_frames(tmp_path):
+    source = open_frame_source(_folder(str(tmp_path / 'empty'), []))
+    assert display_for_source(source) is None
+    with pytest.raises(ValueError):
+        display_for_source(source, percentiles=(1, 99))
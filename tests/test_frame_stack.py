@@ -0,0 +1,43 @@
+# Regression tests of the listing and packing of frames (frame_stack.py), run with: python -m pytest tests
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, sys
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frame_stack import list_frames, pack_frames, open_frame_source
+
+
+def _save(folder, name, value):
+    Image.fromarray(np.full((4, 5), value, dtype=np.uint8)).save(os.path.join(folder, name))
+
+
+def test_only_png_by_default(tmp_path):
+    folder = str(tmp_path)
+    for name, value in [('img_T2.png', 2), ('img_T10.png', 10), ('img_T1.png', 1), ('img_T1.tif', 100),
+                        ('img_T3.tiff', 3), ('notes.txt', 0)]:
+        if name.endswith('.txt'):
+            with open(os.path.join(folder, name), 'w'):
+                pass
+        else:
+            _save(folder, name, value)
+    assert list_frames(folder) == [('1', 'img_T1.png'), ('2', 'img_T2.png'), ('10', 'img_T10.png')]
+    assert list_frames(folder, 'tif') == [('1', 'img_T1.tif'), ('3', 'img_T3.tiff')]
+    stack = pack_frames(folder, str(tmp_path / 'stack'))
+    assert len(stack) == 3 and stack.load(stack.frames[0][1]).array[0, 0] == 1
+    assert [time for time, _ in open_frame_source(folder, 'tif').frames] == ['1', '3']
+
+
+def test_same_time_with_two_extensions_is_refused(tmp_path):
+    folder = str(tmp_path)
+    _save(folder, 'img_T1.tif', 1)
+    _save(folder, 'img_T1.tiff', 2)
+    with pytest.raises(ValueError):
+        list_frames(folder, 'tif')
+    # Default listing ignores both
+    with pytest.raises(ValueError, match='T\\[0-9\\]\\+.png'):
+        pack_frames(folder, str(tmp_path / 'stack'))
@@ -0,0 +1,85 @@
+# Regression tests of intensity.py against brute-force measurements, run with: python -m pytest tests
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from intensity import integral_image, box_sums, measure_frame
+
+H, W = 37, 53
+# Inside the image, on its borders, partly and fully outside
+CENTERS = [(20, 15), (0, 0), (W - 1, H - 1), (2, H - 3), (W + 1, 10), (-2, -1), (W + 30, H + 30), (-40, 5)]
+
+
+def _brute_force(arr, centers, keep):
+    """Sum, mean, min, max and number of pixels of the pixels (x, y) of the image for which keep(x, y, cx, cy)."""
+    yy, xx = np.mgrid[0:arr.shape[0], 0:arr.shape[1]]
+    out = {'sum': [], 'mean': [], 'min': [], 'max': [], 'n_pixels': []}
+    for cx, cy in centers:
+        pixels = arr[keep(xx, yy, cx, cy)].astype(np.float64)
+        out['n_pixels'].append(len(pixels))
+        if len(pixels) == 0:
+            nan = np.full(arr.shape[2:], np.nan)
+            for stat in ('sum', 'mean', 'min', 'max'):
+                out[stat].append(nan)
+        else:
+            out['sum'].append(pixels.sum(axis=0))
+            out['mean'].append(pixels.mean(axis=0))
+            out['min'].append(pixels.min(axis=0))
+            out['max'].append(pixels.max(axis=0))
+    return {stat: np.array(values) for stat, values in out.items()}
+
+
+def _images():
+    rng = np.random.default_rng(5)
+    return [rng.integers(0, 256, (H, W), dtype=np.uint8), rng.integers(0, 65536, (H, W), dtype=np.uint16),
+            rng.integers(0, 4096, (H, W, 3), dtype=np.uint16), rng.normal(100, 20, (H, W))]
+
+
+def test_integral_image():
+    for arr in _images():
+        sat = integral_image(arr)
+        assert sat.shape[:2] == (H + 1, W + 1)
+        for y, x in [(0, 0), (1, 1), (H, W), (17, 40), (H, 3)]:
+            assert np.allclose(sat[y, x], arr[:y, :x].astype(np.float64).sum(axis=(0, 1)))
+    # Exact integer sums, no overflow of 16-bit values
+    big = np.full((300, 300), 65535, dtype=np.uint16)
+    assert integral_image(big)[-1, -1] == 65535 * 300 * 300
+
+
+@pytest.mark.parametrize('size', [(5, 5, 5, 5), (0, 1, 0, 1), (3, 8, 12, 2)])
+def test_box_matches_brute_force(size):
+    left, right, top, bottom = size
+
+    def keep(x, y, cx, cy):
+        return (x >= cx - left) & (x < cx + right) & (y >= cy - top) & (y < cy + bottom)
+    for arr in _images():
+        measured = measure_frame(arr, CENTERS, shape='box', size=size)
+        expected = _brute_force(arr, CENTERS, keep)
+        for stat in expected:
+            assert np.allclose(measured[stat], expected[stat], equal_nan=True), stat
+    # box_sums alone, integer sums are exact
+    arr = _images()[1]
+    sums, counts = box_sums(integral_image(arr), np.array(CENTERS), size)
+    assert sums.dtype == np.int64
+    assert np.array_equal(sums, np.nan_to_num(_brute_force(arr, CENTERS, keep)['sum']).astype(np.int64))
+
+
+@pytest.mark.parametrize('radius', [0, 1, 4, 9])
+def test_disk_matches_brute_force(radius):
+    def keep(x, y, cx, cy):
+        return (x - cx) ** 2 + (y - cy) ** 2 <= radius * radius
+    for arr in _images():
+        measured = measure_frame(arr, CENTERS, shape='disk', radius=radius)
+        expected = _brute_force(arr, CENTERS, keep)
+        for stat in expected:
+            assert np.allclose(measured[stat], expected[stat], equal_nan=True), stat
+
+
+def test_unknown_shape():
+    with pytest.raises(ValueError):
+        measure_frame(_images()[0], CENTERS, shape='ring')
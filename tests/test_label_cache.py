@@ -0,0 +1,55 @@
+# Regression tests of label_cache.py, run with: python -m pytest tests
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, sys
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from label_cache import LabelCache, DEFAULT_FONT
+
+pytestmark = pytest.mark.skipif(not os.path.isfile(DEFAULT_FONT), reason='Default font not installed: ' + DEFAULT_FONT)
+
+LABELS = ['1', '7', '42', '105', '2048', 'a12', 'T-3']
+# Whole and sub-pixel positions, inside the image and across each of its borders
+POSITIONS = [(10, 10), (10.5, 20.25), (33.75, 5.5), (-3, 15), (-2.5, -4.75), (56, 30), (58.25, 41.5), (20, 45.6)]
+
+
+def _background(mode):
+    # Not uniform, so that blending with the background is checked too
+    rng = np.random.default_rng(0)
+    if mode == 'L':
+        return Image.fromarray(rng.integers(0, 256, (50, 64), dtype=np.uint8), mode='L')
+    return Image.fromarray(rng.integers(0, 256, (50, 64, 3), dtype=np.uint8), mode='RGB')
+
+
+@pytest.mark.parametrize('mode, fill', [('L', 255), ('L', 90), ('RGB', (255, 255, 255)), ('RGB', (250, 20, 120))])
+@pytest.mark.parametrize('size', [9, 10, 12, 13.5])
+def test_draw_matches_imagedraw(mode, fill, size):
+    font = ImageFont.truetype(font=DEFAULT_FONT, size=size)
+    cache = LabelCache(font)
+    expected, cached = _background(mode), _background(mode)
+    draw = ImageDraw.Draw(expected)
+    # Twice, so that the second pass is drawn from masks already in the cache
+    for _ in range(2):
+        for xy in POSITIONS:
+            for text in LABELS:
+                draw.text(xy, text, font=font, fill=fill)
+                cache.draw(cached, xy, text, fill)
+    assert cache.hits > 0
+    assert np.array_equal(np.asarray(expected), np.asarray(cached))
+
+
+def test_each_label_alone_matches_imagedraw():
+    # Labels drawn on separate images, a mismatch of one label cannot be hidden by labels drawn on top of it
+    font = ImageFont.truetype(font=DEFAULT_FONT, size=10)
+    cache = LabelCache(font)
+    for xy in POSITIONS:
+        for text in LABELS:
+            expected, cached = _background('RGB'), _background('RGB')
+            ImageDraw.Draw(expected).text(xy, text, font=font, fill=(255, 255, 0))
+            cache.draw(cached, xy, text, (255, 255, 0))
+            assert np.array_equal(np.asarray(expected), np.asarray(cached)), (xy, text)
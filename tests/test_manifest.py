@@ -0,0 +1,117 @@
+# Regression tests of the manifest of incremental runs (manifest.py), run with: python -m pytest tests
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, sys, json, time, threading
+from multiprocessing import Process
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import manifest
+from manifest import Manifest, MANIFEST_FILE, LOCK_SUFFIX
+
+
+def _touch(folder, name):
+    with open(os.path.join(folder, name), 'w'):
+        pass
+
+
+def test_up_to_date_needs_same_record_and_file(tmp_path):
+    folder = str(tmp_path)
+    m = Manifest(folder)
+    m.update('ovl_T1.png', {'input': [1, 2], 'shift': (-4, -5)})
+    m.save()
+    m = Manifest(folder)
+    # Tuples and lists compare equal after the round trip through json
+    assert not m.is_current('ovl_T1.png', {'input': [1, 2], 'shift': (-4, -5)})
+    _touch(folder, 'ovl_T1.png')
+    assert m.is_current('out/ovl_T1.png', {'input': [1, 2], 'shift': (-4, -5)})
+    assert not m.is_current('ovl_T1.png', {'input': [1, 3], 'shift': (-4, -5)})
+    assert not Manifest(folder, force=True).is_current('ovl_T1.png', {'input': [1, 2], 'shift': (-4, -5)})
+
+
+def test_save_merges_records_of_other_processes(tmp_path):
+    folder = str(tmp_path)
+    a, b = Manifest(folder), Manifest(folder)
+    a.update('a.png', {'k': 'a'})
+    b.update('b.png', {'k': 'b'})
+    b.update('shared.png', {'k': 'b'})
+    a.save()
+    b.save()
+    a.update('shared.png', {'k': 'a'})
+    a.save()
+    with open(os.path.join(folder, MANIFEST_FILE)) as f:
+        assert json.load(f) == {'a.png': {'k': 'a'}, 'b.png': {'k': 'b'}, 'shared.png': {'k': 'a'}}
+    assert sorted(os.listdir(folder)) == [MANIFEST_FILE]
+
+
+def _save_many(folder, k, n):
+    m = Manifest(folder, save_every=1)
+    for i in range(n):
+        m.update('f' + str(k) + '_' + str(i), {'k': k})
+
+
+def test_concurrent_saves_lose_no_record(tmp_path):
+    folder = str(tmp_path)
+    writers = [Process(target=_save_many, args=(folder, k, 40)) for k in range(4)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    assert len(Manifest(folder).records) == 160
+    assert sorted(os.listdir(folder)) == [MANIFEST_FILE]
+
+
+def test_save_waits_for_live_lock(tmp_path):
+    folder = str(tmp_path)
+    lock = os.path.join(folder, MANIFEST_FILE) + LOCK_SUFFIX
+    with open(lock, 'w') as f:
+        f.write('other')
+    release = threading.Timer(0.3, os.remove, args=(lock,))
+    release.start()
+    m = Manifest(folder)
+    m.update('a.png', {'k': 'a'})
+    start = time.time()
+    m.save()
+    release.join()
+    assert time.time() - start >= 0.25
+    assert Manifest(folder).records == {'a.png': {'k': 'a'}}
+
+
+def test_stale_lock_is_taken_over(tmp_path):
+    folder = str(tmp_path)
+    lock = os.path.join(folder, MANIFEST_FILE) + LOCK_SUFFIX
+    with open(lock, 'w') as f:
+        f.write('crashed')
+    past = os.stat(lock).st_mtime - 120
+    os.utime(lock, (past, past))
+    m = Manifest(folder)
+    m.update('a.png', {'k': 'a'})
+    m.save()
+    assert Manifest(folder).records == {'a.png': {'k': 'a'}}
+    assert sorted(os.listdir(folder)) == [MANIFEST_FILE]
+
+
+def test_lock_replaced_meanwhile_is_put_back(tmp_path):
+    lock = os.path.join(str(tmp_path), MANIFEST_FILE) + LOCK_SUFFIX
+    with open(lock, 'w') as f:
+        f.write('crashed')
+    stale = manifest._lock_state(lock)
+    # Another process removed the stale lock and created its own before this one renamed it
+    os.remove(lock)
+    with open(lock, 'w') as f:
+        f.write('live')
+    manifest._remove_stale(lock, stale, 'token')
+    with open(lock) as f:
+        assert f.read() == 'live'
+    assert os.listdir(str(tmp_path)) == [os.path.basename(lock)]
+
+
+def test_lock_of_another_process_is_not_released(tmp_path):
+    path = os.path.join(str(tmp_path), MANIFEST_FILE)
+    with manifest._lock(path):
+        # Taken over by another process, e.g. after this one was suspended for longer than stale_seconds
+        with open(path + LOCK_SUFFIX, 'w') as f:
+            f.write('other')
+    with open(path + LOCK_SUFFIX) as f:
+        assert f.read() == 'other'
@@ -0,0 +1,107 @@
+# Regression tests of preprocessing.py against the behavior of preprocessing.R and select_random_save.R, run with:
+# python -m pytest tests
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, sys, csv
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from preprocessing import interpolate_gaps, scan_tracks, complete_tracks, sample_tracks, preprocess
+
+HEADER = ['Image_Metadata_Well', 'Image_Metadata_Site', 'track_id', 'Image_Metadata_T', 'Cond', 'ratio']
+
+
+def _na_interpolation(values):
+    """imputeTS::na.interpolation(option = 'linear') on one trajectory: interpolation along the rows, constant edges."""
+    values = np.asarray(values, dtype=np.float64)
+    measured = ~np.isnan(values)
+    if not measured.any():
+        return values.copy()
+    rows = np.arange(len(values))
+    return np.interp(rows, rows[measured], values[measured])
+
+
+def _write(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        writer.writerows(rows)
+    return path
+
+
+def _read(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def test_interpolate_gaps_matches_per_track_interpolation():
+    rng = np.random.default_rng(3)
+    lengths = rng.integers(1, 12, 300)
+    groups = np.repeat(np.arange(len(lengths)), lengths)
+    values = rng.normal(size=len(groups))
+    values[rng.random(len(groups)) < 0.35] = np.nan
+    # Some tracks without any measure, they stay missing
+    values[groups == 5] = np.nan
+    out = interpolate_gaps(values, groups)
+    expected = np.concatenate([_na_interpolation(values[groups == g]) for g in range(len(lengths))])
+    assert np.allclose(out, expected, equal_nan=True)
+    assert np.all(np.isnan(out[groups == 5]))
+    assert np.array_equal(out[~np.isnan(values)], values[~np.isnan(values)])
+
+
+def test_interpolation_does_not_cross_tracks():
+    values = np.array([1.0, np.nan, np.nan, 10.0, np.nan])
+    groups = np.array(['a', 'a', 'b', 'b', 'b'])
+    assert interpolate_gaps(values, groups).tolist() == [1.0, 1.0, 10.0, 10.0, 10.0]
+
+
+def test_complete_tracks_and_built_ids(tmp_path):
+    csvfi = _write(str(tmp_path / 'in.csv'), [('A01', 1, 1, t, 'c1', 0.5) for t in (1, 2, 3)] +
+                   [('A01', 1, 2, t, 'c1', 0.5) for t in (1, 2)] +
+                   [('B02', 1, 1, t, 'c2', 0.5) for t in (1, 2, 3)])
+    counts, conditions = scan_tracks(csvfi, cond_col='Cond')
+    # uniqID is absent: well, site and track_id pasted with "_", as in preprocessing.R
+    assert counts == {'A01_1_1': 3, 'A01_1_2': 2, 'B02_1_1': 3}
+    assert conditions == {'A01_1_1': 'c1', 'A01_1_2': 'c1', 'B02_1_1': 'c2'}
+    assert complete_tracks(counts) == ['A01_1_1', 'B02_1_1']
+
+
+def test_sample_tracks_per_condition():
+    tracks = ['t' + str(i) for i in range(30)]
+    conditions = {track: 'c' + str(i % 3) for i, track in enumerate(tracks)}
+    counts = {track: 5 if i < 27 else 1 for i, track in enumerate(tracks)}
+    samples = sample_tracks(tracks, conditions, 4, min_obs=2, counts=counts, seed=7)
+    assert list(samples) == ['c0', 'c1', 'c2']
+    for condition, sampled in samples.items():
+        assert len(sampled) == 4 and len(set(sampled)) == 4
+        assert all([conditions[track] == condition and counts[track] >= 2 for track in sampled])
+        # Order of the input is kept
+        assert sampled == sorted(sampled, key=tracks.index)
+    assert samples == sample_tracks(tracks, conditions, 4, min_obs=2, counts=counts, seed=7)
+    # Conditions with too few tracks keep all of them
+    assert sample_tracks(tracks[:4], conditions, 10)['c0'] == ['t0', 't3']
+
+
+def test_preprocess_imputes_in_time_order_and_keeps_measures(tmp_path):
+    # Rows of a track are not in time order in the file
+    rows = [('A01', 1, 1, 3, 'c1', '0.3'), ('A01', 1, 1, 1, 'c1', '0.1'), ('A01', 1, 1, 2, 'c1', 'NA'),
+            ('A01', 1, 1, 4, 'c1', ''),
+            ('A01', 1, 2, 1, 'c2', 'NA'), ('A01', 1, 2, 2, 'c2', '1.23456789012345678'), ('A01', 1, 2, 3, 'c2', 'NA'),
+            ('A01', 1, 2, 4, 'c2', '2'),
+            # Incomplete track, removed
+            ('A01', 1, 3, 1, 'c1', '5')]
+    csvfi = _write(str(tmp_path / 'in.csv'), rows)
+    outputs = preprocess(csvfi, str(tmp_path / 'out'), cond_col='Cond')
+    assert [(out['condition'], out['tracks'], out['rows']) for out in outputs] == [('c1', 1, 4), ('c2', 1, 4)]
+    assert outputs[0]['imputed'] == {'ratio': 4}
+    first = {row['Image_Metadata_T']: row for row in _read(outputs[0]['path'])}
+    assert list(_read(outputs[0]['path'])[0])[:2] == ['uniqID', 'Image_Metadata_T']
+    assert {t: first[t]['ratio'] for t in first} == {'1': '0.1', '2': '0.2', '3': '0.3', '4': '0.3'}
+    second = {row['Image_Metadata_T']: row['ratio'] for row in _read(outputs[1]['path'])}
+    # Measured values are written back exactly as read, imputed ones with 15 significant digits
+    assert second['2'] == '1.23456789012345678'
+    assert second['1'] == '%.15g' % 1.23456789012345678
+    assert second['3'] == '%.15g' % ((1.23456789012345678 + 2) / 2)
+    assert second['4'] == '2'
@@ -0,0 +1,109 @@
+# Regression tests of the on-disk cache of parsed tracks tables (track_table.load_track_table), run with:
+# python -m pytest tests
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import track_table
+from track_table import load_track_table, cache_path, CACHE_DIRNAME
+
+COLUMNS = dict(time_col='Image_Metadata_T', id_col='track_id', xpos_col='x', ypos_col='y')
+
+
+def _write(path, rows, header='Image_Metadata_T,track_id,x,y,x2'):
+    with open(path, 'w') as f:
+        f.write(header + '\n' + ''.join([','.join(map(str, row)) + '\n' for row in rows]))
+    return path
+
+
+def _tables(tmp_path):
+    os.makedirs(str(tmp_path / 'tables'), exist_ok=True)
+    return str(tmp_path / 'tables' / 'objNuclei_tracks.csv')
+
+
+def _count_parses(monkeypatch):
+    """Count the calls to TrackTable.from_csv, i.e. the loads which do not come from the cache."""
+    calls = []
+    from_csv = track_table.TrackTable.from_csv.__func__
+
+    def counted(cls, *args, **kwargs):
+        calls.append(args)
+        return from_csv(cls, *args, **kwargs)
+    monkeypatch.setattr(track_table.TrackTable, 'from_csv', classmethod(counted))
+    return calls
+
+
+def _same(a, b):
+    return all([np.array_equal(getattr(a, name), getattr(b, name))
+                for name in ('time', 'track_id', 'x', 'y', 'frames', 'offsets')])
+
+
+def test_second_load_comes_from_cache(tmp_path, monkeypatch):
+    calls = _count_parses(monkeypatch)
+    csvfi = _write(_tables(tmp_path), [(2, 1, 1, 1, 9), (1, 1, 2, 2, 9), (1, 2, 3, 3, 9)])
+    parsed = load_track_table(csvfi, **COLUMNS)
+    cached = load_track_table(csvfi, **COLUMNS)
+    assert len(calls) == 1
+    assert isinstance(cached.x, np.memmap)
+    assert _same(parsed, cached)
+    assert cached.coords(1) == [(2.0, 2.0), (3.0, 3.0)]
+    # Cache is placed next to the folder of the csv file
+    assert os.path.dirname(cache_path(csvfi, **COLUMNS)) == str(tmp_path / CACHE_DIRNAME)
+    # No temporary file left behind
+    assert not [name for name in os.listdir(cache_path(csvfi, **COLUMNS)) if '.tmp' in name]
+
+
+def test_changed_csv_is_parsed_again(tmp_path, monkeypatch):
+    calls = _count_parses(monkeypatch)
+    csvfi = _write(_tables(tmp_path), [(1, 1, 1, 1, 9)])
+    load_track_table(csvfi, **COLUMNS)
+    # Other size
+    _write(csvfi, [(1, 1, 1, 1, 9), (2, 1, 5, 5, 9)])
+    assert load_track_table(csvfi, **COLUMNS).frames.tolist() == [1, 2]
+    assert len(calls) == 2
+    # Same size, other modification time
+    _write(csvfi, [(1, 1, 1, 1, 9), (2, 1, 6, 6, 9)])
+    st = os.stat(csvfi)
+    os.utime(csvfi, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert load_track_table(csvfi, **COLUMNS).coords(2) == [(6.0, 6.0)]
+    assert len(calls) == 3
+    assert load_track_table(csvfi, **COLUMNS).coords(2) == [(6.0, 6.0)]
+    assert len(calls) == 3
+
+
+def test_other_columns_get_their_own_entry(tmp_path, monkeypatch):
+    calls = _count_parses(monkeypatch)
+    csvfi = _write(_tables(tmp_path), [(1, 1, 1, 1, 9)])
+    other = dict(COLUMNS, xpos_col='x2')
+    assert cache_path(csvfi, **COLUMNS) != cache_path(csvfi, **other)
+    assert load_track_table(csvfi, **COLUMNS).coords(1) == [(1.0, 1.0)]
+    assert load_track_table(csvfi, **other).coords(1) == [(9.0, 1.0)]
+    assert load_track_table(csvfi, **COLUMNS).coords(1) == [(1.0, 1.0)]
+    assert load_track_table(csvfi, **other).coords(1) == [(9.0, 1.0)]
+    assert len(calls) == 2
+
+
+def test_rebuild_and_no_cache(tmp_path, monkeypatch):
+    calls = _count_parses(monkeypatch)
+    csvfi = _write(_tables(tmp_path), [(1, 1, 1, 1, 9)])
+    load_track_table(csvfi, use_cache=False, **COLUMNS)
+    assert not os.path.exists(str(tmp_path / CACHE_DIRNAME))
+    load_track_table(csvfi, **COLUMNS)
+    load_track_table(csvfi, rebuild=True, **COLUMNS)
+    assert len(calls) == 3
+    load_track_table(csvfi, **COLUMNS)
+    assert len(calls) == 3
+
+
+def test_incomplete_entry_is_ignored(tmp_path, monkeypatch):
+    calls = _count_parses(monkeypatch)
+    csvfi = _write(_tables(tmp_path), [(1, 1, 1, 1, 9)])
+    load_track_table(csvfi, **COLUMNS)
+    # A writer interrupted before the completion marker
+    os.remove(os.path.join(cache_path(csvfi, **COLUMNS), 'meta.json'))
+    assert load_track_table(csvfi, **COLUMNS).coords(1) == [(1.0, 1.0)]
+    assert len(calls) == 2
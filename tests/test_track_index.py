@@ -0,0 +1,66 @@
+# Regression tests of the per-track time index (track_table.TrackIndex), run with: python -m pytest tests
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from track_table import TrackTable
+
+
+def _table():
+    # Track 2 is missing at times 3 and 4, track 1 has 2 rows at time 2 (the last one wins)
+    rows = [(1, 1, 0, 0), (1, 2, 10, 100), (2, 1, 1, 1), (2, 2, 11, 101), (2, 1, 5, 5), (3, 1, 2, 2),
+            (5, 2, 14, 104), (4, 1, 3, 3), (6, 3, 7, 7)]
+    time, track_id, x, y = zip(*rows)
+    return TrackTable(time=time, track_id=np.array(track_id), x=x, y=y)
+
+
+def test_trajectories_sorted_by_time():
+    index = _table().track_index()
+    assert index.ids.tolist() == [1, 2, 3]
+    t, x, y = index.trajectory(1)
+    assert t.tolist() == [1, 2, 3, 4] and x.tolist() == [0, 5, 2, 3]
+    assert index.trajectory('2')[0].tolist() == [1, 2, 5]
+    assert 3 in index and '3' in index and 4 not in index and 'a' not in index
+    with pytest.raises(KeyError):
+        index.trajectory(4)
+
+
+def test_positions_without_interpolation():
+    index = _table().track_index()
+    x, y = index.positions(2, [0, 1, 2, 3, 4, 5, 6])
+    assert np.array_equal(x, [np.nan, 10, 11, np.nan, np.nan, 14, np.nan], equal_nan=True)
+    assert np.array_equal(y, [np.nan, 100, 101, np.nan, np.nan, 104, np.nan], equal_nan=True)
+    assert index.position(1, 2) == (5.0, 5.0)
+    assert index.position(2, 3) is None
+    assert np.all(np.isnan(index.positions(9, [1, 2])[0]))
+
+
+def test_positions_with_interpolation():
+    index = _table().track_index()
+    x, y = index.positions(2, [0, 1, 3, 4, 5, 6], interpolate=True)
+    # Gaps are interpolated linearly in time, not before the first nor after the last detection
+    assert np.array_equal(x, [np.nan, 10, 12, 13, 14, np.nan], equal_nan=True)
+    assert np.array_equal(y, [np.nan, 100, 102, 103, 104, np.nan], equal_nan=True)
+    assert index.position(3, 6, interpolate=True) == (7.0, 7.0)
+
+
+def test_same_positions_as_frame_lookup():
+    rng = np.random.default_rng(2)
+    n = 2000
+    table = TrackTable(time=rng.integers(0, 60, n), track_id=rng.integers(0, 50, n), x=rng.uniform(0, 500, n),
+                       y=rng.uniform(0, 500, n))
+    index = table.track_index()
+    times = list(range(-1, 62))
+    for track_id in range(-1, 51):
+        x, y = index.positions(track_id, times)
+        for k, time in enumerate(times):
+            expected = table[time].get(str(track_id)) if time in table else None
+            if expected is None:
+                assert np.isnan(x[k]) and np.isnan(y[k])
+            else:
+                assert (x[k], y[k]) == expected
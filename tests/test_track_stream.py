@@ -0,0 +1,52 @@
+# Regression tests of track_stream.py, run with: python -m pytest tests
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from track_stream import iter_frames, join_frames, NotSortedError
+
+HEADER = 'Image_Metadata_T,track_id,x,y\n'
+COLUMNS = dict(time_col='Image_Metadata_T', id_col='track_id', xpos_col='x', ypos_col='y')
+
+
+def _write(tmp_path, rows):
+    path = str(tmp_path / 'objNuclei_tracks.csv')
+    with open(path, 'w') as f:
+        f.write(HEADER + ''.join([','.join(map(str, row)) + '\n' for row in rows]))
+    return path
+
+
+def test_auto_fallback_keeps_late_rows_of_a_frame(tmp_path):
+    # Time 3 comes back after time 5, in another chunk than its first row
+    csvfi = _write(tmp_path, [(1, 'a', 1, 1), (2, 'a', 2, 2), (3, 'a', 3, 3), (4, 'a', 4, 4), (5, 'a', 5, 5),
+                              (3, 'b', 30, 30), (6, 'a', 6, 6)])
+    frames = [(str(t), 'img_T' + str(t) + '.png') for t in range(1, 7)]
+    joined = {time: rows for time, _, rows in
+              join_frames(frames, iter_frames(csvfi, chunk_rows=5, external_sort='auto', **COLUMNS))}
+    assert joined['3'].track_id.tolist() == ['a', 'b']
+    assert joined['3'].x.tolist() == [3.0, 30.0]
+    assert [joined[str(t)].track_id.tolist() for t in (1, 2, 4, 5, 6)] == [['a']] * 5
+
+
+def test_each_frame_produced_once(tmp_path):
+    csvfi = _write(tmp_path, [(2, 'a', 0, 0), (1, 'a', 0, 0), (2, 'b', 0, 0), (1, 'b', 0, 0)])
+    times = [frame.time for frame in iter_frames(csvfi, chunk_rows=1, **COLUMNS)]
+    assert times == [1, 2]
+
+
+def test_sorted_file_is_streamed(tmp_path):
+    csvfi = _write(tmp_path, [(1, 'a', 0, 0), (1, 'b', 0, 0), (2, 'a', 0, 0), (3, 'a', 0, 0)])
+    for external_sort in ('auto', 'never', 'always'):
+        frames = list(iter_frames(csvfi, chunk_rows=2, external_sort=external_sort, **COLUMNS))
+        assert [(frame.time, frame.track_id.tolist()) for frame in frames] == [(1, ['a', 'b']), (2, ['a']),
+                                                                                (3, ['a'])]
+
+
+def test_never_raises_on_unsorted_file(tmp_path):
+    csvfi = _write(tmp_path, [(1, 'a', 0, 0), (3, 'a', 0, 0), (2, 'a', 0, 0)])
+    with pytest.raises(NotSortedError):
+        list(iter_frames(csvfi, chunk_rows=2, external_sort='never', **COLUMNS))
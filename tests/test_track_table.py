@@ -0,0 +1,84 @@
+# Regression tests of the parsing of tracks csv files by track_table.TrackTable, run with: python -m pytest tests
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, sys, csv
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from track_table import TrackTable
+
+HEADER = ['Image_Metadata_T', 'track_id', 'x', 'y']
+COLUMNS = dict(time_col='Image_Metadata_T', id_col='track_id', xpos_col='x', ypos_col='y')
+
+
+def _write(tmp_path, rows, header=HEADER):
+    path = str(tmp_path / 'objNuclei_tracks.csv')
+    with open(path, 'w') as f:
+        f.write(','.join(header) + '\n' + ''.join([','.join(map(str, row)) + '\n' for row in rows]))
+    return path
+
+
+def _read_dict(csvfi):
+    """Dictionary {time: {track_id: (x, y)}} built row by row, as the original read_csv_track did."""
+    dict_track = {}
+    with open(csvfi, newline='') as csvfile:
+        for row in csv.DictReader(csvfile):
+            dict_track.setdefault(row['Image_Metadata_T'], {})[row['track_id']] = (float(row['x']), float(row['y']))
+    return dict_track
+
+
+def test_rows_sorted_by_time_keep_csv_order_within_frame(tmp_path):
+    csvfi = _write(tmp_path, [(3, 5, 1, 1), (1, 9, 2, 2), (3, 2, 3, 3), (2, 4, 4, 4), (1, 1, 5, 5), (3, 7, 6, 6)])
+    table = TrackTable.from_csv(csvfi, **COLUMNS)
+    assert table.time.tolist() == [1, 1, 2, 3, 3, 3]
+    assert table.track_id.tolist() == [9, 1, 4, 5, 2, 7]
+    assert table.frames.tolist() == [1, 2, 3]
+    assert table.offsets.tolist() == [0, 2, 3, 6]
+    assert table.labels(3) == ['5', '2', '7']
+    assert table.coords('1') == [(2.0, 2.0), (5.0, 5.0)]
+    assert 2 in table and '2' in table and 4 not in table
+    with pytest.raises(KeyError):
+        table.frame(4)
+
+
+def test_same_content_as_dictionary_reader(tmp_path):
+    rng = np.random.default_rng(1)
+    rows = [(int(t), int(i), round(float(x), 3), round(float(y), 3)) for t, i, x, y in
+            zip(rng.integers(1, 20, 500), rng.integers(1, 40, 500), rng.uniform(0, 512, 500), rng.uniform(0, 512, 500))]
+    csvfi = _write(tmp_path, rows)
+    # Duplicates of (time, track) are kept once, with the last position of the file
+    assert TrackTable.from_csv(csvfi, **COLUMNS).to_dict() == _read_dict(csvfi)
+
+
+def test_track_ids_are_integers_only_when_lossless(tmp_path):
+    table = TrackTable.from_csv(_write(tmp_path, [(1, 12, 0, 0), (1, 3, 0, 0)]), **COLUMNS)
+    assert table.track_id.dtype.kind == 'i'
+    assert table.id_from_str('12') == 12 and table.id_from_str('a') is None
+    # Leading zeros, decimals and names are kept as written
+    for ids in (['007', '8'], ['1.0', '2'], ['a1', '2']):
+        table = TrackTable.from_csv(_write(tmp_path, [(1, i, 0, 0) for i in ids]), **COLUMNS)
+        assert table.track_id.dtype.kind == 'U'
+        assert table.labels(1) == ids
+
+
+def test_time_must_be_integer(tmp_path):
+    table = TrackTable.from_csv(_write(tmp_path, [('2.0', 1, 0, 0), ('10', 1, 0, 0)]), **COLUMNS)
+    assert table.frames.tolist() == [2, 10]
+    with pytest.raises(ValueError):
+        TrackTable.from_csv(_write(tmp_path, [('1.5', 1, 0, 0)]), **COLUMNS)
+
+
+def test_columns_found_by_name(tmp_path):
+    csvfi = _write(tmp_path, [(7, 1.5, 2, 3, 'z')], header=['y', 'x', 'track_id', 'Image_Metadata_T', 'other'])
+    table = TrackTable.from_csv(csvfi, **COLUMNS)
+    assert table.frames.tolist() == [3] and table.labels(3) == ['2'] and table.coords(3) == [(1.5, 7.0)]
+    with pytest.raises(ValueError):
+        TrackTable.from_csv(csvfi, time_col='T', id_col='track_id', xpos_col='x', ypos_col='y')
+
+
+def test_header_only_file(tmp_path):
+    table = TrackTable.from_csv(_write(tmp_path, []), **COLUMNS)
+    assert len(table) == 0 and table.to_dict() == {}
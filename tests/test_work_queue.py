@@ -0,0 +1,116 @@
+# Regression tests of the work queue shared by several nodes (work_queue.py), run with: python -m pytest tests
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, sys, json, time
+from multiprocessing import Process
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from work_queue import WorkQueue, frame_ranges, task_name
+
+TASKS = [{'id': task_name('well', start, end), 'frames': [start, end]} for start, end in frame_ranges(10, 4)]
+
+
+def _queue(folder, worker_id, lease_seconds=60):
+    queue = WorkQueue(folder, lease_seconds=lease_seconds, poll_seconds=0.01, worker_id=worker_id)
+    queue.publish(TASKS, params={'size': 3})
+    return queue
+
+
+def _age(lease, seconds):
+    """Set the modification time of a lease in the past, as if its worker stopped renewing it."""
+    past = os.stat(lease).st_mtime - seconds
+    os.utime(lease, (past, past))
+
+
+def test_frame_ranges_and_names():
+    assert frame_ranges(10, 4) == [[0, 4], [4, 8], [8, 10]]
+    assert frame_ranges(0, 4) == []
+    with pytest.raises(ValueError):
+        frame_ranges(10, 0)
+    assert task_name('B 02/x', 0, 50) == 'B-02-x_0_50'
+
+
+def test_each_task_claimed_once(tmp_path):
+    a, b = _queue(str(tmp_path), 'a'), _queue(str(tmp_path), 'b')
+    claimed = [a.claim(), b.claim(), a.claim()]
+    assert sorted([task['id'] for task, _ in claimed]) == sorted([task['id'] for task in TASKS])
+    # All tasks are leased by live workers
+    assert a.claim() is None and b.claim() is None
+    assert a.status() == {'done': 0, 'leased': 3, 'expired': 0, 'todo': 0}
+
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    a, b = _queue(str(tmp_path), 'a', lease_seconds=30), _queue(str(tmp_path), 'b', lease_seconds=30)
+    leases = {}
+    for _ in TASKS:
+        task, lease = a.claim()
+        leases[task['id']] = lease
+    first = TASKS[0]['id']
+    _age(leases[first], 10)
+    assert b.claim() is None
+    _age(leases[first], 60)
+    assert b.status()['expired'] == 1
+    task, lease = b.claim()
+    assert task['id'] == first and lease.endswith(first + '.2.lease')
+    assert b.owns(first, lease) and not a.owns(first, leases[first])
+    # Done tasks are never claimed again, even with an expired lease
+    b.complete(first, {'frames': 4})
+    _age(lease, 60)
+    assert b.claim() is None
+    assert b.status() == {'done': 1, 'leased': 2, 'expired': 0, 'todo': 0}
+
+
+def test_other_arguments_are_refused(tmp_path):
+    _queue(str(tmp_path), 'a')
+    other = WorkQueue(str(tmp_path), worker_id='b')
+    with pytest.raises(ValueError):
+        other.publish(TASKS, params={'size': 4})
+    with pytest.raises(ValueError):
+        other.publish(TASKS[:2], params={'size': 3})
+
+
+def test_run_records_results_and_errors(tmp_path):
+    queue = _queue(str(tmp_path), 'a')
+
+    def process(task):
+        if task['frames'][0] == 4:
+            raise ValueError('unreadable frame')
+        return {'frames': task['frames'][1] - task['frames'][0]}
+    processed = dict(queue.run(process))
+    assert processed[TASKS[0]['id']] == {'frames': 4}
+    assert 'unreadable frame' in processed[TASKS[1]['id']]['error']
+    # Failed tasks are done too, they are not retried
+    assert queue.status()['done'] == 3
+    with open(os.path.join(str(tmp_path), 'done', TASKS[2]['id'] + '.json')) as f:
+        assert json.load(f)['result'] == {'frames': 2}
+
+
+def test_lease_renewed_while_processing(tmp_path):
+    queue = _queue(str(tmp_path), 'a', lease_seconds=0.2)
+    task, lease = queue.claim()
+    _age(lease, 10)
+    with queue.keep_alive(lease):
+        time.sleep(0.2)
+    assert queue.server_time() - os.stat(lease).st_mtime < 0.2
+
+
+def _work(folder, worker_id, out):
+    def process(task):
+        with open(os.path.join(out, task['id'] + '.' + worker_id), 'w'):
+            pass
+        return {'worker': worker_id}
+    _queue(folder, worker_id).run(process)
+
+
+def test_workers_in_parallel_process_each_task_once(tmp_path):
+    folder, out = str(tmp_path / 'queue'), str(tmp_path / 'out')
+    os.makedirs(out)
+    workers = [Process(target=_work, args=(folder, 'w' + str(k), out)) for k in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert sorted([name.rsplit('.', 1)[0] for name in os.listdir(out)]) == sorted([task['id'] for task in TASKS])
@@ -0,0 +1,262 @@
+# Streaming reader of tracks .csv files too large to be held in memory (e.g. the objNuclei.csv export of a full plate).
+#
+# Only the needed columns are kept (time, track id, x, y and optional grouping columns such as the well or the site),
+# parsed in large chunks. When the file is sorted by time, the rows of a frame are contiguous: frames are produced one
+# after the other and only the rows of the current frame (plus the chunk being parsed) are in memory. join_frames then
+# merge-joins them with the time-sorted sequence of images of a well.
+# When the file is not sorted by time, the chunks are sorted one by one and spilled to temporary .npy files (sorted
+# runs), which are merged frame by frame: memory still holds one frame, at the cost of writing the columns once to disk.
+# By default, the time column is scanned once before any frame is produced, to choose between the two: a frame produced
+# from a file found unsorted later on could miss rows that come after it.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, csv, heapq, tempfile
+from collections import namedtuple
+import numpy as np
+from track_table import _as_time_array
+
+# Rows of one frame. track_id are strings as written in the csv file, groups maps grouping columns to string arrays.
+FrameRows = namedtuple('FrameRows', ['time', 'track_id', 'x', 'y', 'groups'])
+EXTERNAL_SORT = ('auto', 'never', 'always')
+DEFAULT_CHUNK_ROWS = 500000
+
+
+class NotSortedError(ValueError):
+    """Raised when a tracks file expected to be sorted by time is not."""
+
+
+def iter_chunks(csvfi, time_col, id_col, xpos_col, ypos_col, group_cols=(), where=None,
+                chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Parse the columns of interest of a csv file by chunks of rows.
+
+    Args:
+        csvfi (str): Path to the csv file, with a header.
+        time_col, id_col, xpos_col, ypos_col (str): Names of the time, track ID and position columns.
+        group_cols (tuple of str, optional): Names of other columns to keep, e.g. the well. Defaults to ().
+        where (dict, optional): Keep only the rows with these values {column name: value as written in the file},
+        e.g. the rows of one well and site of a whole plate. Defaults to None, all rows are kept.
+        chunk_rows (int, optional): Number of kept rows per chunk. Defaults to DEFAULT_CHUNK_ROWS.
+    Yields:
+        Dictionaries of numpy arrays: 'time' (int64), 'track_id' (str), 'x', 'y' (float64), 'line' (line number of
+        each row in the file) and one str array per grouping column.
+        Raise ValueError if a column is missing.
+
+    """
+    where = where or {}
+    names = [time_col, id_col, xpos_col, ypos_col] + list(group_cols)
+    with open(csvfi, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        missing = [col for col in names + list(where) if col not in header]
+        if missing:
+            raise ValueError('Column(s) not found in the first line of the csv file: ' + ', '.join(missing) +
+                             '; Found: ' + ', '.join(header))
+        keep = [header.index(col) for col in names]
+        tests = [(header.index(col), str(value)) for col, value in where.items()]
+        rows, lines = [], []
+        for row in reader:
+            if not row or any([row[i] != value for i, value in tests]):
+                continue
+            rows.append([row[i] for i in keep])
+            lines.append(reader.line_num)
+            if len(rows) == chunk_rows:
+                yield _chunk_arrays(rows, lines, group_cols)
+                rows, lines = [], []
+        if rows:
+            yield _chunk_arrays(rows, lines, group_cols)
+
+
+def _chunk_arrays(rows, lines, group_cols):
+    columns = list(zip(*rows))
+    chunk = {'time': _as_time_array(columns[0]), 'track_id': np.asarray(columns[1], dtype=str),
+             'x': np.asarray(columns[2], dtype=np.float64), 'y': np.asarray(columns[3], dtype=np.float64),
+             'line': np.asarray(lines, dtype=np.int64)}
+    for k, col in enumerate(group_cols):
+        chunk[col] = np.asarray(columns[4 + k], dtype=str)
+    return chunk
+
+
+def _slice(chunk, start, end):
+    return {name: values[start:end] for name, values in chunk.items()}
+
+
+def _concat(first, second):
+    return {name: np.concatenate([first[name], second[name]]) for name in first}
+
+
+def _frame_rows(chunk, group_cols):
+    return FrameRows(time=int(chunk['time'][0]), track_id=chunk['track_id'], x=chunk['x'], y=chunk['y'],
+                     groups={col: chunk[col] for col in group_cols})
+
+
+class _Unsorted(Exception):
+    def __init__(self, line, time, previous):
+        super().__init__(line, time, previous)
+        self.line, self.time, self.previous = line, time, previous
+
+
+def _frames_sorted(chunks, group_cols):
+    """Frames of time-sorted chunks. Each chunk is checked before any of its frames is produced."""
+    pending, last_time = None, None
+    for chunk in chunks:
+        disorder = _chunk_disorder(chunk['time'], chunk['line'], last_time)
+        if disorder is not None:
+            raise _Unsorted(*disorder)
+        if pending is not None:
+            chunk = _concat(pending, chunk)
+        # The last frame of a chunk may continue in the next chunk
+        bounds = np.concatenate([[0], np.flatnonzero(np.diff(chunk['time'])) + 1, [len(chunk['time'])]])
+        for start, end in zip(bounds[:-2], bounds[1:-1]):
+            yield _frame_rows(_slice(chunk, start, end), group_cols)
+        pending = {name: values.copy() for name, values in _slice(chunk, bounds[-2], bounds[-1]).items()}
+        last_time = int(chunk['time'][-1])
+    if pending is not None:
+        yield _frame_rows(pending, group_cols)
+
+
+def _frames_external(chunks, group_cols, tmpdir=None):
+    """Frames of unsorted chunks: sorted runs spilled to .npy files, then merged frame by frame."""
+    with tempfile.TemporaryDirectory(prefix='track_sort_', dir=tmpdir) as folder:
+        runs = []
+        for k, chunk in enumerate(chunks):
+            order = np.argsort(chunk['time'], kind='stable')
+            run = {}
+            for name, values in chunk.items():
+                path = os.path.join(folder, 'run' + str(k) + '_' + str(len(run)) + '.npy')
+                np.save(path, values[order])
+                run[name] = path
+            runs.append(run)
+        del chunks
+        # Runs are opened as memory maps and read frame by frame, positions in heap are (time, run, row)
+        runs = [{name: np.load(path, mmap_mode='r') for name, path in run.items()} for run in runs]
+        heap = [(int(run['time'][0]), k, 0) for k, run in enumerate(runs) if len(run['time'])]
+        heapq.heapify(heap)
+        while heap:
+            time = heap[0][0]
+            parts = []
+            # Runs holding this frame come out in run order, i.e. in order of the file
+            while heap and heap[0][0] == time:
+                _, k, start = heapq.heappop(heap)
+                run = runs[k]
+                end = int(np.searchsorted(run['time'], time, side='right'))
+                parts.append({name: np.array(values[start:end]) for name, values in run.items()})
+                if end < len(run['time']):
+                    heapq.heappush(heap, (int(run['time'][end]), k, end))
+            frame = parts[0]
+            for part in parts[1:]:
+                frame = _concat(frame, part)
+            yield _frame_rows(frame, group_cols)
+        del runs, heap
+
+
+def _first_disorder(csvfi, time_col, where=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Scan the time column of a csv file for the first row whose time is smaller than the time of the row before.
+
+    Args:
+        csvfi, time_col, where, chunk_rows: See iter_chunks.
+    Returns:
+        None if the kept rows are sorted by time, otherwise a 3-tuple (line, time, previous time) of the first row out
+        of order.
+
+    """
+    where = where or {}
+    with open(csvfi, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        # Missing columns are reported by iter_chunks
+        if time_col not in header or any([col not in header for col in where]):
+            return None
+        i_time = header.index(time_col)
+        tests = [(header.index(col), str(value)) for col, value in where.items()]
+        last_time = None
+        times, lines = [], []
+        for row in reader:
+            if row and not any([row[i] != value for i, value in tests]):
+                times.append(row[i_time])
+                lines.append(reader.line_num)
+            if len(times) == chunk_rows:
+                time = _as_time_array(times)
+                disorder = _chunk_disorder(time, lines, last_time)
+                if disorder is not None:
+                    return disorder
+                last_time, times, lines = int(time[-1]), [], []
+        if times:
+            return _chunk_disorder(_as_time_array(times), lines, last_time)
+    return None
+
+
+def _chunk_disorder(time, lines, last_time):
+    """First row out of order of a chunk of times, see _first_disorder."""
+    if last_time is not None and time[0] < last_time:
+        return int(lines[0]), int(time[0]), last_time
+    decrease = np.flatnonzero(time[1:] < time[:-1])
+    if len(decrease):
+        i = decrease[0] + 1
+        return int(lines[i]), int(time[i]), int(time[i - 1])
+    return None
+
+
+def iter_frames(csvfi, time_col, id_col, xpos_col, ypos_col, group_cols=(), where=None,
+                chunk_rows=DEFAULT_CHUNK_ROWS, external_sort='auto', tmpdir=None):
+    """Rows of a tracks csv file, frame by frame in time order, in constant memory.
+
+    Args:
+        csvfi, time_col, id_col, xpos_col, ypos_col, group_cols, where, chunk_rows: See iter_chunks.
+        external_sort (str, optional): What to do if the file is not sorted by time:
+         - 'auto': the time column is scanned once before any frame is produced. Sorted files are then streamed,
+           others are reported and sorted externally. Each frame is produced once, with all its rows.
+         - 'never': raise NotSortedError when the disorder is found. Frames before it may already be produced.
+         - 'always': sort without checking, best for files known to be unsorted.
+        Defaults to 'auto'.
+        tmpdir (str, optional): Folder of the temporary files of the external sort. Defaults to the system default.
+    Yields:
+        A FrameRows per frame present in the file, rows of a frame in the order of the file.
+
+    """
+    if external_sort not in EXTERNAL_SORT:
+        raise ValueError('Unknown external_sort: ' + str(external_sort) + '. Expected one of: ' +
+                         ', '.join(EXTERNAL_SORT))
+    chunk_args = dict(csvfi=csvfi, time_col=time_col, id_col=id_col, xpos_col=xpos_col, ypos_col=ypos_col,
+                      group_cols=group_cols, where=where, chunk_rows=chunk_rows)
+    sort = external_sort == 'always'
+    if external_sort == 'auto':
+        disorder = _first_disorder(csvfi, time_col, where=where, chunk_rows=chunk_rows)
+        if disorder is not None:
+            print(_disorder_message(csvfi, *disorder) + ' Falling back to an external sort.')
+            sort = True
+    if sort:
+        for frame in _frames_external(iter_chunks(**chunk_args), group_cols, tmpdir=tmpdir):
+            yield frame
+        return
+    try:
+        for frame in _frames_sorted(iter_chunks(**chunk_args), group_cols):
+            yield frame
+    except _Unsorted as e:
+        raise NotSortedError(_disorder_message(csvfi, e.line, e.time, e.previous) +
+                             ' Sort the file by time, or allow an external sort.')
+
+
+def _disorder_message(csvfi, line, time, previous):
+    return ('Tracks file is not sorted by time: line ' + str(line) + ' of ' + csvfi + ' has time ' + str(time) +
+            ' after time ' + str(previous) + '.')
+
+
+def join_frames(frames, stream):
+    """Merge-join the images of a well with a stream of track frames, both sorted by time.
+
+    Args:
+        frames (list of 2-tuple): (time (str), image name), sorted by time, see frame_stack.list_frames.
+        stream (iterable of FrameRows): Frames sorted by time, see iter_frames.
+    Yields:
+        3-tuples (time, image, FrameRows or None if no row has this time). Rows of times without image are dropped.
+
+    """
+    stream = iter(stream)
+    current = next(stream, None)
+    for time, image in frames:
+        t = int(time)
+        while current is not None and current.time < t:
+            current = next(stream, None)
+        yield time, image, current if current is not None and current.time == t else None
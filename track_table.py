@@ -0,0 +1,385 @@
+# Columnar storage for tracking tables.
+#
+# A TrackTable keeps the 4 columns needed by the overlay and crop scripts (time, track id, x, y) in contiguous numpy
+# arrays sorted by time. Rows of a given frame are contiguous, so that "all tracks at frame T" is a zero-copy slice.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, csv, json, uuid, hashlib
+import numpy as np
+from spatial_index import SpatialIndex
+
+
+def _as_time_array(values):
+    """Convert a sequence of time strings to an int64 array. Raise ValueError if a time is not an integer."""
+    times = np.asarray(values, dtype=np.float64)
+    if not np.all(np.mod(times, 1) == 0):
+        raise ValueError('Time column must contain integer frame numbers.')
+    return times.astype(np.int64)
+
+
+def _as_id_array(values):
+    """Convert a sequence of track ID strings to an int64 array if this is lossless, otherwise keep them as strings."""
+    ids = np.asarray(values, dtype=str)
+    try:
+        ids_int = ids.astype(np.int64)
+    except ValueError:
+        return ids
+    # Keep strings if converting back does not give the same text (e.g. "007" or "1.0")
+    if np.array_equal(ids_int.astype(str), ids):
+        return ids_int
+    return ids
+
+
+class TrackTable:
+    """Tracks positions stored as time-sorted columns with a frame-offset index.
+
+    Attributes:
+        time (numpy array of int64): Frame of each row.
+        track_id (numpy array of int64 or str): Track ID of each row.
+        x (numpy array of float64): Position in x of each row.
+        y (numpy array of float64): Position in y of each row.
+        frames (numpy array of int64): Sorted unique frames.
+        offsets (numpy array of int64): Rows of frames[i] are in [offsets[i], offsets[i+1]).
+
+    Rows are stably sorted by time, hence within a frame rows keep the order of the csv file.
+    """
+
+    def __init__(self, time, track_id, x, y):
+        time = np.asarray(time, dtype=np.int64)
+        track_id = np.asarray(track_id)
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if not len(time) == len(track_id) == len(x) == len(y):
+            raise ValueError('time, track_id, x and y must have same length.')
+        if len(time) > 1 and np.any(time[1:] < time[:-1]):
+            order = np.argsort(time, kind='stable')
+            time, track_id, x, y = time[order], track_id[order], x[order], y[order]
+        self.time = np.ascontiguousarray(time)
+        self.track_id = np.ascontiguousarray(track_id)
+        self.x = np.ascontiguousarray(x)
+        self.y = np.ascontiguousarray(y)
+        self.frames, starts = np.unique(self.time, return_index=True)
+        self.offsets = np.append(starts, len(self.time)).astype(np.int64)
+
+    @classmethod
+    def from_csv(cls, csvfi, time_col, id_col, xpos_col, ypos_col):
+        """Read the 4 columns of interest from a csv file with track info, in a single pass.
+
+        Args:
+            csvfi (str): path to csv file which contains the track information. A header must be present with columns
+            for: time, track id, position in x and position in y.
+            time_col (str): name of time column.
+            id_col (str): name of track id column.
+            xpos_col (str): name of x-position column.
+            ypos_col (str): name of y-position column.
+        Returns:
+            A TrackTable.
+
+        """
+        with open(csvfi, newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            fl = next(reader, [])
+            if not all([col in fl for col in (time_col, id_col, xpos_col, ypos_col)]):
+                raise ValueError('At least one of the provided column name is not found in the first line of the csv '
+                                 'file. Expected: ' + ', '.join([time_col, id_col, xpos_col, ypos_col]) +
+                                 "; Found: " + ', '.join(fl))
+            i_time, i_id, i_x, i_y = [fl.index(col) for col in (time_col, id_col, xpos_col, ypos_col)]
+            columns = list(zip(*[(row[i_time], row[i_id], row[i_x], row[i_y]) for row in reader if row]))
+        if not columns:
+            columns = [[], [], [], []]
+        return cls(time=_as_time_array(columns[0]),
+                   track_id=_as_id_array(columns[1]),
+                   x=np.asarray(columns[2], dtype=np.float64),
+                   y=np.asarray(columns[3], dtype=np.float64))
+
+    def __len__(self):
+        return len(self.time)
+
+    def __contains__(self, time):
+        return self._frame_index(time) is not None
+
+    def _frame_index(self, time):
+        """Position of a frame in self.frames, None if absent. time can be an integer or a string such as '12'."""
+        time = int(time)
+        i = np.searchsorted(self.frames, time)
+        if i < len(self.frames) and self.frames[i] == time:
+            return i
+        return None
+
+    def frame_slice(self, time):
+        """Slice of the rows belonging to a frame. Raise KeyError if the frame is absent."""
+        i = self._frame_index(time)
+        if i is None:
+            raise KeyError(time)
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def frame(self, time):
+        """All tracks at a frame.
+
+        Args:
+            time (int or str): Frame number.
+        Returns:
+            A 3-tuple (track_id, x, y) of numpy views on the table (no copy).
+        Raises:
+            KeyError if the frame is not in the table.
+
+        """
+        s = self.frame_slice(time)
+        return self.track_id[s], self.x[s], self.y[s]
+
+    def labels(self, time):
+        """Track IDs at a frame as a list of strings, as written in the csv file."""
+        return self.track_id[self.frame_slice(time)].astype(str).tolist()
+
+    def coords(self, time):
+        """Positions at a frame as a list of (x, y) tuples."""
+        s = self.frame_slice(time)
+        return list(zip(self.x[s].tolist(), self.y[s].tolist()))
+
+    def id_from_str(self, track_id):
+        """Convert a track ID provided as string (e.g. from command line) to the type stored in the table."""
+        if self.track_id.dtype.kind in 'iu':
+            try:
+                return int(track_id)
+            except ValueError:
+                return None
+        return str(track_id)
+
+    def position(self, time, track_id):
+        """Position (x, y) of a track at a frame, None if the track is not present at this frame."""
+        return self.track_index().position(track_id, time)
+
+    def track_index(self):
+        """Index of the rows by track, see TrackIndex. Built on first call and kept with the table."""
+        index = self.__dict__.get('_track_index')
+        if index is None:
+            index = self._track_index = TrackIndex(self)
+        return index
+
+    def spatial_index(self, cell_size=64):
+        """Region and radius queries on the cells of each frame, see SpatialIndex. Built on first call per cell size."""
+        indexes = self.__dict__.setdefault('_spatial_indexes', {})
+        if cell_size not in indexes:
+            indexes[cell_size] = SpatialIndex(self, cell_size)
+        return indexes[cell_size]
+
+    def __getitem__(self, time):
+        """Compatibility with the dictionary layout: table[time] returns {track_id (str): (x, y)}."""
+        return dict(zip(self.labels(time), self.coords(time)))
+
+    def to_dict(self):
+        """Export to the 2-level dictionary returned by read_csv_track: {time (str): {track_id (str): (x, y)}}."""
+        return {str(t): self[t] for t in self.frames.tolist()}
+
+
+class TrackIndex:
+    """Rows of a TrackTable grouped by track ID, each track sorted by time.
+
+    Positions of a track at any time are found by binary search in its time array, and whole trajectories are
+    contiguous slices. If a track has several rows at the same time, the last one in the table is kept, as in the
+    dictionary returned by read_csv_track.
+
+    Attributes:
+        ids (numpy array): Sorted unique track IDs, same type as TrackTable.track_id.
+        offsets (numpy array of int64): Rows of ids[i] are in [offsets[i], offsets[i+1]) of time, x and y.
+        time (numpy array of int64): Frames, increasing within each track.
+        x, y (numpy array of float64): Positions.
+    """
+
+    def __init__(self, table):
+        order = np.lexsort((np.arange(len(table.time)), table.time, table.track_id))
+        track_id, time = table.track_id[order], table.time[order]
+        # Keep the last row of each (track, time) pair
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = (track_id[1:] != track_id[:-1]) | (time[1:] != time[:-1])
+        order = order[last]
+        track_id = track_id[last]
+        self.time = table.time[order]
+        self.x = np.asarray(table.x[order], dtype=np.float64)
+        self.y = np.asarray(table.y[order], dtype=np.float64)
+        self.ids, starts = np.unique(track_id, return_index=True)
+        self.offsets = np.append(starts, len(order)).astype(np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, track_id):
+        return self._track_number(track_id) is not None
+
+    def _track_number(self, track_id):
+        """Position of a track in self.ids, None if absent. track_id can also be given as a string."""
+        if self.ids.dtype.kind in 'iu':
+            try:
+                track_id = int(track_id)
+            except ValueError:
+                return None
+        else:
+            track_id = str(track_id)
+        i = np.searchsorted(self.ids, track_id)
+        if i < len(self.ids) and self.ids[i] == track_id:
+            return i
+        return None
+
+    def trajectory(self, track_id):
+        """Whole trajectory of a track.
+
+        Args:
+            track_id: Track ID, as stored in the table or as a string.
+        Returns:
+            A 3-tuple (time, x, y) of numpy views, sorted by time.
+        Raises:
+            KeyError if the track is not in the table.
+
+        """
+        i = self._track_number(track_id)
+        if i is None:
+            raise KeyError(track_id)
+        s = slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+        return self.time[s], self.x[s], self.y[s]
+
+    def positions(self, track_id, times, interpolate=False):
+        """Positions of a track at several times.
+
+        Args:
+            track_id: Track ID, as stored in the table or as a string.
+            times (sequence of int): Frames.
+            interpolate (bool, optional): If True, positions at frames where the track is missing are interpolated
+            linearly between the surrounding detections. Frames before the first or after the last detection stay
+            missing. Defaults to False.
+        Returns:
+            A 2-tuple (x, y) of float arrays of same length as times, NaN where the track has no position.
+
+        """
+        times = np.asarray(times, dtype=np.int64).reshape(-1)
+        x = np.full(len(times), np.nan)
+        y = np.full(len(times), np.nan)
+        if track_id not in self:
+            return x, y
+        t, tx, ty = self.trajectory(track_id)
+        if interpolate:
+            inside = (times >= t[0]) & (times <= t[-1])
+            x[inside] = np.interp(times[inside], t, tx)
+            y[inside] = np.interp(times[inside], t, ty)
+        else:
+            i = np.minimum(np.searchsorted(t, times), len(t) - 1)
+            found = t[i] == times
+            x[found] = tx[i[found]]
+            y[found] = ty[i[found]]
+        return x, y
+
+    def position(self, track_id, time, interpolate=False):
+        """Position (x, y) of a track at one frame, None if missing. See positions."""
+        x, y = self.positions(track_id, [int(time)], interpolate=interpolate)
+        if np.isnan(x[0]):
+            return None
+        return float(x[0]), float(y[0])
+
+
+# ---------------------------------
+# On-disk cache of parsed tables. Each csv file gets a folder in a ".track_cache" directory placed next to the folder
+# of the csv file (i.e. next to "tables/"), with one .npy file per column which can be memory-mapped at loading.
+
+CACHE_DIRNAME = '.track_cache'
+CACHE_VERSION = 1
+_CACHE_ARRAYS = ('time', 'track_id', 'x', 'y', 'frames', 'offsets')
+
+
+def csv_fingerprint(csvfi):
+    """Identify the state of a csv file by its absolute path, size and modification time."""
+    st = os.stat(csvfi)
+    return {'path': os.path.abspath(csvfi), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def cache_path(csvfi, time_col, id_col, xpos_col, ypos_col, cache_dir=None):
+    """Folder where the parsed table of a csv file is cached, for a given choice of columns.
+
+    Args:
+        csvfi (str): path to csv file.
+        time_col, id_col, xpos_col, ypos_col (str): names of the columns, as in TrackTable.from_csv.
+        cache_dir (str, optional): Root of the cache. Defaults to ".track_cache" next to the folder of csvfi.
+    Returns:
+        Path to the cache folder of this csv file (str).
+
+    """
+    csvfi = os.path.abspath(csvfi)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.dirname(csvfi)), CACHE_DIRNAME)
+    key = json.dumps([csvfi, time_col, id_col, xpos_col, ypos_col])
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, os.path.basename(csvfi) + '_' + digest)
+
+
+def _write_cache(table, folder, meta):
+    os.makedirs(folder, exist_ok=True)
+    # Meta file is written last and acts as a completion marker, remove it first so that a concurrent reader never
+    # sees a complete meta with partially written arrays
+    meta_file = os.path.join(folder, 'meta.json')
+    try:
+        os.remove(meta_file)
+    except FileNotFoundError:
+        pass
+    # Temporary files are unique to this writer: several processes may build the cache of the same table at once,
+    # they write the same arrays
+    suffix = '.' + uuid.uuid4().hex + '.tmp'
+    for name in _CACHE_ARRAYS:
+        tmp = os.path.join(folder, name + suffix + '.npy')
+        np.save(tmp, getattr(table, name))
+        os.replace(tmp, os.path.join(folder, name + '.npy'))
+    tmp = os.path.join(folder, 'meta' + suffix + '.json')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_file)
+
+
+def _read_cache(folder, meta):
+    """Return the cached table if its metadata match meta, None otherwise."""
+    try:
+        with open(os.path.join(folder, 'meta.json')) as f:
+            cached_meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached_meta != meta:
+        return None
+    try:
+        arrays = {name: np.load(os.path.join(folder, name + '.npy'), mmap_mode='r') for name in _CACHE_ARRAYS}
+    except (OSError, ValueError):
+        return None
+    table = TrackTable.__new__(TrackTable)
+    table.__dict__.update(arrays)
+    return table
+
+
+def load_track_table(csvfi, time_col, id_col, xpos_col, ypos_col, use_cache=True, rebuild=False, cache_dir=None):
+    """Read a csv file with track info into a TrackTable, going through the on-disk cache.
+
+    The cache entry is keyed on the path of the csv file and the column names, and is discarded automatically when
+    the size or modification time of the csv file changes.
+
+    Args:
+        csvfi (str): path to csv file which contains the track information.
+        time_col, id_col, xpos_col, ypos_col (str): names of the columns, as in TrackTable.from_csv.
+        use_cache (bool, optional): If False, parse the csv file and leave the cache untouched. Defaults to True.
+        rebuild (bool, optional): If True, parse the csv file and overwrite the cache entry. Defaults to False.
+        cache_dir (str, optional): Root of the cache. Defaults to ".track_cache" next to the folder of csvfi.
+    Returns:
+        A TrackTable. When loaded from the cache, its arrays are read-only memory maps.
+
+    """
+    if not use_cache:
+        return TrackTable.from_csv(csvfi, time_col, id_col, xpos_col, ypos_col)
+    folder = cache_path(csvfi, time_col, id_col, xpos_col, ypos_col, cache_dir=cache_dir)
+    meta = {'version': CACHE_VERSION, 'csv': csv_fingerprint(csvfi),
+            'columns': [time_col, id_col, xpos_col, ypos_col]}
+    if not rebuild:
+        table = _read_cache(folder, meta)
+        if table is not None:
+            return table
+    table = TrackTable.from_csv(csvfi, time_col, id_col, xpos_col, ypos_col)
+    try:
+        _write_cache(table, folder, meta)
+    except OSError as e:
+        # A read-only file system should not prevent the analysis
+        print('Could not write tracks cache in ' + folder + ': ' + str(e))
+    return table
@@ -0,0 +1,331 @@
+# Review of trajectories for outliers, replaces the one-plot-at-a-time loop of script_stop_and_watch.R.
+#
+# The trajectories of a condition table (see preprocessing.py) are held in one array of shape (tracks, times,
+# features). Every track gets outlier scores computed for all tracks at once:
+#  - deviation: root mean square distance to the mean curve of the condition, in robust standard deviations;
+#  - jump: largest step between consecutive times, in typical steps of the condition;
+#  - flat: longest run of (nearly) constant values, as a fraction of the trajectory, e.g. tracks imputed over long
+#    gaps or stuck measurements.
+# Each score is converted to a robust z-score across the tracks of the condition and their positive parts are summed.
+# Tracks are ranked by this sum and drawn as small line plots (track in red over the mean curve of the condition in
+# blue, one panel per feature with its own scale like facet_wrap(scales = "free")) on contact sheets, most suspicious
+# first. The lines of all thumbnails of a sheet are rasterized together with markers.segment_pixels. Sheets are
+# rendered in parallel worker processes.
+# The outlier table has the layout written by script_stop_and_watch.R: uniqID and is.outlier ("yes", "no" or "." for
+# not reviewed), one row per track in order of the input table.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, csv, math, warnings
+from multiprocessing import Pool
+import numpy as np
+from preprocessing import to_float
+from markers import segment_pixels
+from montage import Montage, _label_cache
+from encoding import save_image
+
+DEFAULT_FEATURES = ('objNuclei_Intensity_MeanIntensity_imKTR', 'objCytoRing_Intensity_MeanIntensity_imKTR',
+                    'objCells_Intensity_MeanIntensity_imKTR')
+SCORES = ('deviation', 'jump', 'flat')
+NOT_REVIEWED = '.'
+
+# Colors of the thumbnails
+BACKGROUND = (255, 255, 255)
+MEAN_COLOR = (0, 0, 255)
+TRACK_COLOR = (255, 0, 0)
+AXIS_COLOR = (160, 160, 160)
+
+
+def read_trajectories(csvfi, uniq_col='uniqID', time_col='Image_Metadata_T', features=DEFAULT_FEATURES):
+    """Read the trajectories of a condition table into a dense array.
+
+    Args:
+        csvfi (str): Path to the csv file, one row per track and per time.
+        uniq_col (str, optional): Column with unique track IDs. Defaults to 'uniqID'.
+        time_col (str, optional): Name of the time column. Defaults to 'Image_Metadata_T'.
+        features (tuple of str, optional): Columns to review. Defaults to DEFAULT_FEATURES.
+    Returns:
+        A 3-tuple (track IDs in order of first appearance, sorted times (float64), values of shape (tracks, times,
+        features) with NaN where a track has no row or a missing value).
+        Raise ValueError if a column is missing.
+
+    """
+    names = [uniq_col, time_col] + list(features)
+    with open(csvfi, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        missing = [col for col in names if col not in header]
+        if missing:
+            raise ValueError('Column(s) not found in the first line of the csv file: ' + ', '.join(missing) +
+                             '; Found: ' + ', '.join(header))
+        keep = [header.index(col) for col in names]
+        rows = [[row[i] for i in keep] for row in reader if row]
+    columns = list(zip(*rows)) if rows else [[] for _ in names]
+    uid = np.asarray(columns[0], dtype=str)
+    ids, first, track = np.unique(uid, return_index=True, return_inverse=True)
+    # Tracks in order of first appearance, like unique() in R
+    order = np.argsort(first, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    times, time = np.unique(to_float(columns[1]), return_inverse=True)
+    values = np.full((len(ids), len(times), len(features)), np.nan)
+    for k in range(len(features)):
+        values[rank[track.ravel()], time.ravel(), k] = to_float(columns[2 + k])
+    return ids[order].tolist(), times, values
+
+
+# ---------------------------------
+# Scores, for all tracks at once
+
+def _robust_scale(values, axis=None):
+    """1.4826 times the median absolute deviation, ignoring NaN. Zero or undefined scales are replaced by 1."""
+    median = np.nanmedian(values, axis=axis, keepdims=True)
+    scale = 1.4826 * np.nanmedian(np.abs(values - median), axis=axis)
+    return np.where(np.isfinite(scale) & (scale > 0), scale, 1.0)
+
+
+def _longest_run(flags):
+    """Length of the longest run of True along axis 1 of a boolean array."""
+    counts = np.cumsum(flags, axis=1)
+    # Count at the last False before each position, subtracted to restart the runs
+    restart = np.maximum.accumulate(np.where(flags, 0, counts), axis=1)
+    return (counts - restart).max(axis=1) if flags.shape[1] else np.zeros(flags.shape[:1] + flags.shape[2:])
+
+
+def score_trajectories(values, flat_tolerance=0.01, weights=None):
+    """Outlier scores of trajectories, relative to the other trajectories of the condition.
+
+    Args:
+        values (numpy array): Trajectories of shape (tracks, times, features), see read_trajectories.
+        flat_tolerance (float, optional): Steps smaller than this fraction of the typical step of a feature count as
+        flat. Defaults to 0.01.
+        weights (dict, optional): Weight of each of SCORES in the total. Defaults to None, all 1.
+    Returns:
+        A dictionary of arrays of shape (tracks,): the raw scores of SCORES, and 'score', the weighted sum of their
+        positive robust z-scores. Tracks without any value get a NaN score.
+
+    """
+    weights = weights or {}
+    with warnings.catch_warnings():
+        # All-NaN tracks and times are expected, they get NaN scores
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        mean = np.nanmean(values, axis=0)
+        residuals = values - mean
+        z = residuals / _robust_scale(residuals.reshape(-1, values.shape[2]), axis=0)
+        raw = {'deviation': np.sqrt(np.nanmean(z.reshape(len(values), -1) ** 2, axis=1))}
+        steps = np.abs(np.diff(values, axis=1))
+        typical = np.nanmedian(steps.reshape(-1, values.shape[2]), axis=0)
+        typical = np.where(np.isfinite(typical) & (typical > 0), typical, 1.0)
+        if steps.shape[1]:
+            raw['jump'] = np.nanmax((steps / typical).reshape(len(values), -1), axis=1)
+        else:
+            raw['jump'] = np.zeros(len(values))
+        n_steps = np.maximum((~np.isnan(steps)).sum(axis=1), 1)
+        raw['flat'] = np.max(_longest_run(steps <= flat_tolerance * typical) / n_steps, axis=1)
+        raw['flat'][np.isnan(values).all(axis=(1, 2))] = np.nan
+        total = np.zeros(len(values))
+        for name in SCORES:
+            robust = (raw[name] - np.nanmedian(raw[name])) / _robust_scale(raw[name])
+            total += weights.get(name, 1.0) * np.clip(robust, 0, None)
+    raw['score'] = total
+    return raw
+
+
+def rank_tracks(scores):
+    """Indices of the tracks from the most to the least suspicious. Tracks without score come first."""
+    score = np.where(np.isnan(scores['score']), np.inf, scores['score'])
+    return np.argsort(-score, kind='stable')
+
+
+# ---------------------------------
+# Thumbnails
+
+def value_ranges(values, mean=None, percentiles=(1, 99)):
+    """Y range of each feature on the thumbnails, common to all tracks of the condition.
+
+    Args:
+        values (numpy array): Trajectories of shape (tracks, times, features).
+        mean (numpy array, optional): Mean curves of shape (times, features), always inside the range. Defaults to
+        None.
+        percentiles (2-tuple, optional): Percentiles of the values of a feature spanned by its panel, values outside
+        are drawn on the border. Defaults to (1, 99).
+    Returns:
+        A numpy array of shape (features, 2), low and high values.
+
+    """
+    flat = values.reshape(-1, values.shape[2])
+    if np.isnan(flat).all():
+        return np.tile([0.0, 1.0], (values.shape[2], 1))
+    low, high = np.nanpercentile(flat, percentiles, axis=0)
+    if mean is not None and not np.isnan(mean).all():
+        low, high = np.fmin(low, np.nanmin(mean, axis=0)), np.fmax(high, np.nanmax(mean, axis=0))
+    low, high = np.nan_to_num(low), np.nan_to_num(high, nan=1.0)
+    margin = np.where(high > low, 0.05 * (high - low), 0.5)
+    return np.stack([low - margin, high + margin], axis=1)
+
+
+def render_thumbnails(times, values, mean, ranges, panel=(80, 50)):
+    """Line plots of several trajectories, one panel per feature.
+
+    Args:
+        times (numpy array): Times, shape (times,).
+        values (numpy array): Trajectories of shape (tracks, times, features).
+        mean (numpy array): Mean curves of the condition, shape (times, features).
+        ranges (numpy array): Y range of each feature, see value_ranges.
+        panel (2-tuple of int, optional): Width and height of the panel of a feature, in pixels. Defaults to (80, 50).
+    Returns:
+        A uint8 array of shape (tracks, height, features * (width + 1) - 1, 3). Missing values break the lines.
+
+    """
+    n, n_times, n_features = values.shape
+    w, h = panel
+    width = n_features * (w + 1) - 1
+    # All thumbnails side by side on one strip, each line becomes segments in strip coordinates
+    strip = np.empty((h, n * width, 3), dtype=np.uint8)
+    strip[...] = BACKGROUND
+    span = times[-1] - times[0] if n_times > 1 else 1.0
+    x = (times - times[0]) / (span or 1.0) * (w - 1)
+    for k in range(n_features - 1):
+        strip[:, k * (w + 1) + w::width] = AXIS_COLOR
+    low, high = ranges[:, 0], ranges[:, 1]
+    y_track = np.clip((high - values) / (high - low) * (h - 1), 0, h - 1)
+    y_mean = np.clip((high - mean) / (high - low) * (h - 1), 0, h - 1)
+    offsets = np.arange(n)[:, None] * width + np.arange(n_features)[None, :] * (w + 1)
+    for y, color in ((np.broadcast_to(y_mean, values.shape), MEAN_COLOR), (y_track, TRACK_COLOR)):
+        # Points (tracks, times, features, 2) in strip coordinates
+        points = np.stack([np.broadcast_to(x[None, :, None], y.shape) + offsets[:, None, :], y], axis=-1)
+        starts = points[:, :-1].reshape(-1, 2)
+        ends = points[:, 1:].reshape(-1, 2)
+        px, py = segment_pixels(starts, ends)
+        strip[np.clip(py, 0, h - 1), px] = color
+    return strip.reshape(h, n, width, 3).transpose(1, 0, 2, 3)
+
+
+def render_sheet(output, ids, ranks, times, values, mean, ranges, panel=(80, 50), columns=None, gap=4, font=None,
+                 encoding=None):
+    """Write a contact sheet of trajectory thumbnails.
+
+    Args:
+        output (str): Path of the sheet.
+        ids (list of str): Track IDs, captions of the thumbnails with their rank.
+        ranks (list of int): Rank of each track among the tracks of the condition, from 1.
+        times, values, mean, ranges, panel: See render_thumbnails.
+        columns (int, optional): Number of columns of the grid, see montage.Montage. Defaults to None.
+        gap (int, optional): Pixels between thumbnails. Defaults to 4.
+        font (2-tuple, optional): (path, size) of the TrueType font of the captions. Defaults to None, no caption.
+        encoding (dict, optional): Keyword arguments of encoding.save_image. Defaults to None, PNG.
+    Returns:
+        output.
+
+    """
+    thumbs = render_thumbnails(times, values, mean, ranges, panel=panel)
+    labels = _label_cache(font)
+    sheet = Montage(len(ids), thumbs.shape[1:], np.uint8, columns=columns, gap=gap,
+                    caption_height=0 if labels is None else font[1] + 3, background=255)
+    sheet.place(np.arange(len(ids)), thumbs, ['#' + str(rank) + ' ' + uid for rank, uid in zip(ranks, ids)])
+    save_image(sheet.to_image(label_cache=labels, color=(0, 0, 0)), output, **(encoding or {}))
+    return output
+
+
+def _render_sheet_job(job):
+    return render_sheet(**job)
+
+
+def review_condition(csvfi, out_dir, uniq_col='uniqID', time_col='Image_Metadata_T', features=DEFAULT_FEATURES,
+                     per_sheet=100, max_tracks=None, panel=(80, 50), columns=None, font=None, workers=1,
+                     flat_tolerance=0.01, weights=None, encoding=None):
+    """Score the trajectories of a condition table and write ranked contact sheets.
+
+    Args:
+        csvfi (str): Path to the condition table.
+        out_dir (str): Folder of the sheets and of the scores table. Created if it does not exist.
+        uniq_col, time_col, features: See read_trajectories.
+        per_sheet (int, optional): Number of thumbnails per sheet. Defaults to 100.
+        max_tracks (int, optional): Only draw the max_tracks most suspicious tracks. All tracks are scored. Defaults
+        to None, all tracks are drawn.
+        panel, columns, font: See render_sheet.
+        workers (int, optional): Number of processes rendering the sheets. Defaults to 1.
+        flat_tolerance, weights: See score_trajectories.
+        encoding (dict, optional): Encoding of the sheets, keyword arguments of encoding.save_image. Defaults to None.
+    Returns:
+        A 3-tuple (track IDs in order of the table, scores (see score_trajectories), list of the sheets written).
+
+    """
+    ids, times, values = read_trajectories(csvfi, uniq_col=uniq_col, time_col=time_col, features=features)
+    scores = score_trajectories(values, flat_tolerance=flat_tolerance, weights=weights)
+    order = rank_tracks(scores)
+    os.makedirs(out_dir, exist_ok=True)
+    write_scores(os.path.join(out_dir, 'scores.csv'), ids, scores, order, uniq_col=uniq_col)
+    if max_tracks is not None:
+        order = order[:max_tracks]
+    if len(order) == 0:
+        return ids, scores, []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        mean = np.nanmean(values, axis=0)
+    ranges = value_ranges(values, mean)
+    extension = '.' + (encoding or {}).get('frame_format', 'png').replace('jpeg', 'jpg')
+    digits = len(str(int(math.ceil(len(order) / per_sheet))))
+    jobs = []
+    for k, start in enumerate(range(0, len(order), per_sheet)):
+        picks = order[start:start + per_sheet]
+        jobs.append(dict(output=os.path.join(out_dir, 'sheet_' + str(k + 1).zfill(digits) + extension),
+                         ids=[ids[i] for i in picks], ranks=list(range(start + 1, start + len(picks) + 1)),
+                         times=times, values=values[picks], mean=mean, ranges=ranges, panel=panel, columns=columns,
+                         font=font, encoding=encoding))
+    if workers <= 1:
+        sheets = [render_sheet(**job) for job in jobs]
+    else:
+        with Pool(processes=workers) as pool:
+            sheets = pool.map(_render_sheet_job, jobs)
+    return ids, scores, sheets
+
+
+# ---------------------------------
+# Tables
+
+def write_scores(path, ids, scores, order, uniq_col='uniqID'):
+    """Write the scores of the tracks, from the most to the least suspicious, with their rank."""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['rank', uniq_col, 'score'] + list(SCORES))
+        for rank, i in enumerate(order):
+            writer.writerow([rank + 1, ids[i]] + ['%.6g' % scores[name][i] for name in ('score',) + SCORES])
+
+
+def outlier_table(ids, scores=None, threshold=None, outliers=(), not_outliers=()):
+    """Outlier status of each track, as in script_stop_and_watch.R.
+
+    Args:
+        ids (list of str): Track IDs, in order of the table.
+        scores (dict, optional): Output of score_trajectories, required with threshold. Defaults to None.
+        threshold (float, optional): Tracks with a score at least threshold are "yes", the others "no". Defaults to
+        None, tracks are not reviewed (".").
+        outliers, not_outliers (collections of str, optional): Tracks reviewed as outliers ("yes") or not ("no"),
+        override the threshold. Defaults to ().
+    Returns:
+        A list of is.outlier values, one per track.
+        Raise ValueError if a reviewed ID is not a track of the table or is in both collections.
+
+    """
+    unknown = (set(outliers) | set(not_outliers)) - set(ids)
+    if unknown:
+        raise ValueError('Reviewed track(s) not found in the table: ' + ', '.join(sorted(unknown)))
+    both = set(outliers) & set(not_outliers)
+    if both:
+        raise ValueError('Track(s) reviewed both as outlier and not outlier: ' + ', '.join(sorted(both)))
+    if threshold is None:
+        status = [NOT_REVIEWED] * len(ids)
+    else:
+        status = ['yes' if score >= threshold else 'no' for score in np.nan_to_num(scores['score'], nan=np.inf)]
+    reviewed = dict([(uid, 'yes') for uid in outliers] + [(uid, 'no') for uid in not_outliers])
+    return [reviewed.get(uid, value) for uid, value in zip(ids, status)]
+
+
+def write_outlier_table(path, ids, status, uniq_col='uniqID'):
+    """Write the outlier table like script_stop_and_watch.R: columns uniqID and is.outlier, no quotes."""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_NONE, escapechar='\\', lineterminator='\n')
+        writer.writerow([uniq_col, 'is.outlier'])
+        writer.writerows(zip(ids, status))
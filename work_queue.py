@@ -0,0 +1,262 @@
+# Work queue in a shared folder (e.g. on NFS), so that any number of nodes can share a run without a central service.
+#
+# The folder holds:
+#  - queue.json: arguments of the run and list of the task IDs, written by the first worker. Workers started later with
+#    different arguments are refused.
+#  - tasks/<task>.json: description of each task, e.g. a well and a range of frames.
+#  - leases/<task>.<n>.lease: lease number n on a task. A worker claims a task by creating the next lease file with
+#    O_CREAT | O_EXCL, which only one worker can do. The lease is alive while its modification time is less than
+#    lease_seconds old: the owner touches it periodically while it works. The latest lease of a task that expired
+#    belongs to a crashed worker: the task is claimed again by creating lease n + 1.
+#  - done/<task>.json: completion marker, with the worker and the outcome of the task.
+# Ages of the leases are measured with the clock of the file server (modification time of a file touched by the
+# worker), not with the clocks of the nodes.
+# Work with Python 3, not 2!
+
+# ---------------------------------
+
+import os, re, json, time, socket, threading, traceback, uuid
+from contextlib import contextmanager
+
+QUEUE_FILE = 'queue.json'
+
+
+def frame_ranges(n_frames, frames_per_task):
+    """Split n_frames into consecutive ranges of at most frames_per_task frames, as a list of [start, end)."""
+    if frames_per_task < 1:
+        raise ValueError('Number of frames per task must be at least 1.')
+    return [[start, min(start + frames_per_task, n_frames)] for start in range(0, n_frames, frames_per_task)]
+
+
+def task_name(*parts):
+    """ID of a task usable as a file name, from strings and numbers (e.g. a well and a range of frames)."""
+    return '_'.join([re.sub('[^A-Za-z0-9._-]', '-', str(part)) for part in parts])
+
+
+def _write_json(path, obj):
+    """Write a json file atomically, readers never see a partial file."""
+    tmp = path + '.' + uuid.uuid4().hex + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _create_json(path, obj):
+    """Create a json file if it does not exist yet. Return whether this call created it."""
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        json.dump(obj, f, sort_keys=True)
+    return True
+
+
+def _read_json(path):
+    """Content of a json file, None if it is missing or still being written."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class FailedTasks(RuntimeError):
+    """Tasks processed by this worker raised an error, see WorkQueue.run."""
+
+
+class WorkQueue:
+    """Tasks shared by the workers of a run through a folder.
+
+    Args:
+        folder (str): Folder of the queue, shared by all workers. Created if needed.
+        lease_seconds (float, optional): Time after which a task whose worker stopped renewing its lease is claimed
+        again. Leases are renewed every lease_seconds / 4. Defaults to 600.
+        poll_seconds (float, optional): Waiting time between two attempts to claim a task when all remaining tasks
+        are leased by other workers. Defaults to 5.
+        worker_id (str, optional): Name of this worker in leases and completion markers. Defaults to host name and
+        process ID.
+    """
+
+    def __init__(self, folder, lease_seconds=600, poll_seconds=5, worker_id=None):
+        self.folder = folder
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.worker_id = worker_id or socket.gethostname() + '-' + str(os.getpid())
+        for sub in ('tasks', 'leases', 'done', 'clock'):
+            os.makedirs(os.path.join(folder, sub), exist_ok=True)
+        self.task_ids = []
+
+    def _path(self, sub, name):
+        return os.path.join(self.folder, sub, name)
+
+    def publish(self, tasks, params=None):
+        """Register the tasks of the run. Every worker calls it with the same tasks, the first one writes them.
+
+        Args:
+            tasks (list of dict): Tasks, each with a unique 'id' (see task_name) and any json-serializable content.
+            params (dict, optional): Arguments of the run. Defaults to None.
+        Returns:
+            None.
+            Raise ValueError if the queue was created for other tasks or arguments, e.g. by a worker started with
+            other options, or for an earlier run in the same folder.
+
+        """
+        description = {'params': params, 'tasks': [task['id'] for task in tasks]}
+        path = os.path.join(self.folder, QUEUE_FILE)
+        if not _create_json(path, description):
+            existing = None
+            # The first worker may still be writing the file
+            for _ in range(10):
+                existing = _read_json(path)
+                if existing is not None:
+                    break
+                time.sleep(0.1)
+            if existing != json.loads(json.dumps(description, sort_keys=True)):
+                raise ValueError('The queue in ' + self.folder + ' was created with other tasks or arguments. All '
+                                 'workers of a run must use the same arguments; use a new queue folder for a new run.')
+        for task in tasks:
+            task_path = self._path('tasks', task['id'] + '.json')
+            if not os.path.isfile(task_path):
+                _write_json(task_path, task)
+        self.task_ids = description['tasks']
+
+    def server_time(self):
+        """Current time according to the file server, as the modification time of a file touched now."""
+        path = self._path('clock', self.worker_id)
+        with open(path, 'a'):
+            os.utime(path)
+        return os.stat(path).st_mtime
+
+    def _latest_leases(self):
+        """Number of the latest lease of each task, {task ID: n}."""
+        latest = {}
+        for name in os.listdir(os.path.join(self.folder, 'leases')):
+            match = re.match('(.+)\\.([0-9]+)\\.lease$', name)
+            if match:
+                task_id, n = match.group(1), int(match.group(2))
+                latest[task_id] = max(n, latest.get(task_id, 0))
+        return latest
+
+    def is_done(self, task_id):
+        """Whether the completion marker of a task exists."""
+        return os.path.isfile(self._path('done', task_id + '.json'))
+
+    def status(self):
+        """Number of tasks done, leased by a live worker, with an expired lease, and never claimed."""
+        done = set([name[:-len('.json')] for name in os.listdir(os.path.join(self.folder, 'done'))])
+        latest = self._latest_leases()
+        now = self.server_time()
+        counts = {'done': 0, 'leased': 0, 'expired': 0, 'todo': 0}
+        for task_id in self.task_ids:
+            if task_id in done:
+                counts['done'] += 1
+            elif task_id not in latest:
+                counts['todo'] += 1
+            else:
+                try:
+                    age = now - os.stat(self._path('leases', task_id + '.' + str(latest[task_id]) + '.lease')).st_mtime
+                except FileNotFoundError:
+                    age = 0
+                counts['leased' if age <= self.lease_seconds else 'expired'] += 1
+        return counts
+
+    def claim(self):
+        """Claim the first task that is neither done nor leased by a live worker.
+
+        Returns:
+            A 2-tuple (task dict, lease path), or None if no task can be claimed now.
+
+        """
+        done = set([name[:-len('.json')] for name in os.listdir(os.path.join(self.folder, 'done'))])
+        latest = self._latest_leases()
+        now = None
+        for task_id in self.task_ids:
+            if task_id in done:
+                continue
+            n = latest.get(task_id, 0)
+            if n > 0:
+                previous = self._path('leases', task_id + '.' + str(n) + '.lease')
+                now = now or self.server_time()
+                try:
+                    age = now - os.stat(previous).st_mtime
+                except FileNotFoundError:
+                    continue
+                if age <= self.lease_seconds:
+                    continue
+            lease = self._path('leases', task_id + '.' + str(n + 1) + '.lease')
+            if not _create_json(lease, {'worker': self.worker_id}):
+                continue
+            # Completed between the listing and the claim
+            if self.is_done(task_id):
+                continue
+            if n > 0:
+                owner = _read_json(self._path('leases', task_id + '.' + str(n) + '.lease')) or {}
+                print('Claiming again task ' + task_id + ', the lease of worker ' + str(owner.get('worker')) +
+                      ' expired.')
+            return _read_json(self._path('tasks', task_id + '.json')), lease
+        return None
+
+    def owns(self, task_id, lease):
+        """Whether lease is still the latest lease of the task, i.e. no other worker took the task over."""
+        return self._latest_leases().get(task_id, 0) == int(lease.rsplit('.', 2)[1])
+
+    @contextmanager
+    def keep_alive(self, lease):
+        """Renew a lease in a background thread while the enclosed block runs."""
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.lease_seconds / 4):
+                try:
+                    os.utime(lease)
+                except OSError:
+                    return
+
+        thread = threading.Thread(target=renew)
+        thread.daemon = True
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, task_id, result=None):
+        """Write the completion marker of a task, with result (json-serializable) and the worker."""
+        _write_json(self._path('done', task_id + '.json'), {'worker': self.worker_id, 'result': result,
+                                                             'time': self.server_time()})
+
+    def run(self, process):
+        """Claim and process tasks until all tasks of the queue are done.
+
+        Args:
+            process (function): Called with each task dict claimed by this worker, returns a json-serializable result
+            recorded in the completion marker. Exceptions are recorded as the result of the task, which is not
+            retried.
+        Returns:
+            A list of 2-tuples (task ID, result) for the tasks processed by this worker.
+
+        """
+        processed = []
+        while True:
+            claimed = self.claim()
+            if claimed is None:
+                counts = self.status()
+                if counts['done'] == len(self.task_ids):
+                    break
+                # Remaining tasks are leased by other workers, which may still crash
+                time.sleep(self.poll_seconds)
+                continue
+            task, lease = claimed
+            with self.keep_alive(lease):
+                try:
+                    result = process(task)
+                except Exception:
+                    result = {'error': traceback.format_exc()}
+                    print('Task ' + task['id'] + ' failed:\n' + result['error'])
+            if not self.owns(task['id'], lease):
+                print('Lease on task ' + task['id'] + ' expired while it was processed, another worker took it over.')
+            self.complete(task['id'], result)
+            processed.append((task['id'], result))
+        return processed